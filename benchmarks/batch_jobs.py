@@ -0,0 +1,71 @@
+"""Throughput (pares/seg) del camino de job individual vs la tarea batch.
+
+Uso:
+    python -m benchmarks.batch_jobs --properties 20000 --pairs 1000
+
+El camino individual reproduce lo que hace cada POST /job: leer las
+propiedades de la DB en modo inline y calcular un KNN por par.
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+
+from benchmarks.common import populate, use_local_stack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=20000)
+    parser.add_argument("--pairs", type=int, default=500)
+    args = parser.parse_args()
+
+    use_local_stack()
+    populate(args.properties)
+    from recommender_system.celery_config.tasks import (
+        compute_recommendations, compute_recommendations_batch)
+    from recommender_system.recommender_master import build_job_kwargs
+
+    rng = random.Random(11)
+    pairs = [{"user_id": str(i), "property_id": rng.randrange(args.properties)}
+             for i in range(args.pairs)]
+    # el camino individual es lento; se mide sobre una muestra y se extrapola
+    sample = pairs[: max(1, min(len(pairs), 50))]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for pair in sample:
+            compute_recommendations(
+                pair["user_id"], pair["property_id"], **build_job_kwargs("inline"))
+    single_inline = len(sample) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for pair in pairs:
+        compute_recommendations(
+            pair["user_id"], pair["property_id"], **build_job_kwargs("reference"))
+    single_reference = len(pairs) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    compute_recommendations_batch(pairs, **build_job_kwargs("inline"))
+    batch_inline = len(pairs) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    compute_recommendations_batch(pairs, **build_job_kwargs("reference"))
+    batch_reference = len(pairs) / (time.perf_counter() - start)
+
+    print(json.dumps({
+        "properties": args.properties,
+        "pairs": args.pairs,
+        "pairs_per_sec": {
+            "single_inline": single_inline,
+            "single_reference": single_reference,
+            "batch_inline": batch_inline,
+            "batch_reference": batch_reference,
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Filas leídas y latencia: catálogo completo vs candidatos filtrados en SQL.
+
+Uso:
+    python -m benchmarks.candidates --properties 100000 --queries 50
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+
+from benchmarks.common import percentiles, populate, use_local_stack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=30)
+    args = parser.parse_args()
+
+    use_local_stack()
+    populate(args.properties)
+    from recommender_system.candidates import CandidatePolicy, select_candidates
+    from recommender_system.database import SessionLocal
+    from recommender_system.feature_store import load_properties
+    from recommender_system.celery_config.tasks import compute_recommendations, recommend_from_db
+
+    rng = random.Random(5)
+    targets = [rng.randrange(args.properties) for _ in range(args.queries)]
+    policy = CandidatePolicy.from_env()
+
+    full, pushdown, rows_read = [], [], []
+    for property_id in targets:
+        start = time.perf_counter()
+        with SessionLocal() as session:
+            all_properties = load_properties(session)
+        with contextlib.redirect_stdout(io.StringIO()):
+            compute_recommendations(1, property_id, all_properties=all_properties)
+        full.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        recommend_from_db(property_id, policy)
+        pushdown.append((time.perf_counter() - start) * 1000)
+        with SessionLocal() as session:
+            rows_read.append(len(select_candidates(session, property_id, policy)[1]) + 1)
+
+    print(json.dumps({
+        "properties": args.properties,
+        "policy": repr(policy),
+        "full_catalog": {"rows_read": args.properties, **percentiles(full)},
+        "sql_pushdown": {"rows_read_avg": sum(rows_read) / len(rows_read), **percentiles(pushdown)},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Utilidades compartidas por los benchmarks: base temporal, datos sintéticos y reportes."""
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+# (comuna, lat, lon, arriendo mediano en CLP de un 2 dormitorios, peso en el catálogo)
+COMUNAS = [
+    ("Santiago", -33.4489, -70.6693, 450000, 16),
+    ("Providencia", -33.4314, -70.6093, 650000, 10),
+    ("Las Condes", -33.4080, -70.5670, 850000, 10),
+    ("Ñuñoa", -33.4569, -70.5979, 600000, 9),
+    ("Estación Central", -33.4590, -70.6980, 380000, 6),
+    ("San Miguel", -33.4970, -70.6510, 450000, 5),
+    ("La Florida", -33.5227, -70.5983, 420000, 5),
+    ("Vitacura", -33.3900, -70.5740, 1100000, 4),
+    ("Lo Barnechea", -33.3500, -70.5180, 1200000, 3),
+    ("Maipú", -33.5110, -70.7580, 380000, 5),
+    ("Puente Alto", -33.6117, -70.5758, 330000, 4),
+    ("Independencia", -33.4170, -70.6650, 380000, 4),
+    ("Recoleta", -33.4050, -70.6400, 370000, 3),
+    ("La Reina", -33.4450, -70.5400, 750000, 2),
+    ("Macul", -33.4880, -70.5990, 430000, 3),
+    ("Peñalolén", -33.4860, -70.5390, 480000, 2),
+    ("Quilicura", -33.3600, -70.7300, 350000, 2),
+    ("Viña del Mar", -33.0245, -71.5518, 500000, 4),
+    ("Valparaíso", -33.0472, -71.6127, 400000, 2),
+    ("Concepción", -36.8270, -73.0503, 400000, 2),
+]
+# fracción de propiedades por número de dormitorios
+BEDROOMS_WEIGHTS = {1: 30, 2: 38, 3: 22, 4: 8, 5: 2}
+
+
+def use_local_stack():
+    """Apunta DATABASE_URL a un SQLite temporal y Celery al broker en memoria.
+
+    Debe llamarse antes de importar `recommender_system`.
+    """
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/bench.db"
+    os.environ["CELERY_BROKER_URL"] = "memory://"
+    os.environ["CELERY_RESULT_BACKEND"] = "cache+memory://"
+
+
+def synthetic_properties(n: int, seed: int = 7, start: int = 0) -> List[Dict[str, Any]]:
+    """Propiedades con forma de catálogo chileno.
+
+    Se agrupan alrededor del centro de su comuna (las comunas grandes tienen más
+    avisos), y el precio sigue una log-normal centrada en el arriendo típico de
+    la comuna, escalada por el número de dormitorios.
+    """
+    rng = random.Random(seed)
+    comunas = rng.choices(COMUNAS, weights=[c[4] for c in COMUNAS], k=n)
+    bedrooms = rng.choices(list(BEDROOMS_WEIGHTS), weights=list(BEDROOMS_WEIGHTS.values()), k=n)
+    props = []
+    for i, (comuna, lat, lon, median, _), rooms in zip(range(start, start + n), comunas, bedrooms):
+        price = median * (0.55 + 0.225 * rooms) * rng.lognormvariate(0, 0.25)
+        props.append({
+            "external_id": i,
+            "comuna": comuna,
+            "lat": rng.gauss(lat, 0.012),
+            "lon": rng.gauss(lon, 0.012),
+            "bedrooms": rooms,
+            "price": round(price, -3),
+            "raw": {"description": f"Departamento {rooms}D en {comuna}"},
+        })
+    return props
+
+
+def populate(n: int, seed: int = 7, start: int = 0):
+    """Crea el esquema e inserta `n` propiedades sintéticas en una sola versión."""
+    from recommender_system.database import SessionLocal, init_db
+    from recommender_system.feature_store import bump_version
+    from recommender_system.models import Property
+
+    init_db()
+    with SessionLocal() as session:
+        version = bump_version(session)
+        rows = synthetic_properties(n, seed, start)
+        for row in rows:
+            row["version"] = version
+        session.bulk_insert_mappings(Property, rows)
+        session.commit()
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples_ms)
+    return {
+        "p50_ms": statistics.median(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        "max_ms": ordered[-1],
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int = 1) -> Dict[str, float]:
+    """Corre `fn` `repeat` veces: percentiles de latencia, ops/seg y memoria máxima.
+
+    La memoria (tracemalloc) se mide en una pasada extra para no encarecer los tiempos.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ops_per_sec": len(samples) / (sum(samples) / 1000) if sum(samples) else float("inf"),
+        **percentiles(samples),
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(report: Any, output: Optional[str] = None):
+    """Imprime el reporte como JSON y, con `output`, lo guarda junto a metadatos del entorno."""
+    document = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "argv": sys.argv[1:],
+        },
+        "report": report,
+    }
+    text = json.dumps(document, indent=2)
+    print(text)
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            f.write(text + "\n")
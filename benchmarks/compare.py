@@ -0,0 +1,74 @@
+"""Compara dos reportes JSON de benchmarks (por ejemplo, de dos commits).
+
+Recorre ambos reportes, empareja las métricas numéricas por su ruta y muestra
+el cambio relativo. Termina con código 1 si alguna latencia (`*_ms`) o memoria
+(`*_mb`) empeora más que `--threshold`, o si algún `ops_per_sec` cae en esa
+proporción.
+
+Uso:
+    python -m benchmarks.compare antes.json despues.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict
+
+
+def flatten(value: Any, prefix: str = "") -> Dict[str, float]:
+    """Métricas numéricas del reporte como {"ruta.a.la.metrica": valor}.
+
+    Las listas de reportes por tamaño se indexan por `properties` (o `rows`) si lo tienen.
+    """
+    metrics: Dict[str, float] = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            metrics.update(flatten(item, f"{prefix}{key}."))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            label = i
+            if isinstance(item, dict):
+                label = item.get("properties", item.get("rows", i))
+            metrics.update(flatten(item, f"{prefix}{label}."))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        metrics[prefix.rstrip(".")] = float(value)
+    return metrics
+
+
+def regression(name: str, before: float, after: float, threshold: float) -> bool:
+    if before <= 0:
+        return False
+    change = (after - before) / before
+    if name.endswith("_ms") or name.endswith("_mb"):
+        return change > threshold
+    if name.endswith("ops_per_sec") or name.endswith("per_sec"):
+        return change < -threshold
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = flatten(json.load(f).get("report"))
+    with open(args.after) as f:
+        after = flatten(json.load(f).get("report"))
+
+    regressions = []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = (new - old) / old if old else 0.0
+        flag = regression(name, old, new, args.threshold)
+        if flag:
+            regressions.append(name)
+        print(f"{'!' if flag else ' '} {name}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    if regressions:
+        print(f"{len(regressions)} regresiones sobre {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Latencia del re-ranking geográfico: bucle con `haversine` escalar vs versión NumPy.
+
+Uso:
+    python -m benchmarks.haversine --sizes 50 500 10000
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import percentiles, synthetic_properties
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from recommender_system.celery_config.controllers import haversine
+    from recommender_system.ranking import format_recommendations
+
+    report = []
+    for size in args.sizes:
+        props = synthetic_properties(size + 1, seed=size)
+        origen, neighbors = props[0], [(p, random.random()) for p in props[1:]]
+
+        loop, vectorized = [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            ranked = sorted(
+                ((haversine(origen["lat"], origen["lon"], p["lat"], p["lon"]), p)
+                 for p, _ in neighbors), key=lambda item: item[0])[:3]
+            loop.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            format_recommendations(origen, neighbors, k=3, ranking="rerank")
+            vectorized.append((time.perf_counter() - start) * 1000)
+        report.append({
+            "candidates": size,
+            "python_loop": percentiles(loop),
+            "numpy_rerank": percentiles(vectorized),
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Filas/seg al ingerir propiedades: POST /properties/notify por fila vs POST /properties/bulk.
+
+Uso:
+    python -m benchmarks.ingest --rows 20000
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+
+from benchmarks.common import synthetic_properties, use_local_stack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    use_local_stack()
+    from fastapi.testclient import TestClient
+    from recommender_system.recommender_master import app
+
+    client = TestClient(app)
+    rows = synthetic_properties(args.rows)
+    # el camino por fila es lento; se mide sobre una muestra
+    sample = rows[: min(len(rows), 1000)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for row in sample:
+            client.post("/recommender/properties/notify", json=row)
+    per_row = len(sample) / (time.perf_counter() - start)
+
+    body = "\n".join(json.dumps(row) for row in rows)
+    start = time.perf_counter()
+    response = client.post("/recommender/properties/bulk", content=body,
+                           headers={"content-type": "application/x-ndjson"})
+    bulk = args.rows / (time.perf_counter() - start)
+
+    print(json.dumps({
+        "rows": args.rows,
+        "rows_per_sec": {"notify_per_row": per_row, "bulk_ndjson": bulk},
+        "bulk_response": response.json(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
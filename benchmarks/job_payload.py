@@ -0,0 +1,47 @@
+"""Compara tamaño de mensaje y latencia de encolado de `create_job` en ambos modos.
+
+Uso:
+    python -m benchmarks.job_payload --properties 200000 --repeat 20
+
+Crea una base SQLite temporal con propiedades sintéticas y encola contra el
+broker en memoria de Celery, por lo que no necesita Redis ni Postgres.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import percentiles, populate, use_local_stack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    use_local_stack()
+    populate(args.properties)
+
+    # imports tardíos: database.py lee DATABASE_URL al importarse
+    from kombu.serialization import dumps
+    from recommender_system.celery_app import TASK_SERIALIZER
+    from recommender_system.celery_config.tasks import compute_recommendations
+    from recommender_system.recommender_master import build_job_kwargs
+
+    report = {"properties": args.properties, "repeat": args.repeat, "modes": {}}
+    for mode in ("inline", "reference"):
+        timings = []
+        size = 0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            job_kwargs = build_job_kwargs(mode)
+            compute_recommendations.apply_async(args=["1", 0], kwargs=job_kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+            _, _, body = dumps((["1", 0], job_kwargs, {}), serializer=TASK_SERIALIZER)
+            size = len(body)
+        report["modes"][mode] = {"message_bytes": size, **percentiles(timings)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Espera de jobs: polling de GET /job/{id} contra long-poll (/wait) y SSE (/events).
+
+Un hilo hace de worker: termina cada job tras una demora al azar (guarda el
+resultado en el backend y publica el aviso de término como lo hace
+`task_postrun`). Los clientes esperan todos los jobs a la vez y se mide, por
+modo, cuántas lecturas del backend de resultados se hicieron por job y cuánto
+tardó el cliente en ver el término desde que ocurrió.
+
+Uso:
+    python -m benchmarks.job_wait --jobs 500 --poll-interval-ms 250
+"""
+import argparse
+import asyncio
+import logging
+import random
+import threading
+import time
+from uuid import uuid4
+
+from benchmarks.common import percentiles, use_local_stack, write_report
+
+
+async def _poll(client, task_id, interval):
+    while True:
+        job = (await client.get(f"/recommender/job/{task_id}")).json()
+        if job["ready"]:
+            return
+        await asyncio.sleep(interval)
+
+
+async def _wait(client, task_id, timeout):
+    while not (await client.get(f"/recommender/job/{task_id}/wait", params={"timeout": timeout})).json()["ready"]:
+        pass
+
+
+async def _events(client, task_id, timeout):
+    async with client.stream("GET", f"/recommender/job/{task_id}/events", params={"timeout": timeout}) as response:
+        async for line in response.aiter_lines():
+            if line == "event: done":
+                return
+
+
+async def run_mode(mode, args):
+    import httpx
+    from recommender_system import aio, jobs
+    from recommender_system.celery_app import app as celery_app
+    from recommender_system.recommender_master import app
+
+    reads = [0]
+    task_state = aio.task_state
+
+    async def counted(task_id):
+        reads[0] += 1
+        return await task_state(task_id)
+
+    aio.task_state = counted
+    rng = random.Random(args.seed)
+    task_ids = [str(uuid4()) for _ in range(args.jobs)]
+    delays = sorted((rng.uniform(0, args.max_delay_ms / 1000), t) for t in task_ids)
+    finished_at, seen_at = {}, {}
+
+    def worker(start):
+        for delay, task_id in delays:
+            time.sleep(max(0.0, start + delay - time.perf_counter()))
+            celery_app.backend.store_result(task_id, [], "SUCCESS")
+            finished_at[task_id] = time.perf_counter()
+            jobs.notify_done(task_id, "SUCCESS")
+
+    async def client_for(client, task_id):
+        if mode == "poll":
+            await _poll(client, task_id, args.poll_interval_ms / 1000)
+        elif mode == "wait":
+            await _wait(client, task_id, args.timeout)
+        else:
+            await _events(client, task_id, args.timeout)
+        seen_at[task_id] = time.perf_counter()
+
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # primero se conectan los clientes, luego empieza a terminar jobs el worker
+            waiting = [asyncio.create_task(client_for(client, t)) for t in task_ids]
+            await asyncio.sleep(0.2)
+            thread = threading.Thread(target=worker, args=(time.perf_counter(),))
+            thread.start()
+            await asyncio.gather(*waiting)
+            thread.join()
+    finally:
+        aio.task_state = task_state
+    delay_ms = [(seen_at[t] - finished_at[t]) * 1000 for t in task_ids]
+    return {"backend_reads_per_job": reads[0] / args.jobs, "notification_delay_ms": percentiles(delay_ms)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--max-delay-ms", type=float, default=2000)
+    parser.add_argument("--poll-interval-ms", type=float, default=250)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--modes", nargs="+", default=["poll", "wait", "events"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    args = parser.parse_args()
+
+    use_local_stack()
+    logging.disable(logging.INFO)
+    report = {"jobs": args.jobs, "max_delay_ms": args.max_delay_ms,
+              "poll_interval_ms": args.poll_interval_ms, "modes": {}}
+    for mode in args.modes:
+        report["modes"][mode] = asyncio.run(run_mode(mode, args))
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
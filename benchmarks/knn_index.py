@@ -0,0 +1,66 @@
+"""Latencia por tarea: KNN ajustado en cada tarea vs índice KNN persistente.
+
+Uso:
+    python -m benchmarks.knn_index --sizes 1000 10000 100000 --queries 200
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+
+from benchmarks.common import percentiles, populate, use_local_stack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    use_local_stack()
+    from recommender_system.database import SessionLocal
+    from recommender_system.models import Property
+    from recommender_system.celery_config.knn_index import PropertyIndex
+    from recommender_system.celery_config.tasks import compute_recommendations
+
+    report = []
+    populated = 0
+    for size in sorted(args.sizes):
+        populate(size - populated, seed=size, start=populated)
+        with SessionLocal() as session:
+            all_properties = [p.to_dict() for p in session.query(Property).all()]
+        populated = size
+
+        rng = random.Random(size)
+        targets = [rng.randrange(size) for _ in range(args.queries)]
+
+        per_task = []
+        for property_id in targets[: max(1, args.queries // 10)]:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                compute_recommendations(
+                    1, property_id, all_properties=all_properties)
+            per_task.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        index = PropertyIndex()
+        index.refresh()
+        build_ms = (time.perf_counter() - start) * 1000
+        indexed = []
+        for property_id in targets:
+            start = time.perf_counter()
+            index.query(property_id, k=3)
+            indexed.append((time.perf_counter() - start) * 1000)
+
+        report.append({
+            "properties": size,
+            "per_task_fit": percentiles(per_task),
+            "persistent_index": {"build_ms": build_ms, **percentiles(indexed)},
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
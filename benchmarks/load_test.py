@@ -0,0 +1,336 @@
+"""Prueba de carga del par maestro + workers, sin el stack de docker-compose.
+
+El maestro corre en el proceso (app ASGI vía httpx, sin red) y los workers son
+workers Celery reales (`celery.contrib.testing.worker`) con el código de tareas
+de verdad, contra el broker en memoria o un Redis local
+(`--broker redis://localhost:6379/0`). Como en docker-compose.yml hay un pool por
+cola: `--workers` para la interactiva y `--bulk-workers` para la bulk; cada uno
+es un worker `solo` en su hilo, que toma una tarea a la vez como un proceso del
+pool prefork. Con Redis se puede omitir los workers del proceso
+(`--external-workers`) y medir contra workers levantados aparte.
+
+Las llegadas son abiertas (Poisson, `--rate` por segundo durante `--duration`):
+si el sistema se satura las requests no esperan a las anteriores y la cola de
+Celery crece, como en producción. Cada llegada es una operación según `--mix`:
+
+  - create: POST /recommender/job/{user_id}/{property_id}
+  - get:    GET /recommender/job/{task_id} de un job ya creado (un cliente consultando)
+  - notify: POST /recommender/properties/notify con el precio de una propiedad cambiado
+
+El reporte (JSON) trae por operación requests, errores y latencia HTTP; por
+job, throughput, latencia de punta a punta (del POST al aviso de término del
+worker, ver jobs.py), espera en cola y duración de la tarea (sólo con workers
+en el proceso); y la profundidad de cada cola muestreada durante la corrida.
+
+Con un solo núcleo maestro y workers compiten por la CPU: sirve para comparar
+configuraciones (workers, mezcla, tasa) entre sí más que como cifra absoluta.
+
+Uso:
+    python -m benchmarks.load_test --properties 10000 --rate 40 --duration 30 \\
+        --mix create=0.6,get=0.35,notify=0.05 --workers 4 --bulk-workers 1
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict
+
+from benchmarks.common import percentiles, populate, use_local_stack, write_report
+
+OPERATIONS = ("create", "get", "notify")
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """'create=0.6,get=0.4' -> pesos normalizados por operación."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (use {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("mix weights must add up to more than 0")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def _summary(samples_ms):
+    return percentiles(samples_ms) if samples_ms else None
+
+
+class LoadRun:
+    """Estado de una corrida: lo que mandó el generador y lo que reportaron maestro y workers."""
+
+    def __init__(self, args, property_ids):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.property_ids = property_ids
+        self.latency = defaultdict(list)
+        self.status = defaultdict(Counter)
+        # task_id -> time.time() al mandar el POST que lo creó
+        self.submitted: Dict[str, float] = {}
+        self.cached = 0
+        # task_id -> (time.time() del término en el worker, estado); lo llena el hilo de eventos
+        self.done: Dict[str, tuple] = {}
+        self.queue_wait, self.run_time = [], []
+        self._started: Dict[str, float] = {}
+        self.depths = defaultdict(list)
+        self.depth_errors = Counter()
+
+    # --- lado worker (señales y avisos de término, en otros hilos) ---
+
+    def on_job_done(self, message):
+        self.done.setdefault(message["task_id"], (message.get("ts", time.time()), message.get("status")))
+
+    def on_task_start(self, task_id=None, task=None, **kwargs):
+        # como tasks.observe_task_start: el header propio queda en request o en request.headers
+        enqueued_at = getattr(task.request, "enqueued_at", None) or \
+            (getattr(task.request, "headers", None) or {}).get("enqueued_at")
+        if enqueued_at is not None:
+            self.queue_wait.append(max(0.0, time.time() - enqueued_at) * 1000)
+        self._started[task_id] = time.perf_counter()
+
+    def on_task_end(self, task_id=None, **kwargs):
+        started = self._started.pop(task_id, None)
+        if started is not None:
+            self.run_time.append((time.perf_counter() - started) * 1000)
+
+    # --- operaciones HTTP ---
+
+    async def _request(self, client, operation, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except Exception as e:
+            self.status[operation][type(e).__name__] += 1
+            return None
+        self.latency[operation].append((time.perf_counter() - start) * 1000)
+        self.status[operation][response.status_code] += 1
+        return response
+
+    async def create(self, client):
+        user_id = f"u{self.rng.randrange(self.args.users)}"
+        property_id = self.rng.choice(self.property_ids)
+        submitted_at = time.time()
+        response = await self._request(client, "create", "POST",
+                                       f"/recommender/job/{user_id}/{property_id}",
+                                       params={"priority": self.args.priority})
+        if response is None or response.status_code != 200:
+            return
+        job = response.json()
+        if job.get("status") == "SUCCESS":
+            # resuelto desde el caché o los vecinos precalculados: no pasó por la cola
+            self.cached += 1
+        else:
+            self.submitted[job["task_id"]] = submitted_at
+
+    async def get(self, client):
+        if not self.submitted:
+            return await self.create(client)
+        task_id = self.rng.choice(list(self.submitted))
+        await self._request(client, "get", "GET", f"/recommender/job/{task_id}")
+
+    async def notify(self, client):
+        property_id = self.rng.choice(self.property_ids)
+        await self._request(client, "notify", "POST", "/recommender/properties/notify", json={
+            "external_id": property_id, "comuna": None, "lat": None, "lon": None,
+            "bedrooms": None, "price": round(self.rng.uniform(300000, 1200000)),
+        })
+
+    async def sample_depths(self, stop):
+        from recommender_system import aio
+        from recommender_system.celery_app import queue_depths
+
+        while not stop.is_set():
+            try:
+                for queue, depth in (await aio.run_io(queue_depths)).items():
+                    self.depths[queue].append(depth)
+            except Exception as e:
+                self.depth_errors[type(e).__name__] += 1
+            try:
+                await asyncio.wait_for(stop.wait(), self.args.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, timeout):
+        """Espera a que terminen todos los jobs encolados; False si vence `timeout`."""
+        deadline = time.perf_counter() + timeout
+        while any(task_id not in self.done for task_id in self.submitted):
+            if time.perf_counter() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def generate(self, client):
+        """Llegadas Poisson durante `duration`; devuelve la tasa realmente generada."""
+        operations, weights = zip(*self.args.mix.items())
+        pending = set()
+        start = time.perf_counter()
+        next_at, arrivals = start, 0
+        while True:
+            next_at += self.rng.expovariate(self.args.rate)
+            if next_at - start >= self.args.duration:
+                break
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            operation = self.rng.choices(operations, weights)[0]
+            task = asyncio.create_task(getattr(self, operation)(client))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            arrivals += 1
+        loop_time = time.perf_counter() - start
+        await asyncio.gather(*pending)
+        return arrivals / loop_time
+
+    def report(self, achieved_rate, elapsed, drained):
+        requests = {}
+        for operation, statuses in self.status.items():
+            total = sum(statuses.values())
+            errors = sum(n for status, n in statuses.items()
+                         if not isinstance(status, int) or status >= 400)
+            requests[operation] = {
+                "count": total, "errors": errors, "error_rate": errors / total if total else 0.0,
+                "status": {str(status): n for status, n in statuses.items()},
+                "latency": _summary(self.latency[operation]),
+            }
+        finished = {t: self.done[t] for t in self.submitted if t in self.done}
+        failed = sum(1 for _, state in finished.values() if state != "SUCCESS")
+        end_to_end = [(done_at - self.submitted[t]) * 1000 for t, (done_at, _) in finished.items()]
+        throughput = None
+        if finished:
+            first = min(self.submitted.values())
+            throughput = len(finished) / max(1e-9, max(d for d, _ in finished.values()) - first)
+        return {
+            "offered_rate": self.args.rate,
+            "achieved_rate": achieved_rate,
+            "elapsed_s": elapsed,
+            "drained": drained,
+            "requests": requests,
+            "jobs": {
+                "submitted": len(self.submitted),
+                "served_without_queue": self.cached,
+                "completed": len(finished) - failed,
+                "failed": failed,
+                "unfinished": len(self.submitted) - len(finished),
+                "error_rate": (len(self.submitted) - len(finished) + failed) / len(self.submitted)
+                if self.submitted else 0.0,
+                "throughput_per_sec": throughput,
+                "end_to_end": _summary(end_to_end),
+                # sólo con workers en el proceso (se miden con sus señales)
+                "queue_wait": _summary(self.queue_wait),
+                "task_run": _summary(self.run_time),
+            },
+            "queue_depth": {queue: {"max": max(depths), "mean": sum(depths) / len(depths),
+                                    "last": depths[-1]}
+                            for queue, depths in self.depths.items() if depths},
+            "queue_depth_errors": dict(self.depth_errors),
+        }
+
+
+async def run(args, property_ids):
+    import httpx
+    from recommender_system import events, jobs
+    from recommender_system.recommender_master import app
+
+    state = LoadRun(args, property_ids)
+    events.subscribe(jobs.JOBS_CHANNEL, state.on_job_done)
+    if not args.external_workers:
+        from celery.signals import task_postrun, task_prerun
+        task_prerun.connect(state.on_task_start, weak=False)
+        task_postrun.connect(state.on_task_end, weak=False)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(state.sample_depths(stop))
+        start = time.perf_counter()
+        achieved_rate = await state.generate(client)
+        drained = await state.drain(args.drain_timeout)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+    return state.report(achieved_rate, elapsed, drained)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=10000,
+                        help="propiedades sintéticas a insertar (0: usar el catálogo existente)")
+    parser.add_argument("--rate", type=float, default=20, help="llegadas por segundo")
+    parser.add_argument("--duration", type=float, default=30, help="segundos generando carga")
+    parser.add_argument("--mix", type=parse_mix, default="create=0.6,get=0.35,notify=0.05")
+    parser.add_argument("--priority", choices=["high", "normal", "low"], default="high")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=2,
+                        help="workers del proceso en la cola interactiva")
+    parser.add_argument("--bulk-workers", type=int, default=1,
+                        help="workers del proceso en la cola bulk")
+    parser.add_argument("--external-workers", action="store_true",
+                        help="no levantar workers en el proceso (requiere un broker compartido)")
+    parser.add_argument("--broker", help="URL del broker (por defecto memory://)")
+    parser.add_argument("--backend", help="backend de resultados (por defecto el broker, o memoria)")
+    parser.add_argument("--database-url", help="DB del catálogo (por defecto un SQLite temporal)")
+    parser.add_argument("--drain-timeout", type=float, default=60,
+                        help="segundos que se espera a que terminen los jobs encolados")
+    parser.add_argument("--sample-interval", type=float, default=0.5,
+                        help="segundos entre lecturas de la profundidad de las colas")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    args = parser.parse_args()
+    if args.external_workers and not args.broker:
+        parser.error("--external-workers requires --broker (the memory broker is per process)")
+
+    use_local_stack()
+    if args.broker:
+        os.environ["CELERY_BROKER_URL"] = args.broker
+        os.environ["CELERY_RESULT_BACKEND"] = args.backend or args.broker
+    elif args.backend:
+        os.environ["CELERY_RESULT_BACKEND"] = args.backend
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    logging.disable(logging.INFO)
+
+    from sqlalchemy import select
+    from recommender_system.database import SessionLocal, init_db
+    from recommender_system.models import Property
+
+    if args.properties:
+        populate(args.properties, seed=args.seed)
+    else:
+        init_db()
+    with SessionLocal() as session:
+        property_ids = list(session.scalars(select(Property.external_id)))
+    if not property_ids:
+        parser.error("the catalog is empty (use --properties N)")
+
+    if args.external_workers:
+        result = asyncio.run(run(args, property_ids))
+    else:
+        from celery.contrib.testing.worker import start_worker
+        from recommender_system.celery_app import BULK_QUEUE, INTERACTIVE_QUEUE, app as celery_app
+        import recommender_system.celery_config.tasks  # noqa: F401 (registra las tareas)
+
+        if not args.broker:
+            # el transporte en memoria consulta la cola cada 1 s (Redis bloquea en BRPOP):
+            # sin bajarlo la espera en cola mediría el polling del stand-in
+            celery_app.conf.broker_transport_options = {
+                **celery_app.conf.broker_transport_options, "polling_interval": 0.005}
+        pools = [(INTERACTIVE_QUEUE, args.workers), (BULK_QUEUE, args.bulk_workers)]
+        with contextlib.ExitStack() as workers:
+            for queue, count in pools:
+                for i in range(count):
+                    workers.enter_context(start_worker(
+                        celery_app, pool="solo", hostname=f"{queue}-{i}@load",
+                        queues=[queue], perform_ping_check=False,
+                        shutdown_timeout=args.drain_timeout))
+            result = asyncio.run(run(args, property_ids))
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    write_report({"config": config, **result}, args.output)
+
+
+if __name__ == "__main__":
+    main()
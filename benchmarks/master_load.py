@@ -0,0 +1,92 @@
+"""Requests/seg del maestro bajo carga concurrente: POST /job, GET /job/{id} y /heartbeat.
+
+Las requests van directo a la app ASGI (sin red) con `--concurrency` clientes a
+la vez. Mientras corre la ráfaga de POST /job se mide la latencia de /heartbeat,
+para ver si la ráfaga bloquea al resto de las rutas.
+
+Uso:
+    python -m benchmarks.master_load --properties 10000 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+from benchmarks.common import percentiles, populate, use_local_stack
+
+
+async def _burst(client, method, paths, concurrency):
+    """Ejecuta las requests con `concurrency` clientes; devuelve (req/s, latencias, respuestas)."""
+    queue = list(enumerate(paths))
+    latencies, responses = [], [None] * len(paths)
+
+    async def worker():
+        while queue:
+            i, path = queue.pop()
+            start = time.perf_counter()
+            responses[i] = await client.request(method, path)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return len(paths) / (time.perf_counter() - start), latencies, responses
+
+
+async def _heartbeats(client, stop):
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/recommender/heartbeat")
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+async def run(args):
+    import httpx
+    from recommender_system.recommender_master import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        rng = random.Random(1)
+        # usuarios distintos y propiedades al azar: el caché de resultados apenas acierta
+        job_paths = [f"/recommender/job/u{i}/{rng.randrange(args.properties)}"
+                     for i in range(args.requests)]
+        stop = asyncio.Event()
+        heartbeat = asyncio.create_task(_heartbeats(client, stop))
+        create_rps, create_ms, responses = await _burst(
+            client, "POST", job_paths, args.concurrency)
+        stop.set()
+        heartbeat_ms = await heartbeat
+
+        task_ids = [r.json()["task_id"] for r in responses if r.status_code == 200]
+        get_rps, get_ms, _ = await _burst(
+            client, "GET", [f"/recommender/job/{t}" for t in task_ids], args.concurrency)
+
+    return {
+        "properties": args.properties,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "create_job": {"requests_per_sec": create_rps, **percentiles(create_ms)},
+        "get_job": {"requests_per_sec": get_rps, **percentiles(get_ms)},
+        "heartbeat_during_create_burst": percentiles(heartbeat_ms or [0.0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    use_local_stack()
+    populate(args.properties)
+    logging.disable(logging.INFO)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
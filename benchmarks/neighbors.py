@@ -0,0 +1,102 @@
+"""Backends de vecinos: recall@3 contra la búsqueda exacta y latencia por consulta.
+
+Escala (lat, lon, price) igual que el índice de los workers y, para una muestra
+de propiedades del catálogo, compara los 3 vecinos de cada backend con los de
+la fuerza bruta. El backend aproximado ("ivf") se mide con cada valor de
+`--nprobe`: más listas revisadas = más recall y más latencia.
+
+Por defecto usa un catálogo sintético; con `--database` lee el catálogo real de
+`DATABASE_URL`.
+
+Uso:
+    python -m benchmarks.neighbors --properties 100000 --nprobe 1 2 4 8 16
+    DATABASE_URL=postgresql://... python -m benchmarks.neighbors --database
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.common import measure, percentiles, populate, use_local_stack, write_report
+
+K = 3
+
+
+def _recall(expected: np.ndarray, found: np.ndarray, queries: np.ndarray) -> float:
+    """Fracción de los K vecinos exactos (sin la propia consulta) que el backend encontró."""
+    hits = 0
+    for row, query in enumerate(queries):
+        exact = [i for i in expected[row] if i != query][:K]
+        approx = [i for i in found[row] if i != query][:K]
+        hits += len(set(exact) & set(approx))
+    return hits / (K * len(queries))
+
+
+def _evaluate(build, scaled: np.ndarray, queries: np.ndarray, expected: np.ndarray, single: int):
+    start = time.perf_counter()
+    searcher = build()
+    build_ms = (time.perf_counter() - start) * 1000
+    points = scaled[queries]
+    _, found = searcher.query(points, K + 1)
+    # latencia de la ruta interactiva: una propiedad por consulta
+    samples = []
+    for point in points[:single]:
+        start = time.perf_counter()
+        searcher.query(point[None, :], K + 1)
+        samples.append((time.perf_counter() - start) * 1000)
+    batch = measure(lambda: searcher.query(points, K + 1), repeat=3)
+    return {
+        "build_ms": build_ms,
+        "recall_at_3": _recall(expected, found, queries),
+        "query": percentiles(samples),
+        "batch_queries_per_sec": len(points) / (batch["p50_ms"] / 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=100000)
+    parser.add_argument("--database", action="store_true",
+                        help="usar el catálogo de DATABASE_URL en vez de uno sintético")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--single", type=int, default=300,
+                        help="consultas individuales para los percentiles de latencia")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--lists", type=int, default=0, help="listas IVF (0 = raíz de n)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    args = parser.parse_args()
+
+    if not args.database:
+        use_local_stack()
+    from recommender_system.database import SessionLocal
+    from recommender_system.snapshot import load_columns
+    from recommender_system.features import SPEC, FeatureTransform
+    from recommender_system.celery_config.neighbors import (
+        BruteForceSearcher, IVFSearcher, TreeSearcher)
+
+    if not args.database:
+        populate(args.properties)
+    with SessionLocal() as session:
+        columns = load_columns(session)
+    scaled = FeatureTransform.fit(SPEC, columns).encode(columns)
+    rng = np.random.default_rng(args.seed)
+    queries = rng.choice(len(scaled), size=min(args.queries, len(scaled)), replace=False)
+    _, expected = BruteForceSearcher(scaled).query(scaled[queries], K + 1)
+
+    backends = {
+        "brute": lambda: BruteForceSearcher(scaled),
+        "tree": lambda: TreeSearcher(scaled),
+    }
+    for nprobe in args.nprobe:
+        backends[f"ivf(nprobe={nprobe})"] = \
+            lambda nprobe=nprobe: IVFSearcher(scaled, n_lists=args.lists, nprobe=nprobe)
+    report = {"properties": len(scaled), "features": SPEC.key(), "dimensions": scaled.shape[1],
+              "queries": len(queries), "backends": {}}
+    for name, build in backends.items():
+        report["backends"][name] = _evaluate(build, scaled, queries, expected, args.single)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Costo por etapa del pipeline de recomendación a distintos tamaños de catálogo.
+
+Para cada tamaño reporta ops/seg, p50/p95/p99 y memoria máxima de: lectura de la
+DB, serialización del mensaje, escalado, ajuste del KNN, consulta, haversine,
+la tarea completa y los endpoints create_job, notify_property y GET /properties.
+
+Uso:
+    python -m benchmarks.pipeline --sizes 10000 100000 1000000 --output benchmarks/results/pipeline.json
+    python -m benchmarks.compare antes.json despues.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import random
+
+import numpy as np
+
+from benchmarks.common import measure, populate, use_local_stack, write_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="repeticiones de las etapas que recorren todo el catálogo")
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    args = parser.parse_args()
+
+    use_local_stack()
+    from fastapi.testclient import TestClient
+    from kombu.serialization import dumps
+    from sklearn.neighbors import NearestNeighbors
+    from sklearn.preprocessing import StandardScaler
+
+    from recommender_system.celery_app import TASK_SERIALIZER
+    from recommender_system.celery_config.controllers import haversine_np
+    from recommender_system.celery_config.knn_index import build_features
+    from recommender_system.celery_config.tasks import compute_recommendations
+    from recommender_system.database import SessionLocal
+    from recommender_system.feature_store import load_properties
+    from recommender_system.recommender_master import app, build_job_kwargs
+
+    client = TestClient(app)
+    report = []
+    populated = 0
+    for size in sorted(args.sizes):
+        populate(size - populated, seed=size, start=populated)
+        populated = size
+        rng = random.Random(size)
+        targets = [rng.randrange(size) for _ in range(args.queries)]
+        queries = itertools.cycle(targets)
+
+        with SessionLocal() as session:
+            props = load_properties(session)
+        features = build_features(props)
+        scaled = StandardScaler().fit_transform(features)
+        knn = NearestNeighbors(n_neighbors=4).fit(scaled)
+        origen = props[targets[0]]
+        neighbors = props[:3]
+
+        def db_fetch():
+            with SessionLocal() as session:
+                load_properties(session)
+
+        def serialization():
+            dumps((["1", 0], {"all_properties": props}, {}), serializer=TASK_SERIALIZER)
+
+        def query():
+            pos = next(queries)
+            knn.kneighbors(scaled[pos:pos + 1])
+
+        def haversine():
+            haversine_np(origen["lat"], origen["lon"],
+                         np.array([p["lat"] for p in neighbors]),
+                         np.array([p["lon"] for p in neighbors]))
+
+        def task():
+            with contextlib.redirect_stdout(io.StringIO()):
+                compute_recommendations("bench", next(queries))
+
+        def create_job():
+            client.post(f"/recommender/job/bench/{next(queries)}")
+
+        def notify_property():
+            client.post("/recommender/properties/notify",
+                        json={"external_id": next(queries), "price": rng.uniform(3e5, 1e6)})
+
+        def properties_page():
+            client.get("/recommender/properties", params={"limit": 1000})
+
+        def properties_stream():
+            client.get("/recommender/properties", params={"format": "ndjson"})
+
+        # la primera llamada construye el índice del proceso; no se mide como consulta
+        task()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stages = {
+                "db_fetch": measure(db_fetch, args.repeat),
+                "serialization_inline": measure(serialization, args.repeat),
+                "scaling": measure(lambda: StandardScaler().fit_transform(features), args.repeat),
+                "knn_fit": measure(lambda: NearestNeighbors(n_neighbors=4).fit(scaled), args.repeat),
+                "knn_query": measure(query, args.queries),
+                "haversine": measure(haversine, args.queries),
+                "compute_recommendations": measure(task, args.queries),
+                "create_job": measure(create_job, args.queries),
+                "notify_property": measure(notify_property, args.queries),
+                "get_properties_page": measure(properties_page, args.queries),
+                "get_properties_stream": measure(properties_stream, args.repeat),
+            }
+        _, _, body = dumps((["1", 0], build_job_kwargs("inline"), {}), serializer=TASK_SERIALIZER)
+        stages["serialization_inline"]["message_bytes"] = len(body)
+        report.append({"properties": size, "stages": stages})
+        del props, features, scaled, knn
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
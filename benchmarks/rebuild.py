@@ -0,0 +1,45 @@
+"""Reconstrucción completa (snapshot + índice + tabla de vecinos) según el número de procesos.
+
+Para cada valor de `--workers` corre `recommender_system.rebuild.rebuild` sobre
+el mismo catálogo sintético y reporta el tiempo de cada etapa y la aceleración
+de la etapa de vecinos respecto de un solo proceso. Con SQLite las escrituras
+de los procesos se serializan; para medir el escalamiento real usar Postgres
+(`--database-url`).
+
+Uso:
+    python -m benchmarks.rebuild --properties 1000000 --workers 1 2 4 8
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks.common import populate, use_local_stack, write_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=100000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--database-url", help="DB vacía donde cargar el catálogo (por defecto SQLite)")
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    args = parser.parse_args()
+
+    use_local_stack()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    from recommender_system.rebuild import available_cores, rebuild
+
+    populate(args.properties)
+    runs = {}
+    for workers in args.workers:
+        # directorio nuevo por corrida: si no, el snapshot ya exportado se reutiliza
+        runs[workers] = rebuild(workers, snapshot_dir=tempfile.mkdtemp())
+    baseline = runs[args.workers[0]]["neighbors_s"]
+    for run in runs.values():
+        run["neighbors_speedup"] = baseline / run["neighbors_s"]
+    write_report({"properties": args.properties, "cores": available_cores(), "runs": runs},
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Bytes y tiempo de encode/decode de los mensajes de tareas: JSON vs columnar.
+
+Mide dos cuerpos típicos: el mensaje de un job inline (todo el catálogo como
+lista de dicts) y el resultado de un batch (k recomendaciones por par), con el
+serializador JSON, el columnar sin comprimir y el columnar con zlib.
+
+Uso:
+    python -m benchmarks.serialization --properties 100000 --pairs 5000
+"""
+import argparse
+
+from kombu.serialization import dumps, loads
+
+from benchmarks.common import measure, synthetic_properties, write_report
+from recommender_system import serialization
+from recommender_system.feature_store import FEATURE_COLUMNS
+
+
+def _batch_results(properties, pairs: int, k: int = 3):
+    results = []
+    for i in range(pairs):
+        neighbors = [properties[(i * 7 + j) % len(properties)] for j in range(k)]
+        results.append({
+            "user_id": str(i), "property_id": properties[i % len(properties)]["id"],
+            "result": [{"property": p, "distance_km": 0.5 + j, "knn_distance": 0.1 * j}
+                       for j, p in enumerate(neighbors)],
+        })
+    return results
+
+
+def _measure_serializer(body, name, repeat):
+    content_type, content_encoding, data = dumps(body, serializer=name)
+    return {
+        "bytes": len(data),
+        "encode": measure(lambda: dumps(body, serializer=name), repeat),
+        "decode": measure(lambda: loads(data, content_type, content_encoding,
+                                        accept=[content_type]), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=100000)
+    parser.add_argument("--pairs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    args = parser.parse_args()
+
+    serialization.register_serializer()
+    # mismas claves que las filas que lee feature_store.load_properties
+    properties = [{**p, "id": i + 1} for i, p in enumerate(synthetic_properties(args.properties))]
+    properties = [{name: p[name] for name in FEATURE_COLUMNS} for p in properties]
+    bodies = {
+        "inline_job": ([], {"mode": "inline", "all_properties": properties}, {}),
+        "batch_result": {"status": "SUCCESS", "result": _batch_results(properties, args.pairs)},
+    }
+
+    report = {"properties": args.properties, "pairs": args.pairs, "bodies": {}}
+    for label, body in bodies.items():
+        entry = {"json": _measure_serializer(body, "json", args.repeat)}
+        compress_min = serialization.COMPRESS_MIN
+        try:
+            serialization.COMPRESS_MIN = -1
+            entry["columnar"] = _measure_serializer(body, serialization.NAME, args.repeat)
+            serialization.COMPRESS_MIN = 0
+            entry["columnar_zlib"] = _measure_serializer(body, serialization.NAME, args.repeat)
+        finally:
+            serialization.COMPRESS_MIN = compress_min
+        report["bodies"][label] = entry
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Reconstrucción del índice: dicts desde la DB vs columnas desde la DB vs snapshot memory-mapped.
+
+Mide el tiempo de reconstrucción, la latencia de la primera consulta y la memoria
+de Python que queda retenida por el índice (tracemalloc; las páginas del
+snapshot memory-mapped no cuentan porque se comparten entre procesos).
+
+Uso:
+    python -m benchmarks.snapshot --properties 100000
+"""
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import populate, use_local_stack
+
+
+def _measure(build, property_id):
+    start = time.perf_counter()
+    index = build()
+    build_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    index.query(property_id, k=3)
+    first_query_ms = (time.perf_counter() - start) * 1000
+    del index
+
+    # tracemalloc encarece cada asignación: la memoria se mide en una segunda pasada
+    tracemalloc.start()
+    index = build()
+    index.query(property_id, k=3)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"build_ms": build_ms, "first_query_ms": first_query_ms,
+            "retained_mb": retained / 2 ** 20, "peak_mb": peak / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=100000)
+    args = parser.parse_args()
+
+    use_local_stack()
+    from recommender_system.database import SessionLocal
+    from recommender_system.feature_store import load_properties
+    from recommender_system.snapshot import export_snapshot
+    from recommender_system.celery_config.knn_index import PropertyIndex
+
+    populate(args.properties)
+    directory = tempfile.mkdtemp()
+    start = time.perf_counter()
+    with SessionLocal() as session:
+        export_snapshot(session, directory)
+    export_ms = (time.perf_counter() - start) * 1000
+
+    def from_dicts():
+        with SessionLocal() as session:
+            return PropertyIndex.from_properties(load_properties(session))
+
+    def build(snapshot_dir):
+        def run():
+            index = PropertyIndex(snapshot_dir=snapshot_dir)
+            index.rebuild()
+            return index
+        return run
+
+    property_id = args.properties // 2
+    report = {
+        "properties": args.properties,
+        "export_ms": export_ms,
+        "inline_dicts_from_db": _measure(from_dicts, property_id),
+        "columns_from_db": _measure(build(None), property_id),
+        "columns_from_snapshot": _measure(build(directory), property_id),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Arranque en frío: tiempo de importación del maestro y del worker, y colección de tests.
+
+Cada medición corre en un intérprete nuevo (sin módulos cacheados en memoria).
+Para cada módulo reporta el tiempo total de `import` y los paquetes que más
+aportan según `python -X importtime`; para el maestro, además, el tiempo hasta
+responder la primera request (importación + lifespan, que crea el esquema).
+
+Uso:
+    python -m benchmarks.startup --repeat 5 --output benchmarks/results/startup.json
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.common import use_local_stack, write_report
+
+TARGETS = {
+    "master": "recommender_system.recommender_master",
+    "worker": "recommender_system.celery_config.tasks",
+}
+
+FIRST_REQUEST = """
+from fastapi.testclient import TestClient
+from recommender_system.recommender_master import app
+with TestClient(app) as client:
+    assert client.get("/recommender/heartbeat").status_code == 200
+"""
+
+
+def _run(args):
+    start = time.perf_counter()
+    completed = subprocess.run(args, capture_output=True, text=True, env=os.environ.copy())
+    elapsed = (time.perf_counter() - start) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-2000:])
+    return elapsed, completed
+
+
+def _import_profile(module: str, top: int):
+    """Tiempo acumulado del módulo y tiempo propio sumado por paquete de primer nivel."""
+    _, completed = _run([sys.executable, "-X", "importtime", "-c", f"import {module}"])
+    by_package = defaultdict(float)
+    total_us = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue  # encabezado
+        by_package[name.strip().split(".")[0]] += self_us
+        if name.strip() == module:
+            total_us = cumulative_us
+    packages = sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "import_ms": total_us / 1000 if total_us is not None else None,
+        "top_packages_ms": {name: us / 1000 for name, us in packages},
+    }
+
+
+def _median_ms(args, repeat: int) -> float:
+    return statistics.median(_run(args)[0] for _ in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    args = parser.parse_args()
+
+    use_local_stack()
+    report = {}
+    for label, module in TARGETS.items():
+        report[label] = {
+            "process_ms": _median_ms([sys.executable, "-c", f"import {module}"], args.repeat),
+            **_import_profile(module, args.top),
+        }
+    report["master"]["first_request_ms"] = _median_ms(
+        [sys.executable, "-c", FIRST_REQUEST], args.repeat)
+    report["test_collection_ms"] = _median_ms(
+        [sys.executable, "-m", "pytest", "--collect-only", "-q", "-p", "no:cacheprovider"], args.repeat)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Utilidades para las rutas async del maestro.
+
+Lo que sigue siendo bloqueante (publicar en el broker de Celery, el nivel Redis
+del caché de resultados, la DB sin driver async) corre en un pool de hilos
+propio (`RECOMMENDER_IO_THREADS`), separado del threadpool de Starlette: una
+ráfaga de jobs no deja sin hilos al resto de las rutas sync.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from celery import states
+
+from recommender_system.celery_app import app as celery_app
+from recommender_system.database import SessionLocal, get_async_session_factory
+from recommender_system.feature_store import current_version
+
+IO_THREADS = int(os.environ.get("RECOMMENDER_IO_THREADS", "8"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=IO_THREADS, thread_name_prefix="recommender-io")
+_backend_client = None
+
+
+async def run_io(fn, *args, **kwargs):
+    """Ejecuta una llamada bloqueante en el pool de I/O sin bloquear el event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _current_version_sync() -> int:
+    with SessionLocal() as session:
+        return current_version(session)
+
+
+async def current_version_async() -> int:
+    """Versión del catálogo, con el motor async si hay driver y si no en el pool de I/O."""
+    factory = get_async_session_factory()
+    if factory is None:
+        return await run_io(_current_version_sync)
+    async with factory() as session:
+        return await session.run_sync(current_version)
+
+
+def _redis_backend_client():
+    """Cliente `redis.asyncio` del result backend de Celery, o None si no es Redis."""
+    global _backend_client
+    url = celery_app.conf.result_backend or ""
+    if not isinstance(url, str) or not url.startswith(("redis://", "rediss://")):
+        return None
+    if _backend_client is None:
+        import redis.asyncio
+
+        _backend_client = redis.asyncio.Redis.from_url(url)
+    return _backend_client
+
+
+def _task_state_sync(task_id: str) -> Dict[str, Any]:
+    result = celery_app.AsyncResult(task_id)
+    return {"status": result.status, "result": result.result}
+
+
+async def task_state(task_id: str) -> Dict[str, Any]:
+    """`{"ready", "status", "result"}` de una tarea, leyendo el backend Redis sin bloquear."""
+    client = _redis_backend_client()
+    if client is None:
+        state = await run_io(_task_state_sync, task_id)
+    else:
+        backend = celery_app.backend
+        raw = await client.get(backend.get_key_for_task(task_id))
+        meta = backend.decode_result(raw) if raw else {"status": states.PENDING, "result": None}
+        state = {"status": meta["status"], "result": meta.get("result")}
+    if isinstance(state["result"], BaseException):
+        state["result"] = repr(state["result"])
+    elif state["status"] in states.PROPAGATE_STATES and isinstance(state["result"], dict):
+        state["result"] = state["result"].get("exc_message")
+    return {"ready": state["status"] in states.READY_STATES, **state}
@@ -0,0 +1,185 @@
+"""Políticas de selección de candidatos para el recomendador.
+
+Una política restringe qué propiedades pueden recomendarse a partir de la
+propiedad origen (misma comuna, ±N dormitorios, banda de precio, radio en km).
+Se puede evaluar en Python (`matches`) o empujar a la base de datos
+(`sql_filters`), donde aprovecha el índice compuesto (comuna, bedrooms, price)
+y el índice de geohash.
+
+Si quedan menos de `min_candidates` candidatos, `levels()` entrega versiones
+cada vez más amplias de la política: primero sin radio, luego sin banda de
+precio, luego sin restricción de dormitorios y, sólo si `allow_other_comunas`,
+sin comuna.
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from recommender_system import geo
+from recommender_system.celery_config.controllers import haversine
+from recommender_system.feature_store import FEATURE_COLUMNS, feature_columns, load_properties
+from recommender_system.models import Property
+
+
+def _env_optional(name: str, cast):
+    value = os.environ.get(name, "")
+    return cast(value) if value != "" else None
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+class CandidatePolicy:
+    """Criterios de filtrado de candidatos respecto a la propiedad origen."""
+
+    def __init__(self, same_comuna: bool = True, bedrooms_delta: Optional[int] = None,
+                 price_band: Optional[float] = None, min_candidates: int = 3,
+                 allow_other_comunas: bool = False, radius_km: Optional[float] = None):
+        self.same_comuna = same_comuna
+        # diferencia máxima de dormitorios (None = sin restricción)
+        self.bedrooms_delta = bedrooms_delta
+        # fracción de precio aceptada alrededor del origen, ej. 0.2 = ±20% (None = sin restricción)
+        self.price_band = price_band
+        self.min_candidates = min_candidates
+        self.allow_other_comunas = allow_other_comunas
+        # distancia máxima en km a la propiedad origen (None = sin restricción)
+        self.radius_km = radius_km
+
+    @classmethod
+    def from_env(cls) -> "CandidatePolicy":
+        return cls(
+            same_comuna=_env_flag("RECOMMENDER_POLICY_SAME_COMUNA", "true"),
+            bedrooms_delta=_env_optional(
+                "RECOMMENDER_POLICY_BEDROOMS_DELTA", int),
+            price_band=_env_optional("RECOMMENDER_POLICY_PRICE_BAND", float),
+            min_candidates=int(os.environ.get(
+                "RECOMMENDER_POLICY_MIN_CANDIDATES", "3")),
+            allow_other_comunas=_env_flag(
+                "RECOMMENDER_POLICY_ALLOW_OTHER_COMUNAS", "false"),
+            radius_km=_env_optional("RECOMMENDER_POLICY_RADIUS_KM", float),
+        )
+
+    def replace(self, **changes) -> "CandidatePolicy":
+        params = {
+            "same_comuna": self.same_comuna,
+            "bedrooms_delta": self.bedrooms_delta,
+            "price_band": self.price_band,
+            "min_candidates": self.min_candidates,
+            "allow_other_comunas": self.allow_other_comunas,
+            "radius_km": self.radius_km,
+        }
+        params.update(changes)
+        return CandidatePolicy(**params)
+
+    def key(self) -> Tuple:
+        """Identifica la política (útil como parte de una llave de caché)."""
+        return (self.same_comuna, self.bedrooms_delta, self.price_band,
+                self.min_candidates, self.allow_other_comunas, self.radius_km)
+
+    def __eq__(self, other):
+        return isinstance(other, CandidatePolicy) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return (f"CandidatePolicy(same_comuna={self.same_comuna}, bedrooms_delta={self.bedrooms_delta}, "
+                f"price_band={self.price_band}, radius_km={self.radius_km}, min_candidates={self.min_candidates})")
+
+    @property
+    def unrestricted(self) -> bool:
+        return (not self.same_comuna and self.bedrooms_delta is None
+                and self.price_band is None and self.radius_km is None)
+
+    def levels(self) -> List["CandidatePolicy"]:
+        """La política y sus ampliaciones sucesivas, de la más estricta a la más amplia."""
+        levels = [self]
+        if self.radius_km is not None:
+            levels.append(levels[-1].replace(radius_km=None))
+        if self.price_band is not None:
+            levels.append(levels[-1].replace(price_band=None))
+        if self.bedrooms_delta is not None:
+            levels.append(levels[-1].replace(bedrooms_delta=None))
+        if self.same_comuna and self.allow_other_comunas:
+            levels.append(levels[-1].replace(same_comuna=False))
+        return levels
+
+    def _price_range(self, origen: Dict[str, Any]):
+        price = origen.get("price")
+        if self.price_band is None or not price:
+            return None
+        return price * (1 - self.price_band), price * (1 + self.price_band)
+
+    def matches(self, origen: Dict[str, Any], prop: Dict[str, Any]) -> bool:
+        """Indica si `prop` es candidata para `origen` (los datos nulos del origen no restringen)."""
+        if self.same_comuna and prop.get("comuna") != origen.get("comuna"):
+            return False
+        if self.bedrooms_delta is not None and origen.get("bedrooms") is not None:
+            bedrooms = prop.get("bedrooms")
+            if bedrooms is None or abs(bedrooms - origen["bedrooms"]) > self.bedrooms_delta:
+                return False
+        price_range = self._price_range(origen)
+        if price_range is not None:
+            price = prop.get("price")
+            if price is None or not price_range[0] <= price <= price_range[1]:
+                return False
+        if self._has_radius(origen):
+            if prop.get("lat") is None or prop.get("lon") is None:
+                return False
+            if haversine(origen["lat"], origen["lon"], prop["lat"], prop["lon"]) > self.radius_km:
+                return False
+        return True
+
+    def _has_radius(self, origen: Dict[str, Any]) -> bool:
+        return self.radius_km is not None and origen.get("lat") is not None and origen.get("lon") is not None
+
+    def sql_filters(self, origen: Dict[str, Any]) -> list:
+        """Las condiciones de `matches` como expresiones SQLAlchemy (el radio, por celdas de geohash)."""
+        filters = []
+        if self.same_comuna:
+            if origen.get("comuna") is None:
+                filters.append(Property.comuna.is_(None))
+            else:
+                filters.append(Property.comuna == origen["comuna"])
+        if self.bedrooms_delta is not None and origen.get("bedrooms") is not None:
+            filters.append(Property.bedrooms.between(
+                origen["bedrooms"] - self.bedrooms_delta, origen["bedrooms"] + self.bedrooms_delta))
+        price_range = self._price_range(origen)
+        if price_range is not None:
+            filters.append(Property.price.between(*price_range))
+        if self._has_radius(origen):
+            # sólo acota por celdas; el radio exacto lo aplica `matches`
+            prefixes = geo.covering_prefixes(
+                origen["lat"], origen["lon"], self.radius_km)
+            if prefixes:
+                filters.append(geo.prefix_filter(Property.geohash, prefixes))
+        return filters
+
+
+# política configurada por entorno (misma comuna por defecto)
+POLICY = CandidatePolicy.from_env()
+
+
+def select_candidates(session, property_id: int, policy: CandidatePolicy):
+    """Lee desde la DB la propiedad origen y sólo los candidatos que cumplen la política.
+
+    Amplía la política mientras queden menos de `min_candidates` candidatos.
+    Devuelve `(origen, candidatos)`; `origen` es None si la propiedad no existe.
+    """
+    row = session.execute(
+        select(*feature_columns()).where(Property.external_id == property_id)
+    ).first()
+    if row is None:
+        return None, []
+    origen = dict(zip(FEATURE_COLUMNS, row))
+
+    candidates: List[Dict[str, Any]] = []
+    for level in policy.levels():
+        filters = level.sql_filters(origen) + [Property.external_id != property_id]
+        candidates = [p for p in load_properties(session, filters=filters)
+                      if level.matches(origen, p)]
+        if len(candidates) >= level.min_candidates:
+            break
+    return origen, candidates
@@ -1,26 +1,102 @@
 import os
 from celery import Celery
+from celery.signals import setup_logging, worker_process_shutdown
+from kombu import Queue
+
+from recommender_system import logs
+from recommender_system.serialization import NAME as COLUMNAR_SERIALIZER, register_serializer
 
 # Crear la instancia de Celery usando variables de entorno (o valores por defecto)
 BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', BROKER_URL)
 
-app = Celery('recommender_system', broker=BROKER_URL, backend=RESULT_BACKEND)
+# Sólo los workers importan el módulo de tareas (NumPy, scikit-learn, índice KNN);
+# el maestro encola por nombre con `task(...)`.
+TASKS_MODULE = 'recommender_system.celery_config.tasks'
+
+app = Celery('recommender_system', broker=BROKER_URL, backend=RESULT_BACKEND,
+             include=[TASKS_MODULE])
+
+# Serialización de argumentos y resultados: el formato columnar binario
+# (recommender_system/serialization.py) o 'json'. Ambos se aceptan siempre,
+# así un worker puede leer mensajes encolados antes de cambiar la variable.
+register_serializer()
+TASK_SERIALIZER = os.environ.get('RECOMMENDER_TASK_SERIALIZER', COLUMNAR_SERIALIZER)
+
+# Colas: las recomendaciones que un usuario está esperando van a la cola
+# interactiva; los batches, backfills y snapshots a la cola bulk. Cada cola
+# tiene su propio pool de workers (ver docker-compose.yml).
+INTERACTIVE_QUEUE = os.environ.get('RECOMMENDER_INTERACTIVE_QUEUE', 'recommender.interactive')
+BULK_QUEUE = os.environ.get('RECOMMENDER_BULK_QUEUE', 'recommender.bulk')
+
+# Prioridades dentro de una cola (Redis: 0 es la más urgente)
+PRIORITY_STEPS = [0, 3, 6, 9]
+PRIORITY_SEP = ':'
+# prioridad del job -> (cola, prioridad en la cola)
+PRIORITIES = {
+    'high': (INTERACTIVE_QUEUE, 0),
+    'normal': (INTERACTIVE_QUEUE, 3),
+    'low': (BULK_QUEUE, 6),
+}
 
 # configuración mínima coherente con el proyecto
 app.conf.update(
-    accept_content=['json'],
-    task_serializer='json',
-    result_serializer='json',
+    accept_content=[COLUMNAR_SERIALIZER, 'json'],
+    task_serializer=TASK_SERIALIZER,
+    result_serializer=TASK_SERIALIZER,
     timezone='America/Santiago',
+    task_queues=[Queue(INTERACTIVE_QUEUE), Queue(BULK_QUEUE)],
+    task_default_queue=INTERACTIVE_QUEUE,
+    task_routes={
+        'recommender_system.celery_config.tasks.compute_recommendations': {'queue': INTERACTIVE_QUEUE},
+        'recommender_system.celery_config.tasks.compute_recommendations_batch': {'queue': BULK_QUEUE},
+        'recommender_system.celery_config.tasks.rebuild_snapshot': {'queue': BULK_QUEUE},
+        'recommender_system.celery_config.tasks.precompute_neighbors': {'queue': BULK_QUEUE},
+        'recommender_system.celery_config.tasks.check_neighbors': {'queue': BULK_QUEUE},
+    },
+    task_default_priority=3,
+    broker_transport_options={
+        'priority_steps': PRIORITY_STEPS,
+        'sep': PRIORITY_SEP,
+        'queue_order_strategy': 'priority',
+    },
+    # cada pool de workers ajusta cuántas tareas reserva por proceso:
+    # 1 en la cola interactiva (ninguna tarea espera detrás de otra larga),
+    # más en la cola bulk (menos idas y vueltas al broker)
+    worker_prefetch_multiplier=int(os.environ.get('RECOMMENDER_WORKER_PREFETCH', '1')),
 )
 
-# Autodiscover tasks en el paquete de configuración
-try:
-    app.autodiscover_tasks(['recommender_system.celery_config'])
-except Exception:
-    # fallback silencioso si el entorno de importación es diferente en pruebas locales
-    pass
+
+def queue_depths():
+    """Mensajes esperando en cada cola, sumando todos sus niveles de prioridad."""
+    depths = {}
+    with app.connection_for_read() as conn:
+        channel = conn.default_channel
+        for queue in (INTERACTIVE_QUEUE, BULK_QUEUE):
+            try:
+                depths[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+            except Exception:
+                # la cola aún no existe en el broker
+                depths[queue] = 0
+    return depths
+
+
+@setup_logging.connect
+def configure_logging(loglevel=None, **kwargs):
+    """Los workers usan el logging de logs.py (cola no bloqueante, JSON) en vez del de Celery."""
+    logs.setup_logging(loglevel)
+
+
+@worker_process_shutdown.connect
+def flush_logs(**kwargs):
+    # los procesos del pool terminan con os._exit: sin esto se perdería lo que queda en la cola
+    logs.stop_logging()
+
+
+def task(name: str):
+    """Firma de una tarea de `TASKS_MODULE` por nombre, para encolarla sin importar ese módulo."""
+    return app.signature(f'{TASKS_MODULE}.{name}')
+
 
 # Exponer `app` como la variable que el resto del proyecto importa
 # Ej: from recommender_system.celery_app import app
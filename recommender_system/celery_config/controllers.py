@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 
 def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     # Esta función calcula la distancia en km entre dos puntos geográficos usando la fórmula del haversine
@@ -10,3 +12,14 @@ def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * \
         math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
     return 2 * R * math.asin(math.sqrt(a))
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    # Versión vectorizada de `haversine`: acepta escalares o arreglos NumPy (con broadcasting)
+    # y devuelve las distancias en km en un solo cálculo sobre todo el arreglo
+    R = 6371.0
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float))
+                              for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * \
+        np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * R * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
@@ -0,0 +1,581 @@
+"""Índice KNN persistente por proceso worker.
+
+En vez de ajustar un `StandardScaler` y un `NearestNeighbors` nuevos en cada
+tarea, cada proceso worker mantiene la matriz escalada (las features de
+`RECOMMENDER_FEATURES`, ver features.py) y un buscador de vecinos ya ajustado (KD-tree por defecto; ver `neighbors.py` para
+los backends de fuerza bruta y aproximado). Cuando cambia la versión del catálogo se leen sólo las
+filas escritas desde la última versión vista:
+
+  - las filas nuevas o modificadas van a un "delta" que se recorre por fuerza bruta,
+  - la fila anterior de una propiedad modificada se marca como muerta en el árbol,
+  - cuando se acumulan `RECOMMENDER_INDEX_REBUILD_THRESHOLD` cambios se reconstruye todo.
+
+Con el stream de cambios (changes.py) las filas cambiadas llegan por Redis y no
+se consulta la DB; el umbral se resuelve compactando en memoria (`compact`).
+
+Con un backend exacto la búsqueda sigue siendo exacta: se pide al árbol
+k + filas muertas vecinos y se mezcla con el delta.
+
+La escala es una transformación afín fija (`FeatureTransform`) con las
+estadísticas del catálogo al reconstruir; las filas del delta se escalan con
+la misma. Las estadísticas se siguen en streaming con cada cambio (`stats`) y
+la compactación las adopta sólo si se desviaron más de `RECOMMENDER_STATS_DRIFT`.
+
+El catálogo principal se guarda en columnas (`PropertyColumns`) y los dicts de
+propiedad sólo se arman para los vecinos devueltos. Si hay un snapshot en
+`RECOMMENDER_SNAPSHOT_DIR`, la reconstrucción carga memory-mapped (compartidas
+entre procesos) sus columnas y su matriz escalada, y sólo lee de la DB las filas
+escritas después de él. El buscador (nodos del KD-tree, listas IVF) se arma en
+cada proceso, pero sobre esa matriz compartida, sin copiarla.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from recommender_system import changes, features, metrics, snapshot
+from recommender_system.database import SessionLocal
+from recommender_system.features import FeatureSpec, FeatureTransform, NormalizationStats
+from recommender_system.feature_store import count_properties, current_version, load_properties
+from recommender_system.snapshot import PropertyColumns
+from recommender_system.celery_config.neighbors import NEIGHBOR_BACKEND, build_searcher
+
+logger = logging.getLogger(__name__)
+
+# permite volver al cálculo por tarea (feature store + KNN nuevo) si es necesario
+INDEX_ENABLED = os.environ.get(
+    "RECOMMENDER_KNN_INDEX", "true").lower() in ("1", "true", "yes")
+REBUILD_THRESHOLD = int(os.environ.get(
+    "RECOMMENDER_INDEX_REBUILD_THRESHOLD", "1000"))
+# segundos que se espera una versión saltada en el stream de cambios antes de leerla de la DB
+GAP_TIMEOUT = 5.0
+
+# llave de partición para consultar todo el catálogo
+_ALL = object()
+
+
+def build_features(properties: List[Dict[str, Any]], fill: Optional[np.ndarray] = None) -> np.ndarray:
+    """Features numéricas sin escalar (por defecto lat, lon, price); los NULL se
+    reemplazan según `RECOMMENDER_NULL_FEATURES` (ver `PropertyColumns.features`)."""
+    return PropertyColumns.from_properties(properties).features(fill)
+
+
+class PropertyIndex:
+    """Índice KNN sobre las features escaladas de todo el catálogo."""
+
+    def __init__(self, session_factory=SessionLocal, rebuild_threshold: int = REBUILD_THRESHOLD,
+                 snapshot_dir: Optional[str] = snapshot.SNAPSHOT_DIR,
+                 backend: str = NEIGHBOR_BACKEND, spec: FeatureSpec = features.SPEC):
+        self._session_factory = session_factory
+        self.rebuild_threshold = rebuild_threshold
+        self.snapshot_dir = snapshot_dir
+        self.backend = backend
+        self.spec = spec
+        self._lock = threading.RLock()
+        self.version: Optional[int] = None
+        # consumidor del stream de cambios (changes.py); sin él se consulta la DB en cada refresh
+        self.changes: Optional[changes.ChangeConsumer] = None
+        # versiones saltadas por el stream -> momento en que se notó la falta
+        self._missing: Dict[int, float] = {}
+        # external_id -> versión del último cambio aplicado (upsert o borrado) desde la
+        # última reconstrucción, para descartar eventos atrasados; sobrevive a `compact`
+        self._row_versions: Dict[Any, int] = {}
+        # con el stream activo: última comparación con la DB y, si la DB va adelante,
+        # (versión de la DB, momento en que se notó)
+        self._db_checked = 0.0
+        self._db_ahead: Optional[Tuple[int, float]] = None
+        self._reset(PropertyColumns.from_properties([]))
+
+    def _reset(self, columns: PropertyColumns, scaler: Optional[FeatureTransform] = None,
+               stats: Optional[NormalizationStats] = None, scaled: Optional[np.ndarray] = None):
+        """Reemplaza el catálogo principal; sin `scaler` calcula estadísticas exactas de `columns`.
+
+        `scaled` es `columns` ya escalada con `scaler` (la del snapshot), para no recalcularla.
+        """
+        self._main = columns
+        if scaler is None:
+            with metrics.stage("features"):
+                scaler = FeatureTransform.fit(self.spec, columns)
+        # las filas del delta usan la misma escala y reemplazo de NULL que el catálogo principal
+        self._scaler = scaler.with_comunas(columns.comunas)
+        # estadísticas vigentes del catálogo, actualizadas con cada cambio
+        self.stats = stats if stats is not None else scaler.stats.copy()
+        if len(columns):
+            if scaled is not None and scaled.shape == (len(columns), self._scaler.dimensions):
+                self._scaled = scaled
+            else:
+                with metrics.stage("scale"):
+                    self._scaled = self._scaler.encode(columns)
+            with metrics.stage("fit"):
+                self._tree = build_searcher(self._scaled, self.backend)
+        else:
+            self._scaled = np.empty((0, self._scaler.dimensions))
+            self._tree = None
+        self._alive = np.ones(len(columns), dtype=bool)
+        self._dead = 0
+        # external_ids del catálogo principal ordenados, para ubicar filas con searchsorted
+        self._order = np.argsort(columns.external_id, kind="stable")
+        self._sorted_ids = columns.external_id[self._order]
+        self._delta_props: List[Dict[str, Any]] = []
+        self._delta_scaled = np.empty((0, self._scaler.dimensions))
+        # external_id -> posición en el delta
+        self._delta_location: Dict[Any, int] = {}
+        # árboles por comuna, construidos la primera vez que se consultan
+        self._partitions: Dict[Any, Tuple[np.ndarray, Any]] = {}
+
+    @classmethod
+    def from_properties(cls, properties: List[Dict[str, Any]],
+                        scaler: Optional[FeatureTransform] = None) -> "PropertyIndex":
+        """Índice transitorio sobre una lista ya cargada (modo inline, candidatos de SQL).
+
+        Si `properties` no es el catálogo completo (candidatos), `scaler` debe
+        traer las estadísticas globales (`features.sql_transform`): ajustarlas
+        sobre los candidatos cambiaría la escala de una consulta a otra.
+        """
+        index = cls(session_factory=None, snapshot_dir=None,
+                    spec=scaler.spec if scaler is not None else features.SPEC)
+        index._reset(PropertyColumns.from_properties(properties), scaler)
+        return index
+
+    def __len__(self):
+        return len(self._main) - self._dead + len(self._delta_props)
+
+    @property
+    def pending_changes(self) -> int:
+        return self._dead + len(self._delta_props)
+
+    def rebuild(self, session=None):
+        """Relee todo el catálogo (desde el snapshot si está al día) y reajusta escalador y árbol."""
+        with self._lock:
+            if session is None:
+                with self._session_factory() as session:
+                    return self.rebuild(session)
+            version = current_version(session)
+            self._row_versions.clear()
+            if not self._rebuild_from_snapshot(session, version):
+                self._row_versions.clear()
+                self._reset(snapshot.load_columns(session))
+            self.version = version
+            self._missing.clear()
+            self._db_checked, self._db_ahead = time.monotonic(), None
+            logger.info("Índice KNN reconstruido: version=%s, propiedades=%s", version, len(self))
+            raw = self.spec.raw_matrix(self._main)
+            nulls = {name: int(count) for name, count in zip(self.spec.numeric, np.isnan(raw).sum(axis=0)) if count}
+            if nulls:
+                logger.warning(
+                    "Features NULL reemplazadas por %s: %s", snapshot.NULL_FEATURES, nulls)
+
+    def _rebuild_from_snapshot(self, session, version: int) -> bool:
+        columns = snapshot.load_current(self.snapshot_dir)
+        if columns is None or columns.version is None or columns.version > version:
+            return False
+        # las filas posteriores al snapshot salen del stream de cambios si los conserva
+        # todos hasta `version`; si no, de la DB por versión
+        entries = self.changes.entries_since(columns.version) if self.changes is not None else None
+        # la matriz escalada del snapshot, si se escaló con la misma configuración de features
+        prepared = snapshot.load_scaled(self.snapshot_dir, columns.version, self.spec) or (None, None)
+        if entries is not None and max([columns.version] + [e["version"] for e in entries]) == version:
+            self._reset(columns, prepared[0], scaled=prepared[1])
+            self.version = columns.version
+            self.apply_change_events(entries)
+            source = f"{len(entries)} eventos del stream"
+        else:
+            changed = load_properties(session, since_version=columns.version, with_version=True)
+            if len(changed) > self.rebuild_threshold:
+                return False
+            self._reset(columns, prepared[0], scaled=prepared[1])
+            self.apply_changes(changed)
+            source = f"{len(changed)} cambios"
+        # borrados posteriores al snapshot
+        if len(self) != count_properties(session):
+            return False
+        logger.info("Índice KNN cargado desde snapshot v%s + %s", columns.version, source)
+        return True
+
+    def refresh(self):
+        """Aplica los cambios escritos desde la última versión vista."""
+        if self.changes is not None and self.changes.running:
+            # los cambios llegan por el stream: a la DB sólo por versiones que no llegaron
+            self.changes.poll()
+            self.check_db()
+            self.resolve_gaps()
+            return
+        with self._lock, self._session_factory() as session:
+            version = current_version(session)
+            if self.version is None:
+                return self.rebuild(session)
+            if version == self.version:
+                return
+            changed = load_properties(session, since_version=self.version, with_version=True)
+            if self._tree is None or self.pending_changes + len(changed) > self.rebuild_threshold:
+                return self.rebuild(session)
+            self.apply_changes(changed)
+            self.version = version
+            # borrados hechos fuera de la API no avanzan la versión de fila
+            if len(self) != count_properties(session):
+                self.rebuild(session)
+
+    def check_db(self, interval: float = GAP_TIMEOUT):
+        """Con el stream activo, compara cada `interval` segundos la versión y el tamaño con la DB.
+
+        Una versión de la DB más nueva que la del índice es un hueco que ningún
+        evento posterior delata (ej. falló la publicación de la última escritura):
+        se lee de la DB si el stream no la entrega en `GAP_TIMEOUT` segundos. Con
+        la misma versión, otro tamaño indica borrados hechos fuera de la API.
+        """
+        now = time.monotonic()
+        if now - self._db_checked < interval:
+            return
+        self._db_checked = now
+        with self._lock, self._session_factory() as session:
+            version = current_version(session)
+            if version > self.version:
+                noticed = self._db_ahead[1] if self._db_ahead is not None else now
+                self._db_ahead = (version, noticed)
+            elif version == self.version and not self._missing and len(self) != count_properties(session):
+                self.rebuild(session)
+
+    def _stale(self, external_id, version: Optional[int]) -> bool:
+        """Si un cambio de `version` es anterior al último aplicado a `external_id`; si no, lo registra."""
+        if version is None:
+            return False
+        if version < self._row_versions.get(external_id, version):
+            return True
+        self._row_versions[external_id] = version
+        return False
+
+    def _main_position(self, external_id) -> Optional[int]:
+        """Fila viva del catálogo principal para `external_id`, o None."""
+        if external_id is None or not len(self._sorted_ids):
+            return None
+        i = int(np.searchsorted(self._sorted_ids, external_id))
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == external_id:
+            pos = int(self._order[i])
+            return pos if self._alive[pos] else None
+        return None
+
+    def _locate(self, external_id) -> Tuple[Optional[str], Optional[int]]:
+        if external_id in self._delta_location:
+            return "delta", self._delta_location[external_id]
+        pos = self._main_position(external_id)
+        return ("main", pos) if pos is not None else (None, None)
+
+    def _numeric(self, main_positions: List[int], delta_props: List[Dict[str, Any]]) -> np.ndarray:
+        """Features numéricas sin escalar de filas del índice (para las estadísticas)."""
+        return np.vstack([
+            self._scaler.numeric(self._main.select(np.array(main_positions, dtype=np.int64))),
+            self._scaler.numeric(PropertyColumns.from_properties(delta_props)),
+        ])
+
+    def apply_changes(self, properties: List[Dict[str, Any]]):
+        """Inserta o reemplaza propiedades sin reconstruir el árbol.
+
+        Las filas con `"version"` anterior al último cambio aplicado a esa
+        propiedad (un evento atrasado) se ignoran.
+        """
+        with self._lock:
+            properties = [{k: v for k, v in prop.items() if k != "version"} for prop in properties
+                          if not self._stale(prop.get("external_id"), prop.get("version"))]
+            if not properties:
+                return
+            incoming = PropertyColumns.from_properties(properties)
+            numeric = self._scaler.numeric(incoming)
+            scaled = self._scaler.transform(numeric, incoming)
+            replaced_main, replaced_delta = [], []
+            new_rows = []
+            for prop, row in zip(properties, scaled):
+                where, pos = self._locate(prop.get("external_id"))
+                if where == "delta":
+                    replaced_delta.append(self._delta_props[pos])
+                    self._delta_props[pos] = prop
+                    self._delta_scaled[pos] = row
+                    continue
+                if where == "main":
+                    replaced_main.append(pos)
+                    self._alive[pos] = False
+                    self._dead += 1
+                self._delta_location[prop.get("external_id")] = \
+                    len(self._delta_props) + len(new_rows)
+                new_rows.append((prop, row))
+            if new_rows:
+                self._delta_props.extend(p for p, _ in new_rows)
+                self._delta_scaled = np.vstack(
+                    [self._delta_scaled, np.array([r for _, r in new_rows])])
+            self.stats.remove(self._numeric(replaced_main, replaced_delta))
+            self.stats.add(numeric)
+
+    def remove(self, external_ids: List[Any], version: Optional[int] = None):
+        """Quita propiedades borradas del catálogo sin reconstruir el árbol.
+
+        Con `version`, no borra las propiedades con un cambio posterior ya aplicado.
+        """
+        with self._lock:
+            removed = []
+            dropped = set()
+            for external_id in external_ids:
+                if self._stale(external_id, version):
+                    continue
+                where, pos = self._locate(external_id)
+                if where == "main":
+                    removed.append(pos)
+                    self._alive[pos] = False
+                    self._dead += 1
+                elif where == "delta":
+                    dropped.add(pos)
+            self.stats.remove(self._numeric(removed, [self._delta_props[i] for i in sorted(dropped)]))
+            if dropped:
+                keep = [i for i in range(len(self._delta_props)) if i not in dropped]
+                self._delta_props = [self._delta_props[i] for i in keep]
+                self._delta_scaled = self._delta_scaled[keep].reshape(-1, self._scaler.dimensions)
+                self._delta_location = {
+                    prop.get("external_id"): i for i, prop in enumerate(self._delta_props)}
+
+    def compact(self):
+        """Reconstruye el árbol con las filas vivas y el delta, sin leer la DB.
+
+        Mantiene la escala salvo que las estadísticas en streaming se hayan
+        desviado más de `RECOMMENDER_STATS_DRIFT`: entonces adopta esas, sin
+        recorrer el catálogo.
+        """
+        with self._lock:
+            columns = self._main.select(self._alive).extend(
+                PropertyColumns.from_properties(self._delta_props))
+            columns.version = self.version
+            scaler = self._scaler
+            drift = scaler.stats.drift(self.stats)
+            if drift > features.STATS_DRIFT:
+                logger.info(
+                    "Estadísticas de features desviadas %.3f desv. estándar: se actualiza la escala",
+                    drift)
+                scaler = scaler.with_stats(self.stats.copy())
+            self._reset(columns, scaler, self.stats)
+
+    def apply_change_events(self, entries: List[Dict[str, Any]]):
+        """Aplica eventos del stream de cambios (ver changes.py).
+
+        Se ignoran los de versiones ya aplicadas. Si un evento salta versiones,
+        las saltadas quedan pendientes: si no llegan en `GAP_TIMEOUT` segundos,
+        `resolve_gaps` las lee de la DB. Una versión pendiente que llega tarde
+        (maestros publicando fuera de orden) no pisa cambios más nuevos de la
+        misma propiedad.
+        """
+        with self._lock:
+            if self.version is None:
+                return
+            # external_id -> (versión, fila o None si se borró) del cambio más nuevo del lote
+            latest: Dict[Any, Tuple[int, Optional[Dict[str, Any]]]] = {}
+            for entry in entries:
+                version = entry["version"]
+                if version <= self.version and version not in self._missing:
+                    continue
+                self._missing.pop(version, None)
+                if version > self.version + 1:
+                    noticed = time.monotonic()
+                    for skipped in range(self.version + 1, version):
+                        self._missing.setdefault(skipped, noticed)
+                self.version = max(self.version, version)
+                if entry["op"] == "delete":
+                    rows = [(external_id, None) for external_id in entry["ids"]]
+                else:
+                    rows = [(prop["external_id"], prop) for prop in changes.entry_rows(entry)]
+                for external_id, prop in rows:
+                    if external_id not in latest or latest[external_id][0] <= version:
+                        latest[external_id] = (version, prop)
+            deleted: Dict[int, List[Any]] = {}
+            upserts = []
+            for external_id, (version, prop) in latest.items():
+                if prop is None:
+                    deleted.setdefault(version, []).append(external_id)
+                else:
+                    upserts.append(dict(prop, version=version))
+            for version, external_ids in deleted.items():
+                self.remove(external_ids, version)
+            self.apply_changes(upserts)
+            if self.pending_changes > self.rebuild_threshold:
+                self.compact()
+
+    def catch_up(self, since_version: int):
+        """Lee de la DB sólo las filas escritas después de `since_version`."""
+        with self._lock, self._session_factory() as session:
+            version = current_version(session)
+            self.apply_changes(load_properties(session, since_version=since_version, with_version=True))
+            self._missing = {v: noticed for v, noticed in self._missing.items() if v > version}
+            self.version = max(self.version or 0, version)
+            if self._db_ahead is not None and self.version >= self._db_ahead[0]:
+                self._db_ahead = None
+            if self.pending_changes > self.rebuild_threshold:
+                self.compact()
+
+    def resolve_gaps(self, timeout: float = GAP_TIMEOUT):
+        """Lee de la DB las versiones saltadas por el stream (o vistas en la DB por
+        `check_db`) que no llegaron en `timeout` segundos."""
+        with self._lock:
+            now = time.monotonic()
+            expired = [v for v, noticed in self._missing.items() if now - noticed >= timeout]
+            if self._db_ahead is not None:
+                version, noticed = self._db_ahead
+                if self.version >= version:
+                    self._db_ahead = None
+                elif now - noticed >= timeout:
+                    expired.append(self.version + 1)
+        if expired:
+            logger.warning(
+                "Versiones ausentes del stream de cambios: %s, se leen de la DB", len(expired))
+            self.catch_up(min(expired) - 1)
+
+    def get(self, external_id) -> Optional[Dict[str, Any]]:
+        where, pos = self._locate(external_id)
+        if where == "main":
+            return self._main.row(pos)
+        if where == "delta":
+            return self._delta_props[pos]
+        return None
+
+    def external_ids(self) -> List[Any]:
+        """external_id de todas las propiedades vivas del índice."""
+        with self._lock:
+            main = self._main.external_id[self._alive].tolist()
+            return main + [p.get("external_id") for p in self._delta_props]
+
+    def _partition(self, comuna) -> Tuple[np.ndarray, Any]:
+        """Filas del árbol principal (y su árbol) para una comuna o para todo el catálogo."""
+        if comuna is _ALL:
+            return np.arange(len(self._main)), self._tree
+        if comuna not in self._partitions:
+            code = self._main.comuna_code(comuna)
+            rows = np.flatnonzero(self._main.comuna_codes == code) \
+                if code is not None else np.empty(0, dtype=int)
+            tree = build_searcher(self._scaled[rows], self.backend) if len(rows) else None
+            self._partitions[comuna] = (rows, tree)
+        return self._partitions[comuna]
+
+    def query(self, external_id, k: int = 3, policy=None) -> Optional[List[Tuple[Dict[str, Any], float]]]:
+        """Devuelve los k vecinos de `external_id` como `(propiedad, knn_distance)`.
+
+        Devuelve None si la propiedad no está en el índice.
+        """
+        return self.query_many([external_id], k=k, policy=policy).get(external_id)
+
+    def query_many(self, external_ids: List[Any], k: int = 3, policy=None) -> Dict[Any, List[Tuple[Dict[str, Any], float]]]:
+        """Vecinos de varias propiedades con consultas vectorizadas al árbol.
+
+        Con una `CandidatePolicy` sólo se devuelven vecinos que la cumplen: si
+        exige misma comuna se consulta el árbol de esa comuna, y el resto de los
+        criterios se aplica pidiendo más vecinos hasta completar k (búsqueda exacta).
+        Las propiedades que no están en el índice no aparecen en el resultado.
+        """
+        with self._lock:
+            groups: Dict[Any, list] = {}
+            for external_id in dict.fromkeys(external_ids):
+                where, pos = self._locate(external_id)
+                if where is None:
+                    continue
+                if where == "main":
+                    point, origen = self._scaled[pos], self._main.row(pos)
+                else:
+                    point, origen = self._delta_scaled[pos], self._delta_props[pos]
+                key = origen.get("comuna") if policy is not None and policy.same_comuna else _ALL
+                groups.setdefault(key, []).append((external_id, point, origen))
+
+            result = {}
+            for key, members in groups.items():
+                found = self._search_main(key, members, k, policy)
+                if self._delta_props:
+                    points = np.array([point for _, point, _ in members])
+                    distances = np.linalg.norm(
+                        points[:, None, :] - self._delta_scaled[None, :, :], axis=2)
+                    for row, (external_id, _, origen) in enumerate(members):
+                        for dist, prop in zip(distances[row], self._delta_props):
+                            if prop.get("external_id") != external_id and \
+                                    (policy is None or policy.matches(origen, prop)):
+                                found[row].append((dist, prop))
+                for row, (external_id, _, _) in enumerate(members):
+                    found[row].sort(key=lambda item: item[0])
+                    result[external_id] = [(prop, dist) for dist, prop in found[row][:k]]
+            return result
+
+    def scan_many(self, external_ids: List[Any], k: int = 3, policy=None) -> Dict[Any, List[Tuple[Dict[str, Any], float]]]:
+        """Como `query_many`, pero midiendo la distancia a todas las filas (sin árboles).
+
+        Es lento; sirve de referencia para verificar resultados precalculados.
+        """
+        with self._lock:
+            alive = np.flatnonzero(self._alive)
+            points = np.vstack([self._scaled[alive], self._delta_scaled])
+            # MISSING (-1) indexa el None agregado al final
+            names = np.array(list(self._main.comunas) + [None], dtype=object)
+            comunas = np.concatenate([
+                names[self._main.comuna_codes[alive]],
+                np.array([p.get("comuna") for p in self._delta_props], dtype=object)])
+            result = {}
+            for external_id in dict.fromkeys(external_ids):
+                where, pos = self._locate(external_id)
+                if where is None:
+                    continue
+                if where == "main":
+                    point, origen = self._scaled[pos], self._main.row(pos)
+                else:
+                    point, origen = self._delta_scaled[pos], self._delta_props[pos]
+                candidates = np.arange(len(points))
+                if policy is not None and policy.same_comuna:
+                    candidates = np.flatnonzero(comunas == origen.get("comuna"))
+                distances = np.linalg.norm(points[candidates] - point, axis=1)
+                matches = []
+                for i in np.argsort(distances, kind="stable"):
+                    row = candidates[i]
+                    prop = self._main.row(alive[row]) if row < len(alive) \
+                        else self._delta_props[row - len(alive)]
+                    if prop.get("external_id") == external_id:
+                        continue
+                    if policy is None or policy.matches(origen, prop):
+                        matches.append((prop, float(distances[i])))
+                        if len(matches) == k:
+                            break
+                result[external_id] = matches
+            return result
+
+    def _search_main(self, key, members, k: int, policy) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        rows, tree = self._partition(key)
+        found: List[List[Tuple[float, Dict[str, Any]]]] = [[] for _ in members]
+        if tree is None:
+            return found
+        external_ids = self._main.external_id
+        pending = list(range(len(members)))
+        n_query = min(len(rows), k + 1 + self._dead)
+        while pending:
+            points = np.array([members[m][1] for m in pending])
+            distances, indices = tree.query(points, k=n_query)
+            incomplete = []
+            for row, m in enumerate(pending):
+                external_id, _, origen = members[m]
+                matches = []
+                for dist, idx in zip(distances[row], indices[row]):
+                    pos = rows[idx]
+                    # se descartan muertas y el propio origen antes de armar el dict
+                    if not self._alive[pos] or external_ids[pos] == external_id:
+                        continue
+                    prop = self._main.row(pos)
+                    if policy is None or policy.matches(origen, prop):
+                        matches.append((dist, prop))
+                    if policy is None and len(matches) == k:
+                        break
+                found[m] = matches
+                if len(matches) < k and n_query < len(rows):
+                    incomplete.append(m)
+            pending = incomplete
+            n_query = min(len(rows), n_query * 4)
+        return found
+
+
+_index: Optional[PropertyIndex] = None
+
+
+def get_index() -> PropertyIndex:
+    """Índice del proceso actual, creado de forma perezosa."""
+    global _index
+    if _index is None:
+        _index = PropertyIndex()
+    return _index
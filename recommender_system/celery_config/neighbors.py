@@ -0,0 +1,204 @@
+"""Backends de búsqueda de vecinos para el índice KNN.
+
+Todos exponen la interfaz de `KDTree.query` de scikit-learn: `query(points, k)`
+devuelve `(distances, indices)` de forma (len(points), min(k, n)), ordenados de
+menor a mayor distancia. `RECOMMENDER_NEIGHBOR_BACKEND` elige cuál usa el índice:
+
+  - "brute": exacto, distancias a todas las filas con NumPy (por bloques).
+  - "tree":  exacto, KD-tree de scikit-learn (por defecto).
+  - "ivf":   aproximado, cuantización gruesa tipo IVF: k-means en
+    `RECOMMENDER_IVF_LISTS` centroides y búsqueda exacta sólo dentro de las
+    `RECOMMENDER_IVF_NPROBE` listas más cercanas a cada consulta. Más listas
+    revisadas = más recall y más latencia (`benchmarks.neighbors` mide ambos).
+"""
+import os
+from typing import Dict, Optional, Tuple, Type
+
+import numpy as np
+
+NEIGHBOR_BACKEND = os.environ.get("RECOMMENDER_NEIGHBOR_BACKEND", "tree")
+# 0 = raíz cuadrada del número de filas
+IVF_LISTS = int(os.environ.get("RECOMMENDER_IVF_LISTS", "0"))
+IVF_NPROBE = int(os.environ.get("RECOMMENDER_IVF_NPROBE", "8"))
+IVF_ITERATIONS = 10
+# elementos de la matriz de distancias que se calculan de una vez (fuerza bruta)
+_BLOCK_ELEMENTS = 4_000_000
+
+
+class BruteForceSearcher:
+    name = "brute"
+
+    def __init__(self, points: np.ndarray):
+        self._points = np.ascontiguousarray(points, dtype=float)
+        self._norms = np.einsum("ij,ij->i", self._points, self._points)
+
+    def __len__(self):
+        return len(self._points)
+
+    def query(self, points: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        n = len(self._points)
+        k = min(k, n)
+        distances = np.empty((len(points), k))
+        indices = np.empty((len(points), k), dtype=np.intp)
+        block = max(1, _BLOCK_ELEMENTS // max(n, 1))
+        for start in range(0, len(points), block):
+            chunk = points[start:start + block]
+            # |a - b|² = |a|² + |b|² - 2ab, en una sola multiplicación de matrices
+            squared = self._norms[None, :] - 2 * chunk @ self._points.T
+            squared += np.einsum("ij,ij->i", chunk, chunk)[:, None]
+            np.maximum(squared, 0, out=squared)
+            if k < n:
+                candidates = np.argpartition(squared, k - 1, axis=1)[:, :k]
+            else:
+                candidates = np.broadcast_to(np.arange(n), squared.shape)
+            # la expansión pierde precisión en distancias chicas: las k elegidas se
+            # recalculan directamente antes de ordenarlas
+            nearest = np.linalg.norm(self._points[candidates] - chunk[:, None, :], axis=2)
+            order = np.argsort(nearest, axis=1, kind="stable")
+            indices[start:start + block] = np.take_along_axis(candidates, order, axis=1)
+            distances[start:start + block] = np.take_along_axis(nearest, order, axis=1)
+        return distances, indices
+
+
+class TreeSearcher:
+    name = "tree"
+
+    def __init__(self, points: np.ndarray):
+        # import diferido: scikit-learn (y SciPy) tarda ~1 s en importarse y sólo
+        # lo necesitan los procesos que construyen un índice
+        from sklearn.neighbors import KDTree
+        self._tree = KDTree(points)
+        self._n = len(points)
+
+    def __len__(self):
+        return self._n
+
+    def query(self, points: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self._tree.query(np.atleast_2d(points), k=min(k, self._n))
+
+
+class IVFSearcher:
+    """Búsqueda aproximada: sólo se revisan las filas de las listas más cercanas."""
+    name = "ivf"
+
+    def __init__(self, points: np.ndarray, n_lists: int = IVF_LISTS, nprobe: int = IVF_NPROBE,
+                 iterations: int = IVF_ITERATIONS, seed: int = 0):
+        self._points = np.ascontiguousarray(points, dtype=float)
+        n = len(self._points)
+        n_lists = max(1, min(n_lists or int(round(np.sqrt(n))), n))
+        self.nprobe = nprobe
+        rng = np.random.default_rng(seed)
+        # k-means (Lloyd) entrenado sobre una muestra
+        sample = self._points[rng.choice(n, size=min(n, n_lists * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            _, assigned = BruteForceSearcher(centroids).query(sample, 1)
+            assigned = assigned[:, 0]
+            counts = np.bincount(assigned, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self._centroids = BruteForceSearcher(centroids)
+        _, assigned = self._centroids.query(self._points, 1)
+        assigned = assigned[:, 0]
+        # filas agrupadas por lista: la lista l son _order[_offsets[l]:_offsets[l + 1]]
+        self._order = np.argsort(assigned, kind="stable")
+        self._offsets = np.searchsorted(assigned[self._order], np.arange(n_lists + 1))
+        self._sizes = np.diff(self._offsets)
+        self._norms = np.einsum("ij,ij->i", self._points, self._points)
+
+    def __len__(self):
+        return len(self._points)
+
+    def query(self, points: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        k = min(k, len(self._points))
+        if not len(points) or not k:
+            return np.empty((len(points), k)), np.empty((len(points), k), dtype=np.intp)
+        n_lists = len(self._sizes)
+        # todas las listas ordenadas por cercanía: se revisan más de nprobe si no alcanzan k filas
+        _, ranked = self._centroids.query(points, n_lists)
+        enough = (np.cumsum(self._sizes[ranked], axis=1) < k).sum(axis=1) + 1
+        probes = np.minimum(np.maximum(self.nprobe, enough), n_lists)
+        width = int(probes.max())
+        if len(points) * width < 2 * n_lists:
+            # pocas consultas (ej. una suelta): casi cada lista la revisaría una sola,
+            # conviene reunir los candidatos de cada consulta
+            return self._query_each(points, ranked, probes, k)
+        candidates = self._candidates_by_list(points, ranked, probes, width, k)
+        # distancias finales recalculadas directamente (la expansión pierde precisión)
+        nearest = np.linalg.norm(self._points[candidates] - points[:, None, :], axis=2)
+        order = np.argsort(nearest, axis=1, kind="stable")
+        return np.take_along_axis(nearest, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+    def _query_each(self, points, ranked, probes, k) -> Tuple[np.ndarray, np.ndarray]:
+        distances = np.empty((len(points), k))
+        indices = np.empty((len(points), k), dtype=np.intp)
+        for row, point in enumerate(points):
+            candidates = np.concatenate(
+                [self._order[self._offsets[l]:self._offsets[l + 1]] for l in ranked[row, :probes[row]]])
+            diff = self._points[candidates] - point
+            squared = np.einsum("ij,ij->i", diff, diff)
+            nearest = np.argpartition(squared, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            nearest = nearest[np.argsort(squared[nearest], kind="stable")]
+            indices[row] = candidates[nearest]
+            distances[row] = np.sqrt(squared[nearest])
+        return distances, indices
+
+    def _candidates_by_list(self, points, ranked, probes, width, k) -> np.ndarray:
+        """Las k filas más cercanas a cada consulta, recorriendo cada lista una sola vez
+        con todas las consultas que la revisan (una multiplicación de matrices por lista)."""
+        # pares (consulta, posición de la lista en su ranking) agrupados por lista
+        rows, slots = np.nonzero(np.arange(width)[None, :] < probes[:, None])
+        lists = ranked[rows, slots]
+        grouped = np.argsort(lists, kind="stable")
+        rows, slots, lists = rows[grouped], slots[grouped], lists[grouped]
+        bounds = np.flatnonzero(np.diff(lists)) + 1
+        # las k mejores filas de cada (consulta, lista revisada); inf si la lista tiene menos de k
+        best = np.full((len(points), width, k), np.inf)
+        best_ids = np.zeros((len(points), width, k), dtype=np.intp)
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(lists)]):
+            l = lists[start]
+            members = self._order[self._offsets[l]:self._offsets[l + 1]]
+            if not len(members):
+                continue
+            queries, places = rows[start:end], slots[start:end]
+            chunk = points[queries]
+            # |a - b|² = |a|² + |b|² - 2ab, como en la fuerza bruta
+            squared = self._norms[members][None, :] - 2 * chunk @ self._points[members].T
+            squared += np.einsum("ij,ij->i", chunk, chunk)[:, None]
+            taken = min(k, len(members))
+            if taken < len(members):
+                nearest = np.argpartition(squared, taken - 1, axis=1)[:, :taken]
+            else:
+                nearest = np.broadcast_to(np.arange(len(members)), squared.shape)
+            best[queries, places, :taken] = np.take_along_axis(squared, nearest, axis=1)
+            best_ids[queries, places, :taken] = members[nearest]
+        best, best_ids = best.reshape(len(points), -1), best_ids.reshape(len(points), -1)
+        return np.take_along_axis(best_ids, np.argpartition(best, k - 1, axis=1)[:, :k], axis=1)
+
+
+BACKENDS: Dict[str, Type] = {
+    BruteForceSearcher.name: BruteForceSearcher,
+    TreeSearcher.name: TreeSearcher,
+    IVFSearcher.name: IVFSearcher,
+}
+
+
+def backend_key(backend: Optional[str] = None) -> str:
+    """Identifica los resultados de `backend` (parte de las llaves de caché): los
+    exactos dan los mismos vecinos y comparten llave; el aproximado depende de sus parámetros."""
+    backend = NEIGHBOR_BACKEND if backend is None else backend
+    if backend == IVFSearcher.name:
+        return f"ivf:{IVF_LISTS}:{IVF_NPROBE}"
+    return "exact"
+
+
+def build_searcher(points: np.ndarray, backend: str = NEIGHBOR_BACKEND, **options):
+    """Buscador del backend `backend` sobre `points` (matriz (n, d) ya escalada)."""
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Backend de vecinos desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+    return BACKENDS[backend](points, **options)
@@ -1,96 +1,386 @@
 # celery
 from recommender_system.celery_app import app
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_process_init
 
 # standard
 import logging
-from typing import List, Dict, Any, Optional
-import numpy as np
-from sklearn.neighbors import NearestNeighbors
-from sklearn.preprocessing import StandardScaler
+import multiprocessing
+import os
+import random
+import socket
+import time
+from typing import List, Dict, Any, Optional, Set
 
-from recommender_system.celery_config.controllers import haversine
+from recommender_system import changes, events, jobs, logs, metrics, precompute, snapshot
+from recommender_system.candidates import POLICY, CandidatePolicy, select_candidates
+from recommender_system.celery_config.knn_index import INDEX_ENABLED, PropertyIndex, get_index
+from recommender_system.database import SessionLocal
+from recommender_system.feature_store import current_version, feature_store, global_transform
+from recommender_system.ranking import RANKING, RERANK_CANDIDATES, format_recommendations
+from recommender_system.recommendation_store import save_recommendations
+from recommender_system.result_cache import result_cache
 
 logger = logging.getLogger(__name__)
 
+# candidatos ya filtrados en SQL: no se vuelve a aplicar la política
+UNRESTRICTED = CandidatePolicy(same_comuna=False)
 
-@app.task(bind=False)
-def compute_recommendations(user_id: int, property_id: int, job_id: Optional[int] = None, all_properties: Optional[List[Dict[str, Any]]] = None):
+
+@worker_process_init.connect
+def load_knn_index(**kwargs):
+    """Carga el índice KNN una vez al iniciar cada proceso worker.
+
+    Con Redis, después lo mantiene al día el stream de cambios (ver changes.py)
+    en vez de consultar la DB en cada tarea.
+    """
+    if not INDEX_ENABLED:
+        return
+    try:
+        index = get_index()
+        stream = changes.shared_stream() if changes.CHANGES_ENABLED else None
+        if stream is not None:
+            index.changes = changes.ChangeConsumer(index, stream)
+        index.rebuild()
+        if index.changes is not None:
+            index.changes.start()
+    except Exception as e:
+        # se construirá de forma perezosa en la primera tarea
+        logger.warning("No se pudo cargar el índice KNN al iniciar: %s", e)
+
+
+@worker_process_init.connect
+def start_metrics_collector(**kwargs):
+    """Publica las métricas de este proceso worker para GET /recommender/metrics."""
+    try:
+        key = f"{metrics.REMOTE_PREFIX}{socket.gethostname()}:{os.getpid()}"
+        metrics.start_collector(events.get_client(), key)
+    except Exception as e:
+        logger.warning("No se pudo iniciar el colector de métricas: %s", e)
+
+
+@before_task_publish.connect
+def mark_enqueued_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+_task_started: Dict[str, float] = {}
+
+
+@task_prerun.connect
+def observe_task_start(task_id=None, task=None, kwargs=None, **extra):
+    # según la versión de Celery los headers propios quedan en request o en request.headers
+    enqueued_at = getattr(task.request, "enqueued_at", None) or \
+        (getattr(task.request, "headers", None) or {}).get("enqueued_at")
+    if enqueued_at is not None:
+        queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+        metrics.QUEUE_WAIT.labels(task.name, queue).observe(
+            max(0.0, time.time() - enqueued_at))
+    inline = (kwargs or {}).get("all_properties")
+    if inline:
+        metrics.TASK_PAYLOAD_ITEMS.labels(task.name).inc(len(inline))
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_end(task_id=None, task=None, state=None, **extra):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        metrics.TASK_LATENCY.labels(task.name, state or "UNKNOWN").observe(
+            time.perf_counter() - started)
+    # task_postrun llega después de guardar el resultado: quien espera ya puede leerlo
+    if task is not None and task.name.rsplit(".", 1)[-1] in jobs.NOTIFIED_TASKS:
+        jobs.notify_done(task_id, state or "UNKNOWN")
+
+
+def store_results(entries, task_id: Optional[str] = None):
+    """Guarda los resultados en la tabla de recomendaciones sin hacer fallar la tarea."""
+    try:
+        with metrics.stage("store"):
+            save_recommendations(entries, task_id=task_id)
+    except Exception as e:
+        logger.error("Error al guardar recomendaciones: %s", e)
+
+
+def neighbors_with_policy(index: PropertyIndex, property_ids: List[int], policy: CandidatePolicy, k: int = 3):
+    """Consulta el índice ampliando la política para los orígenes con muy pocos vecinos."""
+    pending = list(dict.fromkeys(property_ids))
+    neighbors = {}
+    for level in policy.levels():
+        found = index.query_many(
+            pending, k=k, policy=None if level.unrestricted else level)
+        neighbors.update(found)
+        pending = [pid for pid, items in found.items()
+                   if len(items) < min(k, level.min_candidates)]
+        if not pending:
+            break
+    return neighbors
+
+
+def recommend(index: PropertyIndex, property_ids: List[int], policy: CandidatePolicy = POLICY, k: int = 3) -> Dict[int, Any]:
+    """Resultado (lista o mensaje de error) por cada propiedad origen."""
+    if not len(index):
+        return {pid: "error: no properties provided" for pid in property_ids}
+    # en modo "rerank" el KNN sólo preselecciona; se piden más vecinos
+    n_fetch = max(k, RERANK_CANDIDATES) if RANKING == "rerank" else k
+    with metrics.stage("query"):
+        neighbors = neighbors_with_policy(index, property_ids, policy, n_fetch)
+    with metrics.stage("rank"):
+        return {
+            pid: format_recommendations(index.get(pid), neighbors[pid], k)
+            if pid in neighbors else "error: property not found"
+            for pid in property_ids
+        }
+
+
+def recommend_from_db(property_id: int, policy: CandidatePolicy = POLICY):
+    """Lee de la DB sólo los candidatos de la política y calcula el KNN sobre ellos.
+
+    La escala usa las estadísticas de todo el catálogo, no las de los candidatos.
+    """
+    with metrics.stage("fetch"), SessionLocal() as session:
+        origen, candidates = select_candidates(session, property_id, policy)
+        scaler = global_transform(session) if origen is not None else None
+    if origen is None:
+        return "error: property not found"
+    index = PropertyIndex.from_properties([origen] + candidates, scaler)
+    return recommend(index, [property_id], UNRESTRICTED)[property_id]
+
+
+# acks_late: si el worker muere la tarea (corta e idempotente) vuelve a la cola
+@app.task(bind=False, acks_late=True, reject_on_worker_lost=True)
+def compute_recommendations(user_id: int, property_id: int, job_id: Optional[int] = None, all_properties: Optional[List[Dict[str, Any]]] = None, dataset_version: Optional[int] = None):
     """
     Tarea Celery que calcula hasta 3 recomendaciones usando KNN con la lista `all_properties` proporcionada.
 
+    Si no se entrega `all_properties` (modo por referencia), se consulta el índice
+    KNN persistente del worker; si está deshabilitado, se leen de la DB sólo los
+    candidatos que cumplen la política.
+
     Reglas:
-      - Filtrar propiedades en la misma comuna que la propiedad origen
-      - Usar KNN para encontrar las 3 más similares basadas en lat, lon, price
+      - Filtrar propiedades en la misma comuna que la propiedad origen (ver `CandidatePolicy`)
+      - Usar KNN para encontrar las 3 más similares según las features de
+        `RECOMMENDER_FEATURES` (por defecto lat, lon, price; ver features.py)
+
+    En modo por referencia el resultado se guarda en el caché de resultados
+    (ver `result_cache`) bajo la versión del catálogo con que se calculó.
 
     Devuelve una lista con hasta 3 elementos: cada uno es un dict {"property": <prop>, "distance_km": <km>, "knn_distance": <dist>}.
     """
-    if not all_properties:
-        return "error: no properties provided"
+    if all_properties is not None:
+        index = PropertyIndex.from_properties(all_properties)
+        result = recommend(index, [property_id])[property_id]
+    else:
+        result = result_cache.get(property_id, POLICY, dataset_version, RANKING)
+        if result is None:
+            start = time.perf_counter()
+            if INDEX_ENABLED:
+                index = get_index()
+                with metrics.stage("fetch"):
+                    index.refresh()
+                result = recommend(index, [property_id])[property_id]
+                version = index.version
+            else:
+                result = recommend_from_db(property_id)
+                version = dataset_version
+            result_cache.set(property_id, POLICY, version, RANKING, result,
+                             time.perf_counter() - start)
 
-    # buscar propiedad origen en la lista
-    origen = next(
-        (p for p in all_properties if p.get("external_id") == property_id), None)
-    if not origen:
-        return "error: property not found"
-
-    origen_price = origen.get("price")
-    origen_comuna = origen.get("comuna")
-    candidates = []
-    for p in all_properties:
-        if (p.get("external_id") != origen.get("external_id")):
-            candidates.append(p)
-
-    if not candidates:
-        return []
-
-    # preparar datos para KNN
-    # características: lat, lon, price
-    features = []
-    for p in candidates:
-        lat = p.get("lat") or 0
-        lon = p.get("lon") or 0
-        price = p.get("price") or 0
-        features.append([lat, lon, price])
-
-    # incluir la propiedad origen para calcular distancias
-    origen_lat = origen.get("lat") or 0
-    origen_lon = origen.get("lon") or 0
-    origen_price = origen.get("price") or 0
-    origen_features = [[origen_lat, origen_lon, origen_price]]
-    all_features = origen_features + features
-
-    # convertir a numpy array
-    all_features = np.array(all_features)
-
-    # normalizar características
-    scaler = StandardScaler()
-    scaled_features = scaler.fit_transform(all_features)
-
-    # usar KNN para encontrar los 3 más cercanos a la propiedad origen
-    knn = NearestNeighbors(n_neighbors=min(
-        4, len(candidates) + 1), algorithm='auto')  # +1 porque incluye origen
-    knn.fit(scaled_features)
-    distances, indices = knn.kneighbors(
-        scaled_features[0:1])  # solo para origen
-
-    # obtener los candidatos más cercanos (excluyendo el origen mismo)
-    recommended_indices = indices[0][1:]  # saltar el primero que es el origen
-    recommended_distances = distances[0][1:]
-
-    # calcular distancia geográfica real para cada recomendación
-    result = []
-    for idx, dist in zip(recommended_indices, recommended_distances):
-        # porque indices empiezan desde 1 (origen es 0)
-        prop = candidates[idx - 1]
-        # calcular distancia real usando haversine
-        real_dist = haversine(
-            origen_lat, origen_lon, prop["lat"], prop["lon"])
-        result.append({
-            "property": prop,
-            "distance_km": real_dist,
-            "knn_distance": dist
-        })
-
-    print(
-        f"Recomendaciones para user_id={user_id}, property_id={property_id}: {result}")
+    logger.debug("Recomendaciones para user_id=%s, property_id=%s: %s",
+                 user_id, property_id, logs.Truncated(result))
+    store_results([(user_id, property_id, result)],
+                  compute_recommendations.request.id)
     return result
+
+
+# sin acks_late: un batch largo podría superar el visibility timeout de Redis y ejecutarse dos veces
+@app.task(bind=False, acks_late=False)
+def compute_recommendations_batch(pairs: List[Dict[str, Any]], all_properties: Optional[List[Dict[str, Any]]] = None, dataset_version: Optional[int] = None):
+    """
+    Tarea Celery que calcula recomendaciones para muchos pares (user_id, property_id).
+
+    Construye la matriz de features una vez y resuelve todas las consultas con
+    llamadas vectorizadas al índice. Devuelve {"results": [...]} con un elemento
+    por par, en el mismo orden: {"user_id", "property_id", "result"}, donde
+    `result` tiene el mismo formato que `compute_recommendations`.
+    """
+    property_ids = [pair["property_id"] for pair in pairs]
+    if all_properties is None and INDEX_ENABLED:
+        index = get_index()
+        with metrics.stage("fetch"):
+            index.refresh()
+    else:
+        if all_properties is None:
+            with metrics.stage("fetch"):
+                _, all_properties = feature_store.get(dataset_version)
+        index = PropertyIndex.from_properties(all_properties)
+    by_property = recommend(index, property_ids)
+    if all_properties is None and INDEX_ENABLED:
+        for property_id, result in by_property.items():
+            result_cache.set(property_id, POLICY, index.version, RANKING, result)
+
+    results = [
+        {"user_id": pair.get("user_id"), "property_id": pair["property_id"],
+         "result": by_property[pair["property_id"]]}
+        for pair in pairs
+    ]
+    logger.info("Batch de recomendaciones procesado: %s pares", len(results))
+    store_results([(item["user_id"], item["property_id"], item["result"]) for item in results],
+                  compute_recommendations_batch.request.id)
+    return {"results": results}
+
+
+@app.task(bind=False)
+def rebuild_snapshot():
+    """Exporta un snapshot columnar del catálogo si el vigente quedó atrasado.
+
+    Los workers lo cargan memory-mapped en su siguiente reconstrucción del índice.
+    """
+    if not snapshot.SNAPSHOT_DIR:
+        return {"status": "disabled"}
+    with SessionLocal() as session:
+        version = current_version(session)
+        if snapshot.current_snapshot_version() == version:
+            return {"status": "current", "version": version}
+        columns = snapshot.export_snapshot(session)
+    return {"status": "exported", "version": columns.version, "rows": len(columns)}
+
+
+class _ExactScan:
+    """Vista del índice cuyas consultas son por fuerza bruta (`scan_many`)."""
+
+    def __init__(self, index: PropertyIndex):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, external_id):
+        return self._index.get(external_id)
+
+    def query_many(self, external_ids, k: int = 3, policy=None):
+        return self._index.scan_many(external_ids, k=k, policy=policy)
+
+
+# lo que heredan los procesos de build_neighbor_table (fork): así el índice no se serializa
+_shard_state: Dict[str, Any] = {}
+
+
+def _init_shard_process():
+    # las conexiones heredadas del pool son del proceso padre: cada hijo abre las suyas
+    bind = getattr(_shard_state["session_factory"], "kw", {}).get("bind")
+    if bind is not None:
+        bind.dispose(close=False)
+
+
+def _store_shard(bounds) -> int:
+    start, end = bounds
+    state = _shard_state
+    results = recommend(state["index"], state["sources"][start:end])
+    return precompute.store_neighbors(results, state["key"], state["version"], state["session_factory"])
+
+
+def build_neighbor_table(index: PropertyIndex, session_factory=SessionLocal,
+                         chunk_size: int = precompute.CHUNK_SIZE, workers: int = 1) -> Dict[str, Any]:
+    """Recalcula los vecinos de todo el catálogo y borra los de orígenes que ya no existen.
+
+    Con `workers` > 1 los bloques de orígenes se reparten entre procesos (fork)
+    que comparten el índice ya construido y escriben cada uno sus filas; las
+    filas de versiones anteriores se borran sólo cuando terminaron todos.
+    """
+    key = precompute.policy_key(POLICY, RANKING)
+    version = index.version
+    sources = index.external_ids()
+    bounds = [(start, start + chunk_size) for start in range(0, len(sources), chunk_size)]
+    _shard_state.update(index=index, sources=sources, key=key, version=version,
+                        session_factory=session_factory)
+    try:
+        if workers > 1 and len(bounds) > 1:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(min(workers, len(bounds)), initializer=_init_shard_process) as pool:
+                rows = sum(pool.imap_unordered(_store_shard, bounds))
+        else:
+            rows = sum(map(_store_shard, bounds))
+    finally:
+        _shard_state.clear()
+    pruned = precompute.prune(key, version, session_factory) if version is not None else 0
+    logger.info(
+        "Tabla de vecinos recalculada: version=%s, orígenes=%s, filas=%s",
+        version, len(sources), rows)
+    return {"status": "precomputed", "version": version, "sources": len(sources),
+            "rows": rows, "pruned": pruned}
+
+
+def affected_sources(index: PropertyIndex, changed: List[int], session, key: str,
+                     fanout: int = precompute.FANOUT, k: int = 3) -> Set[int]:
+    """Orígenes cuyos vecinos pueden cambiar cuando cambian las propiedades `changed`.
+
+    Son las propias propiedades cambiadas, los orígenes que hoy las tienen como
+    vecinas (pueden salir) y, entre sus `fanout` vecinos más cercanos, los
+    orígenes para los que ahora quedan más cerca que su peor vecino guardado
+    (pueden entrar). En modo "rerank" el peor knn_distance no decide la entrada,
+    así que se recalculan todos esos vecinos cercanos.
+    """
+    affected = set(changed)
+    affected |= precompute.sources_with_neighbor(session, list(changed), key)
+    near_policy = CandidatePolicy(same_comuna=True) if POLICY.same_comuna else None
+    closest: Dict[int, float] = {}
+    for items in index.query_many(list(changed), k=fanout, policy=near_policy).values():
+        for prop, dist in items:
+            source = prop.get("external_id")
+            closest[source] = min(dist, closest.get(source, dist))
+    stored = precompute.worst_distances(session, list(closest), key)
+    for source, dist in closest.items():
+        count, worst = stored.get(source, (0, None))
+        if RANKING == "rerank" or count < k or dist < worst:
+            affected.add(source)
+    return affected
+
+
+def refresh_neighbor_table(index: PropertyIndex, changed: List[int],
+                           session_factory=SessionLocal) -> Dict[str, Any]:
+    key = precompute.policy_key(POLICY, RANKING)
+    with session_factory() as session:
+        sources = sorted(affected_sources(index, changed, session, key))
+    rows = precompute.store_neighbors(recommend(index, sources), key, index.version, session_factory)
+    return {"status": "refreshed", "version": index.version, "sources": len(sources), "rows": rows}
+
+
+def check_neighbor_table(index: PropertyIndex, sample: int = 200, seed: Optional[int] = None,
+                         session_factory=SessionLocal) -> Dict[str, Any]:
+    """Compara una muestra de la tabla contra KNN por fuerza bruta sobre el mismo índice."""
+    key = precompute.policy_key(POLICY, RANKING)
+    ids = index.external_ids()
+    sources = random.Random(seed).sample(ids, min(sample, len(ids)))
+    stored = {source: precompute.lookup(source, key, session_factory) for source in sources}
+    report = precompute.compare(stored, recommend(_ExactScan(index), sources))
+    report["version"] = index.version
+    if report["mismatched"]:
+        logger.warning(
+            "Tabla de vecinos inconsistente: %s/%s orígenes difieren",
+            report['mismatched'], report['sampled'])
+    return report
+
+
+def _fresh_index() -> PropertyIndex:
+    index = get_index()
+    index.refresh()
+    return index
+
+
+@app.task(bind=False)
+def precompute_neighbors():
+    """Recalcula la tabla `property_neighbors` completa (ver precompute.py)."""
+    return build_neighbor_table(_fresh_index())
+
+
+@app.task(bind=False)
+def refresh_neighbors(property_ids: List[int]):
+    """Recalcula sólo los vecindarios afectados por cambios en `property_ids`."""
+    return refresh_neighbor_table(_fresh_index(), property_ids)
+
+
+@app.task(bind=False)
+def check_neighbors(sample: int = 200, seed: Optional[int] = None):
+    """Verifica una muestra de la tabla precalculada contra KNN por fuerza bruta."""
+    return check_neighbor_table(_fresh_index(), sample, seed)
@@ -0,0 +1,288 @@
+"""Stream de cambios del catálogo (change data) del maestro a los workers.
+
+`notify_property` y la ingesta masiva publican, después del commit, un evento
+compacto por transacción:
+
+    {"op": "upsert", "version": 42, "ts": 1700000000.0, "rows": [[id, external_id, comuna, lat, lon, bedrooms, price], ...]}
+    {"op": "delete", "version": 43, "ts": 1700000001.0, "ids": [external_id, ...]}
+
+Las filas van en el orden de `FEATURE_COLUMNS` (con los campos `raw.<campo>` de
+`RECOMMENDER_FEATURES`, que debe ser igual en maestro y workers) y reflejan el
+estado ya escrito (no el payload). Con Redis el stream es `RECOMMENDER_CHANGES_STREAM` (XADD con
+MAXLEN aproximado `RECOMMENDER_CHANGES_MAXLEN`); sin Redis se usa una cola en
+memoria del proceso (pruebas, desarrollo local).
+
+En cada proceso worker un `ChangeConsumer` lee el stream por lotes y los
+aplica al índice KNN (`PropertyIndex.apply_change_events`) sin releer la
+tabla. Al reiniciar retoma desde la versión del índice: busca en el stream las
+entradas posteriores y, si el stream ya fue recortado, el índice lee de la DB
+sólo las filas con versión posterior. `recommender_change_lag_versions` mide
+el atraso de cada proceso respecto del stream.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from recommender_system import events, metrics
+from recommender_system.feature_store import FEATURE_COLUMNS
+from recommender_system.features import feature_value
+
+logger = logging.getLogger(__name__)
+
+CHANGES_ENABLED = os.environ.get(
+    "RECOMMENDER_CHANGE_EVENTS", "true").lower() in ("1", "true", "yes")
+STREAM_KEY = os.environ.get("RECOMMENDER_CHANGES_STREAM", "recommender:changes")
+MAXLEN = int(os.environ.get("RECOMMENDER_CHANGES_MAXLEN", "100000"))
+# entradas por lectura y espera máxima de la lectura bloqueante del consumidor
+BATCH_SIZE = 500
+BLOCK_MS = 1000
+# entradas por página al buscar hacia atrás la versión de arranque
+_SCAN_PAGE = 1000
+
+LAG_VERSIONS = metrics.REGISTRY.gauge(
+    "recommender_change_lag_versions",
+    "Versiones del catálogo publicadas y aún no aplicadas por el proceso", ("process",))
+APPLY_DELAY = metrics.REGISTRY.histogram(
+    "recommender_change_delay_seconds",
+    "Tiempo entre la publicación de un cambio y su aplicación en un worker")
+APPLIED = metrics.REGISTRY.counter(
+    "recommender_change_events_total", "Eventos de cambio aplicados", ("op",))
+
+
+def _encode(entry: Dict[str, Any]) -> str:
+    return json.dumps(entry, separators=(",", ":"))
+
+
+def _decode(raw) -> Dict[str, Any]:
+    return json.loads(raw)
+
+
+class LocalStream:
+    """Stand-in en memoria del stream de Redis: sólo lo ven los consumidores del mismo proceso."""
+
+    def __init__(self, maxlen: int = MAXLEN):
+        self._entries: deque = deque(maxlen=maxlen)
+        self._next_id = 1
+        self._changed = threading.Condition()
+
+    def add(self, entry: Dict[str, Any]):
+        with self._changed:
+            self._entries.append((self._next_id, entry))
+            self._next_id += 1
+            self._changed.notify_all()
+
+    def last_id(self) -> int:
+        with self._changed:
+            return self._next_id - 1
+
+    def read(self, after: int, count: int, block_ms: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._changed:
+            if block_ms and self._next_id - 1 <= after:
+                self._changed.wait(block_ms / 1000)
+            return [item for item in self._entries if item[0] > after][:count]
+
+    def reverse(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        with self._changed:
+            items = list(self._entries)
+        return reversed(items)
+
+    def head_version(self) -> int:
+        with self._changed:
+            return self._entries[-1][1]["version"] if self._entries else 0
+
+
+class RedisStream:
+    def __init__(self, client, key: str = STREAM_KEY, maxlen: int = MAXLEN):
+        self._client = client
+        self._key = key
+        self._maxlen = maxlen
+
+    def add(self, entry: Dict[str, Any]):
+        self._client.xadd(self._key, {"e": _encode(entry)}, maxlen=self._maxlen, approximate=True)
+
+    def last_id(self) -> str:
+        newest = self._client.xrevrange(self._key, count=1)
+        return newest[0][0] if newest else "0-0"
+
+    def read(self, after: str, count: int, block_ms: int = 0) -> List[Tuple[str, Dict[str, Any]]]:
+        found = self._client.xread({self._key: after}, count=count, block=block_ms or None)
+        return [(entry_id, _decode(fields[b"e"]))
+                for _, items in found or () for entry_id, fields in items]
+
+    def head_version(self) -> int:
+        newest = self._client.xrevrange(self._key, count=1)
+        return _decode(newest[0][1][b"e"])["version"] if newest else 0
+
+    def reverse(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        upper = "+"
+        while True:
+            page = self._client.xrevrange(self._key, max=upper, count=_SCAN_PAGE)
+            for entry_id, fields in page:
+                yield entry_id, _decode(fields[b"e"])
+            if len(page) < _SCAN_PAGE:
+                return
+            last = page[-1][0]
+            upper = "(" + (last.decode() if isinstance(last, bytes) else last)
+
+
+_local_stream = LocalStream()
+
+
+def get_stream():
+    """Stream del proceso: Redis si está configurado, si no la cola en memoria."""
+    return shared_stream() or _local_stream
+
+
+def shared_stream() -> Optional[RedisStream]:
+    """Stream visible desde otros procesos (Redis), o None."""
+    client = events.get_client()
+    return RedisStream(client) if client is not None else None
+
+
+def entries_since(stream, version: int) -> Optional[Tuple[Any, List[Dict[str, Any]]]]:
+    """`(posición, entradas)` publicadas después de `version`, en orden.
+
+    `posición` es el id de la entrada más nueva (desde donde seguir leyendo).
+    Devuelve None si el stream ya no conserva todas esas entradas (se recortó).
+    """
+    collected = []
+    position = None
+    for entry_id, entry in stream.reverse():
+        if position is None:
+            position = entry_id
+        if entry["version"] <= version:
+            collected.reverse()
+            return position, collected
+        collected.append(entry)
+    if not collected:
+        return stream.last_id(), []
+    # se llegó al inicio: alcanza sólo si la entrada más antigua es la siguiente versión
+    if collected[-1]["version"] != version + 1:
+        return None
+    collected.reverse()
+    return position, collected
+
+
+def _publish(entry: Dict[str, Any]):
+    if not CHANGES_ENABLED:
+        return
+    try:
+        get_stream().add(entry)
+    except Exception as e:
+        # los workers notan la versión faltante al compararse con la DB y la leen de ahí
+        # (ver PropertyIndex.check_db)
+        logger.warning(f"No se pudo publicar el cambio v{entry['version']}: {str(e)}")
+
+
+def publish_upserts(properties: List[Dict[str, Any]], version: int):
+    """Publica el estado escrito de `properties` (dicts con `FEATURE_COLUMNS`)."""
+    if properties:
+        _publish({"op": "upsert", "version": version, "ts": time.time(),
+                  "rows": [[feature_value(prop, name) for name in FEATURE_COLUMNS] for prop in properties]})
+
+
+def publish_deletes(external_ids: List[int], version: int):
+    if external_ids:
+        _publish({"op": "delete", "version": version, "ts": time.time(), "ids": list(external_ids)})
+
+
+def entry_rows(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [dict(zip(FEATURE_COLUMNS, row)) for row in entry.get("rows", ())]
+
+
+class ChangeConsumer:
+    """Aplica el stream de cambios a `target` (un `PropertyIndex`) en un hilo daemon.
+
+    `target` necesita `version`, `apply_change_events(entries)`,
+    `catch_up(since_version)` (lectura de la DB por versión) y `resolve_gaps()`.
+    """
+
+    def __init__(self, target, stream=None, batch_size: int = BATCH_SIZE, block_ms: int = BLOCK_MS):
+        self._target = target
+        self._stream = stream if stream is not None else get_stream()
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self._position = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._process = f"{socket.gethostname()}:{os.getpid()}"
+
+    @property
+    def running(self) -> bool:
+        return self._position is not None and not self._stop.is_set()
+
+    def entries_since(self, version: int) -> Optional[List[Dict[str, Any]]]:
+        found = entries_since(self._stream, version)
+        return None if found is None else found[1]
+
+    def catch_up(self):
+        """Se ubica después de la versión del target y aplica lo publicado desde entonces."""
+        with self._lock:
+            version = self._target.version or 0
+            found = entries_since(self._stream, version)
+            if found is None:
+                logger.warning(
+                    f"El stream de cambios ya no tiene v{version}: se leen de la DB las filas posteriores")
+                position = self._stream.last_id()
+                self._target.catch_up(version)
+            else:
+                position, entries = found
+                self._apply(entries)
+            self._position = position
+
+    def poll(self, block_ms: int = 0) -> int:
+        """Aplica hasta `batch_size` entradas pendientes; devuelve cuántas."""
+        position = self._position
+        if position is None:
+            return 0
+        # la lectura (que puede bloquear) va sin el lock: mientras el hilo espera,
+        # una tarea puede aplicar lo pendiente con su propio poll()
+        items = self._stream.read(position, self.batch_size, block_ms)
+        if not items:
+            return 0
+        with self._lock:
+            if self._position != position:
+                # otro llamador ya avanzó: lo leído se vuelve a leer desde la nueva posición
+                return 0
+            self._position = items[-1][0]
+            self._apply([entry for _, entry in items])
+        return len(items)
+
+    def _apply(self, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        self._target.apply_change_events(entries)
+        now = time.time()
+        for entry in entries:
+            APPLIED.labels(entry["op"]).inc()
+        APPLY_DELAY.labels().observe(max(0.0, now - entries[-1]["ts"]))
+
+    def observe_lag(self):
+        head = self._stream.head_version()
+        LAG_VERSIONS.labels(self._process).set(max(0, head - (self._target.version or 0)))
+
+    def start(self) -> threading.Thread:
+        self.catch_up()
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.poll(self.block_ms)
+                    self._target.resolve_gaps()
+                    self.observe_lag()
+                except Exception as e:
+                    logger.warning(f"Error leyendo el stream de cambios: {str(e)}")
+                    self._stop.wait(self.block_ms / 1000)
+
+        self._thread = threading.Thread(target=run, name="change-consumer", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
@@ -1,20 +1,82 @@
+import logging
 import os
+from typing import Optional
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
     # fallback to sqlite for local development
     "sqlite:///./recommender.db",
 )
 
+# pool de conexiones (no aplica a SQLite salvo pre_ping)
+POOL_SIZE = int(os.getenv("RECOMMENDER_DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("RECOMMENDER_DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("RECOMMENDER_DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("RECOMMENDER_DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv(
+    "RECOMMENDER_DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# motor async (asyncpg / aiosqlite) para las rutas async del maestro
+ASYNC_DB_ENABLED = os.getenv(
+    "RECOMMENDER_ASYNC_DB", "true").lower() in ("1", "true", "yes")
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+# el maestro crea/actualiza el esquema al arrancar; con "false" se hace aparte
+# (`python -m recommender_system.database`, ej. un job previo al despliegue)
+INIT_DB_ON_STARTUP = os.getenv(
+    "RECOMMENDER_INIT_DB_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+def engine_options(url: str) -> dict:
+    """Opciones de `create_engine` para `url` según la configuración del pool."""
+    options = {"pool_pre_ping": POOL_PRE_PING}
+    if not url.startswith("sqlite"):
+        options.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                       pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE)
+    return options
+
+
 # echo=False to avoid noisy logs in production
-engine = create_engine(DATABASE_URL, echo=False, future=True)
+engine = create_engine(DATABASE_URL, echo=False, future=True,
+                       **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(
     bind=engine, autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
 
 
+def async_database_url(url: str = DATABASE_URL) -> Optional[str]:
+    """La misma base con driver async (ej. postgresql:// -> postgresql+asyncpg://)."""
+    scheme, _, rest = url.partition("://")
+    driver = ASYNC_DRIVERS.get(scheme.split("+")[0])
+    return f"{driver}://{rest}" if driver else None
+
+
+_async_session_factory = None
+_async_checked = False
+
+
+def get_async_session_factory():
+    """Sessionmaker async, o None si está deshabilitado o el driver no está instalado."""
+    global _async_session_factory, _async_checked
+    if not _async_checked:
+        _async_checked = True
+        url = async_database_url()
+        if ASYNC_DB_ENABLED and url:
+            try:
+                from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+                async_engine = create_async_engine(url, **engine_options(url))
+                _async_session_factory = async_sessionmaker(
+                    async_engine, autoflush=False, expire_on_commit=False)
+            except ImportError as e:
+                logger.warning(
+                    f"Sin driver async para {url.split('://')[0]}, se usa el pool de hilos: {str(e)}")
+    return _async_session_factory
+
+
 def init_db():
     """Crea las tablas declaradas por los modelos si no existen."""
     from sqlalchemy import inspect
@@ -27,4 +89,69 @@ def init_db():
     except Exception:
         pass
 
+    existing_tables = set(inspector.get_table_names())
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns(existing_tables)
+    seed_catalog_version(engine)
+
+
+def seed_catalog_version(bind):
+    """Crea la fila única de `catalog_version` (versión 0) si falta, en bases nuevas o antiguas.
+
+    Así `bump_version` es sólo un UPDATE: dos primeras escrituras concurrentes
+    ya no compiten por insertar la fila.
+    """
+    from sqlalchemy import insert, select
+    from sqlalchemy.exc import IntegrityError
+    from recommender_system.models import CatalogVersion
+
+    with bind.connect() as conn:
+        if conn.execute(select(CatalogVersion.id).where(CatalogVersion.id == 1)).first() is not None:
+            return
+    try:
+        with bind.begin() as conn:
+            conn.execute(insert(CatalogVersion).values(id=1, version=0))
+    except IntegrityError:
+        # otro proceso la creó entre la consulta y el insert
+        pass
+
+
+def _add_missing_columns(existing_tables):
+    """Agrega columnas e índices nuevos a tablas que ya existían.
+
+    `create_all` no altera tablas existentes, así que las columnas agregadas a
+    los modelos después de crear la base (siempre nullable) se crean aquí.
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+
+
+def setup_database():
+    """Esquema (`init_db`) más el backfill de geohashes de filas antiguas."""
+    from recommender_system import geo
+
+    init_db()
+    with SessionLocal() as session:
+        geo.backfill_geohashes(session)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    setup_database()
+    logger.info(f"Esquema listo en {engine.url.render_as_string(hide_password=True)}")
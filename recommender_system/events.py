@@ -0,0 +1,153 @@
+"""Bus de eventos liviano entre el maestro y los workers.
+
+Si el broker de Celery es Redis (o se define `RECOMMENDER_EVENTS_URL`), los
+mensajes viajan por Redis pub/sub y un único hilo por proceso los reparte a
+los suscriptores. Si Redis se cae, el hilo registra el error y reintenta con
+espera creciente (hasta `RECOMMENDER_EVENTS_RETRY_MAX` segundos) en vez de
+morir; lo publicado mientras tanto se pierde, así que quien depende de un
+aviso debe tener un plazo y releer el estado. Con el broker en memoria (pruebas, desarrollo local) los
+mensajes se entregan directamente dentro del mismo proceso.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# espera máxima (segundos) entre reintentos del hilo de pub/sub con Redis caído
+RETRY_MAX = float(os.environ.get("RECOMMENDER_EVENTS_RETRY_MAX", "30"))
+
+_lock = threading.Lock()
+_subscribers: Dict[str, List[Callable[[Dict[str, Any]], None]]] = defaultdict(list)
+_client = None
+_pubsub = None
+_listener = None
+# canales que escucha `_listener`
+_listening = frozenset()
+# errores seguidos del hilo de pub/sub (para la espera creciente) y el último
+_failures = 0
+_last_failure = 0.0
+_retry_timer = None
+
+
+def _redis_url():
+    from recommender_system.celery_app import app
+
+    url = os.environ.get("RECOMMENDER_EVENTS_URL") or app.conf.broker_url or ""
+    return url if url.startswith(("redis://", "rediss://")) else None
+
+
+def get_client():
+    """Cliente Redis compartido del proceso, o None si no hay Redis configurado."""
+    global _client
+    if _client is None:
+        url = _redis_url()
+        if url is None:
+            return None
+        import redis
+
+        _client = redis.Redis.from_url(url)
+    return _client
+
+
+def _dispatch(channel: str, message: Dict[str, Any]):
+    for callback in list(_subscribers.get(channel, ())):
+        try:
+            callback(message)
+        except Exception as e:
+            logger.error(f"Error en suscriptor de {channel}: {str(e)}")
+
+
+def _on_redis_message(raw):
+    channel = raw["channel"].decode() if isinstance(
+        raw["channel"], bytes) else raw["channel"]
+    _dispatch(channel, json.loads(raw["data"]))
+
+
+def publish(channel: str, message: Dict[str, Any]):
+    """Publica un mensaje; los errores de Redis se registran y no se propagan."""
+    try:
+        client = get_client()
+        if client is None:
+            _dispatch(channel, message)
+        else:
+            client.publish(channel, json.dumps(message))
+    except Exception as e:
+        logger.warning(f"No se pudo publicar evento en {channel}: {str(e)}")
+
+
+def _backoff() -> float:
+    """Espera antes del siguiente reintento; se reinicia tras un rato sin errores."""
+    global _failures, _last_failure
+    now = time.monotonic()
+    if now - _last_failure > 2 * RETRY_MAX:
+        _failures = 0
+    _failures += 1
+    _last_failure = now
+    return min(RETRY_MAX, 0.5 * 2 ** min(_failures, 10))
+
+
+def _on_listener_error(error, pubsub, thread):
+    # el hilo de redis-py termina si el handler no vuelve: se registra y se reintenta
+    # (la siguiente lectura reconecta y vuelve a suscribir los canales)
+    delay = _backoff()
+    logger.warning("Error en el hilo de pub/sub, reintento en %.1fs: %s", delay, error)
+    time.sleep(delay)
+
+
+def _restart_listener():
+    """(Re)arma el hilo de pub/sub con todos los canales suscritos; requiere `_lock`.
+
+    Los canales se registran en un PubSub nuevo antes de arrancar su hilo, así
+    nunca se suscribe desde otro hilo sobre la conexión que el hilo está leyendo.
+    El hilo anterior se detiene después: un aviso repetido en el cambio no hace
+    daño (los suscriptores son idempotentes), uno perdido sí.
+    """
+    global _pubsub, _listener, _listening, _retry_timer
+    _retry_timer = None
+    try:
+        client = get_client()
+        if client is None or not _subscribers:
+            return
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: _on_redis_message for channel in _subscribers})
+        listener = pubsub.run_in_thread(
+            sleep_time=1.0, daemon=True, exception_handler=_on_listener_error)
+    except Exception as e:
+        delay = _backoff()
+        logger.warning("No se pudo suscribir a %s, reintento en %.1fs: %s",
+                       ", ".join(_subscribers), delay, e)
+        # sin una suscripción posterior nadie más lo reintentaría
+        _retry_timer = threading.Timer(delay, _retry_listener)
+        _retry_timer.daemon = True
+        _retry_timer.start()
+        return
+    if _listener is not None:
+        _listener.stop()
+    _pubsub, _listener, _listening = pubsub, listener, frozenset(_subscribers)
+
+
+def _listener_stale() -> bool:
+    """Si falta el hilo (nunca arrancó, murió o no sobrevivió a un fork) o le faltan canales."""
+    return _listener is None or not _listener.is_alive() or _listening != set(_subscribers)
+
+
+def _retry_listener():
+    with _lock:
+        if _listener_stale():
+            _restart_listener()
+
+
+def subscribe(channel: str, callback: Callable[[Dict[str, Any]], None]):
+    """Registra `callback` para los mensajes de `channel` en este proceso."""
+    with _lock:
+        _subscribers[channel].append(callback)
+        if _retry_timer is not None:
+            # ya hay un reintento pendiente, que incluirá este canal
+            return
+        if _listener_stale():
+            _restart_listener()
@@ -0,0 +1,119 @@
+"""Almacén de features de propiedades, versionado y compartido por maestro y workers.
+
+En modo "por referencia" el mensaje de Celery sólo lleva `user_id`, `property_id`
+y la versión del catálogo; el worker resuelve las propiedades candidatas desde
+aquí en vez de recibir la tabla completa dentro del mensaje.
+"""
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+
+from recommender_system.database import SessionLocal
+from recommender_system.features import SPEC, FeatureSpec, FeatureTransform, feature_expression, sql_transform
+from recommender_system.models import CatalogVersion, Property
+
+logger = logging.getLogger(__name__)
+
+# columnas numéricas/categóricas que usa el recomendador (sin `raw`), más los
+# campos de `raw` que pide RECOMMENDER_FEATURES (ej. "raw.m2", ver features.py)
+FEATURE_COLUMNS = ("id", "external_id", "comuna",
+                   "lat", "lon", "bedrooms", "price") + SPEC.raw_columns
+
+
+def feature_columns() -> list:
+    """Expresiones SQL de `FEATURE_COLUMNS` (los campos de `raw` se extraen del JSON)."""
+    return [feature_expression(name) for name in FEATURE_COLUMNS]
+
+
+def count_properties(session) -> int:
+    """Cantidad de propiedades en el catálogo."""
+    return session.execute(select(func.count(Property.id))).scalar_one()
+
+
+def current_version(session) -> int:
+    """Devuelve la versión actual del catálogo (0 si nunca se ha escrito)."""
+    version = session.execute(
+        select(CatalogVersion.version).where(CatalogVersion.id == 1)
+    ).scalar_one_or_none()
+    return version or 0
+
+
+def bump_version(session) -> int:
+    """Incrementa la versión del catálogo dentro de la transacción del llamador.
+
+    El commit queda a cargo de quien escribe las propiedades, de modo que la
+    nueva versión y los cambios se publican juntos. La fila la crea `init_db`
+    (`seed_catalog_version`): aquí sólo se actualiza.
+    """
+    updated = session.execute(
+        update(CatalogVersion)
+        .where(CatalogVersion.id == 1)
+        .values(version=CatalogVersion.version + 1)
+    ).rowcount
+    if not updated:
+        raise RuntimeError("catalog_version no tiene fila: ejecute init_db() antes de escribir")
+    return current_version(session)
+
+
+def load_properties(session, since_version: Optional[int] = None, filters=(),
+                    with_version: bool = False) -> List[Dict[str, Any]]:
+    """Lee las features de las propiedades, sin el JSON `raw` (sólo sus campos configurados).
+
+    Con `since_version` sólo devuelve las filas escritas después de esa versión;
+    `filters` son condiciones SQLAlchemy adicionales. Con `with_version` cada
+    fila trae además la versión en que se escribió (`"version"`).
+    """
+    names = FEATURE_COLUMNS + ("version",) if with_version else FEATURE_COLUMNS
+    query = select(*feature_columns(), *([Property.version] if with_version else [])).where(*filters)
+    if since_version is not None:
+        query = query.where(Property.version > since_version)
+    rows = session.execute(query).all()
+    return [dict(zip(names, row)) for row in rows]
+
+
+# clave de la configuración de features -> (versión del catálogo, transformación)
+_transforms: Dict[str, Tuple[int, FeatureTransform]] = {}
+
+
+def global_transform(session, spec: FeatureSpec = SPEC) -> FeatureTransform:
+    """Escala con estadísticas de todo el catálogo, calculada una vez por versión y proceso."""
+    version = current_version(session)
+    cached = _transforms.get(spec.key())
+    if cached is None or cached[0] != version:
+        cached = (version, sql_transform(session, spec))
+        _transforms[spec.key()] = cached
+    return cached[1]
+
+
+class FeatureStore:
+    """Caché por proceso de las features, invalidada por versión del catálogo."""
+
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._properties: List[Dict[str, Any]] = []
+
+    def get(self, dataset_version: Optional[int] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """Devuelve `(version, propiedades)`, recargando si el catálogo cambió.
+
+        `dataset_version` es la versión con la que se encoló el job; si el
+        catálogo avanzó desde entonces se usan los datos más recientes.
+        """
+        with self._lock, self._session_factory() as session:
+            version = current_version(session)
+            if version != self._version:
+                self._properties = load_properties(session)
+                self._version = version
+                logger.info(
+                    f"Feature store recargado: version={version}, propiedades={len(self._properties)}")
+        if dataset_version is not None and dataset_version != version:
+            logger.debug(
+                f"Job encolado con version={dataset_version}, usando version={version}")
+        return version, self._properties
+
+
+# instancia compartida por el proceso (un worker prefork tiene la suya)
+feature_store = FeatureStore()
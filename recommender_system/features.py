@@ -0,0 +1,319 @@
+"""Configuración de las features del KNN: qué se compara, con qué peso y cómo se normaliza.
+
+`RECOMMENDER_FEATURES` es una lista `nombre[:peso]` separada por comas (por
+defecto `lat,lon,price`, el modelo histórico con pesos 1):
+
+  - `lat`, `lon`, `price`, `bedrooms`: columnas de `properties`
+  - `price_per_bedroom`: price / bedrooms (0 dormitorios cuenta como 1)
+  - `raw.<campo>`: valor numérico de un campo del JSON `raw` (se extrae en SQL)
+  - `comuna`: one-hot de la comuna; dos comunas distintas quedan a distancia `peso`
+
+Cada feature numérica se centra y escala con estadísticas globales del catálogo
+(`NormalizationStats`) y luego se multiplica por su peso. Las estadísticas se
+calculan una vez por versión del catálogo y se actualizan en streaming
+(Welford) a medida que cambian las propiedades; la transformación resultante
+(`FeatureTransform`) es afín y queda fija mientras las estadísticas no se
+desvíen más de `RECOMMENDER_STATS_DRIFT` desviaciones estándar. Así una
+propiedad tiene las mismas coordenadas en cada consulta, sin importar qué
+candidatos la acompañan, y los workers con la misma transformación devuelven
+los mismos vecinos.
+"""
+import math
+import os
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Float, case, cast, func, select
+
+from recommender_system.models import Property
+
+FEATURES = os.environ.get("RECOMMENDER_FEATURES", "lat,lon,price")
+# con qué se reemplaza una feature NULL al armar la matriz: "zero" (0, el
+# comportamiento histórico) o "mean" (promedio de la columna, que tras escalar
+# queda en 0 y no acerca la fila a ninguna otra)
+NULL_FEATURES = os.environ.get("RECOMMENDER_NULL_FEATURES", "zero")
+# desviación (en desviaciones estándar) de media o dispersión a partir de la
+# cual la compactación del índice adopta las estadísticas actualizadas
+STATS_DRIFT = float(os.environ.get("RECOMMENDER_STATS_DRIFT", "0.05"))
+
+RAW_PREFIX = "raw."
+COMUNA = "comuna"
+COLUMN_FEATURES = ("lat", "lon", "price", "bedrooms")
+DERIVED_FEATURES = ("price_per_bedroom",)
+
+
+class FeatureSpec:
+    """Features numéricas (en orden) y sus pesos, más el peso opcional del one-hot de comuna."""
+
+    def __init__(self, weights: Dict[str, float]):
+        for name, weight in weights.items():
+            known = name in COLUMN_FEATURES + DERIVED_FEATURES + (COMUNA,) or \
+                (name.startswith(RAW_PREFIX) and len(name) > len(RAW_PREFIX))
+            if not known:
+                raise ValueError(
+                    f"Feature desconocida en RECOMMENDER_FEATURES: {name} (opciones: "
+                    f"{', '.join(COLUMN_FEATURES + DERIVED_FEATURES + (COMUNA,))}, raw.<campo>)")
+            if not weight > 0:
+                raise ValueError(f"El peso de {name} debe ser positivo: {weight}")
+        if not weights:
+            raise ValueError("RECOMMENDER_FEATURES no tiene features")
+        self.weights = dict(weights)
+        self.numeric = [name for name in weights if name != COMUNA]
+        self.comuna_weight: Optional[float] = weights.get(COMUNA)
+
+    @classmethod
+    def parse(cls, text: str) -> "FeatureSpec":
+        weights: Dict[str, float] = {}
+        for item in text.split(","):
+            if not item.strip():
+                continue
+            name, _, weight = item.strip().partition(":")
+            weights[name.strip()] = float(weight) if weight else 1.0
+        return cls(weights)
+
+    def key(self) -> str:
+        return ",".join(f"{name}:{weight:g}" for name, weight in self.weights.items())
+
+    def __repr__(self):
+        return f"FeatureSpec({self.key()})"
+
+    @property
+    def raw_columns(self) -> Tuple[str, ...]:
+        """Columnas `raw.<campo>` que hay que leer junto con `FEATURE_COLUMNS`."""
+        return tuple(name for name in self.numeric if name.startswith(RAW_PREFIX))
+
+    @property
+    def numeric_weights(self) -> np.ndarray:
+        return np.array([self.weights[name] for name in self.numeric], dtype=np.float64)
+
+    def raw_matrix(self, columns) -> np.ndarray:
+        """Matriz (n, features numéricas) desde un `PropertyColumns`; NaN donde el valor es NULL."""
+        arrays = columns.arrays
+        bedrooms = None
+        values = []
+        for name in self.numeric:
+            if name in ("bedrooms", "price_per_bedroom") and bedrooms is None:
+                # MISSING (-1) es NULL
+                bedrooms = np.asarray(arrays["bedrooms"], dtype=np.float64)
+                bedrooms = np.where(bedrooms < 0, np.nan, bedrooms)
+            if name == "bedrooms":
+                values.append(bedrooms)
+            elif name == "price_per_bedroom":
+                values.append(np.asarray(arrays["price"], dtype=np.float64) / np.maximum(bedrooms, 1))
+            elif name in arrays:
+                values.append(np.asarray(arrays[name], dtype=np.float64))
+            else:
+                values.append(np.full(len(columns), np.nan))
+        return np.column_stack(values).reshape(-1, len(self.numeric)) if values \
+            else np.empty((len(columns), 0))
+
+
+SPEC = FeatureSpec.parse(FEATURES)
+
+
+def model_key(spec: Optional[FeatureSpec] = None, nulls: Optional[str] = None) -> str:
+    """Configuración de features de la que dependen los vecinos (parte de las llaves de caché)."""
+    spec = SPEC if spec is None else spec
+    return f"{spec.key()};nulls={NULL_FEATURES if nulls is None else nulls}"
+
+
+def feature_value(prop: Dict[str, Any], name: str) -> Any:
+    """Valor de la columna `name` en un dict de propiedad; `raw.<campo>` se busca
+    primero ya extraído y si no dentro de `prop["raw"]`."""
+    if name.startswith(RAW_PREFIX) and name not in prop:
+        raw = prop.get("raw")
+        return raw.get(name[len(RAW_PREFIX):]) if isinstance(raw, dict) else None
+    return prop.get(name)
+
+
+def _expression(name: str):
+    if name.startswith(RAW_PREFIX):
+        return Property.raw[name[len(RAW_PREFIX):]].as_float()
+    if name == "price_per_bedroom":
+        divisor = case((Property.bedrooms.is_(None), None),
+                       (Property.bedrooms >= 1, Property.bedrooms), else_=1)
+        return cast(Property.price, Float) / divisor
+    return getattr(Property, name)
+
+
+def feature_expression(name: str):
+    """Expresión SQL de una columna de features (los campos de `raw` se extraen del JSON)."""
+    if name.startswith(RAW_PREFIX):
+        return _expression(name).label(name)
+    return _expression(name)
+
+
+def null_fill(raw: np.ndarray, nulls: str = NULL_FEATURES) -> np.ndarray:
+    """Valor que reemplaza los NULL de cada columna de `raw` según `RECOMMENDER_NULL_FEATURES`."""
+    if nulls == "zero":
+        return np.zeros(raw.shape[1])
+    if nulls == "mean":
+        present = (~np.isnan(raw)).sum(axis=0)
+        totals = np.nansum(raw, axis=0)
+        return np.divide(totals, present, out=np.zeros(raw.shape[1]), where=present > 0)
+    raise ValueError(
+        f"RECOMMENDER_NULL_FEATURES desconocido: {nulls} (opciones: zero, mean)")
+
+
+def fill_nulls(raw: np.ndarray, fill: np.ndarray) -> np.ndarray:
+    return np.where(np.isnan(raw), fill, raw)
+
+
+class NormalizationStats:
+    """Cantidad, media y suma de cuadrados de las desviaciones (M2) por feature.
+
+    Se pueden agregar y quitar filas sin recorrer el catálogo (fórmulas de
+    Welford/Chan por bloques), así una actualización cuesta lo que las filas cambiadas.
+    """
+
+    def __init__(self, count: int, mean: np.ndarray, m2: np.ndarray):
+        self.count = count
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.m2 = np.asarray(m2, dtype=np.float64)
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray) -> "NormalizationStats":
+        if not len(matrix):
+            return cls(0, np.zeros(matrix.shape[1]), np.zeros(matrix.shape[1]))
+        mean = matrix.mean(axis=0)
+        return cls(len(matrix), mean, ((matrix - mean) ** 2).sum(axis=0))
+
+    def copy(self) -> "NormalizationStats":
+        return NormalizationStats(self.count, self.mean.copy(), self.m2.copy())
+
+    @property
+    def std(self) -> np.ndarray:
+        """Desviación estándar poblacional (como `StandardScaler`); 1 si es 0."""
+        if not self.count:
+            return np.ones(len(self.mean))
+        std = np.sqrt(np.maximum(self.m2, 0) / self.count)
+        return np.where(std > 0, std, 1.0)
+
+    def add(self, matrix: np.ndarray):
+        if not len(matrix):
+            return
+        other = NormalizationStats.from_matrix(matrix)
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / total
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+
+    def remove(self, matrix: np.ndarray):
+        if not len(matrix):
+            return
+        other = NormalizationStats.from_matrix(matrix)
+        rest = self.count - other.count
+        if rest <= 0:
+            self.count, self.mean, self.m2 = 0, np.zeros_like(self.mean), np.zeros_like(self.m2)
+            return
+        mean = (self.mean * self.count - other.mean * other.count) / rest
+        delta = other.mean - mean
+        self.m2 = np.maximum(self.m2 - other.m2 - delta ** 2 * rest * other.count / self.count, 0)
+        self.mean = mean
+        self.count = rest
+
+    def drift(self, other: "NormalizationStats") -> float:
+        """Mayor diferencia de media o desviación de `other`, en desviaciones estándar de `self`."""
+        if not self.count or not len(self.mean):
+            return 0.0 if not other.count else math.inf
+        std = self.std
+        return float(max(np.max(np.abs(other.mean - self.mean) / std),
+                         np.max(np.abs(other.std - std) / std)))
+
+
+class FeatureTransform:
+    """Transformación afín fija: (x - media) / desviación * peso, más el one-hot de comuna.
+
+    `fill` es el reemplazo de los NULL (ver `null_fill`) y `comunas` fija las
+    columnas del one-hot; una comuna que no está en la lista queda sin ninguna.
+    """
+
+    def __init__(self, spec: FeatureSpec, stats: NormalizationStats, fill: np.ndarray,
+                 comunas: Sequence[Optional[str]] = ()):
+        self.spec = spec
+        self.stats = stats
+        self.fill = np.asarray(fill, dtype=np.float64)
+        self.comunas = [name for name in dict.fromkeys(comunas) if name is not None]
+        self._positions = {name: i for i, name in enumerate(self.comunas)}
+        self._offset = stats.mean
+        self._scale = spec.numeric_weights / stats.std
+
+    @classmethod
+    def fit(cls, spec: FeatureSpec, columns, nulls: str = NULL_FEATURES) -> "FeatureTransform":
+        """Estadísticas exactas de `columns` (un recorrido completo)."""
+        raw = spec.raw_matrix(columns)
+        fill = null_fill(raw, nulls)
+        return cls(spec, NormalizationStats.from_matrix(fill_nulls(raw, fill)), fill, columns.comunas)
+
+    def with_stats(self, stats: NormalizationStats) -> "FeatureTransform":
+        return FeatureTransform(self.spec, stats, self.fill, self.comunas)
+
+    def with_comunas(self, comunas: Sequence[Optional[str]]) -> "FeatureTransform":
+        """La misma transformación con columnas de one-hot también para `comunas`."""
+        if self.spec.comuna_weight is None or all(
+                name is None or name in self._positions for name in comunas):
+            return self
+        return FeatureTransform(self.spec, self.stats, self.fill, list(self.comunas) + list(comunas))
+
+    @property
+    def dimensions(self) -> int:
+        onehot = len(self.comunas) if self.spec.comuna_weight is not None else 0
+        return len(self.spec.numeric) + onehot
+
+    def numeric(self, columns) -> np.ndarray:
+        """Features numéricas de `columns` sin escalar, con los NULL reemplazados."""
+        return fill_nulls(self.spec.raw_matrix(columns), self.fill)
+
+    def transform(self, numeric: np.ndarray, columns=None) -> np.ndarray:
+        """Escala `numeric`; con one-hot de comuna, las comunas salen de `columns`."""
+        scaled = (numeric - self._offset) * self._scale
+        if self.spec.comuna_weight is None:
+            return scaled
+        onehot = np.zeros((len(numeric), len(self.comunas)))
+        if columns is not None and len(numeric):
+            # la última posición traduce MISSING (-1) a "sin columna"
+            remap = np.array([self._positions.get(name, -1) for name in columns.comunas] + [-1])
+            positions = remap[columns.comuna_codes]
+            rows = np.flatnonzero(positions >= 0)
+            # dos filas de comunas distintas difieren en dos columnas: distancia = peso
+            onehot[rows, positions[rows]] = self.spec.comuna_weight / math.sqrt(2)
+        return np.hstack([scaled, onehot])
+
+    def encode(self, columns) -> np.ndarray:
+        return self.transform(self.numeric(columns), columns)
+
+
+def sql_transform(session, spec: FeatureSpec = SPEC, nulls: str = NULL_FEATURES) -> FeatureTransform:
+    """Transformación con estadísticas de todo el catálogo calculadas con agregados SQL.
+
+    Es lo que usan los índices transitorios armados sobre candidatos de SQL: no
+    leen el catálogo, pero escalan con las mismas estadísticas globales. Sin
+    one-hot de comunas prefijado (se agregan con `with_comunas`).
+    """
+    aggregates = [func.count(Property.id)]
+    for name in spec.numeric:
+        value = cast(_expression(name), Float)
+        aggregates += [func.count(value), func.sum(value), func.sum(value * value)]
+    row = session.execute(select(*aggregates)).one()
+    total = row[0] or 0
+    fills, means, m2s = [], [], []
+    for i in range(len(spec.numeric)):
+        present, sums, squares = row[1 + 3 * i:4 + 3 * i]
+        present, sums, squares = present or 0, float(sums or 0), float(squares or 0)
+        if nulls == "mean":
+            fill = sums / present if present else 0.0
+        elif nulls == "zero":
+            fill = 0.0
+        else:
+            raise ValueError(
+                f"RECOMMENDER_NULL_FEATURES desconocido: {nulls} (opciones: zero, mean)")
+        # los NULL cuentan como el valor de reemplazo
+        sums += (total - present) * fill
+        squares += (total - present) * fill * fill
+        mean = sums / total if total else 0.0
+        fills.append(fill)
+        means.append(mean)
+        m2s.append(max(squares - total * mean * mean, 0.0))
+    return FeatureTransform(spec, NormalizationStats(total, means, m2s), np.array(fills))
+
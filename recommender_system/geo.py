@@ -0,0 +1,107 @@
+"""Índice espacial por geohash para consultas por radio.
+
+Cada propiedad guarda el geohash de su ubicación (`Property.geohash`). Para
+buscar alrededor de un punto se elige la precisión cuya celda es al menos tan
+grande como el radio, y se consultan la celda del punto y sus 8 vecinas como
+rangos de prefijo en SQL (aprovechan el índice btree). El filtro exacto se hace
+después con haversine sobre ese subconjunto.
+"""
+import math
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9
+KM_PER_DEGREE = 111.32
+
+
+def encode(lat: float, lon: float, precision: int = PRECISION) -> str:
+    """Geohash de `precision` caracteres para el punto (lat, lon)."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def encode_optional(lat: Optional[float], lon: Optional[float]) -> Optional[str]:
+    """Geohash o None si la propiedad no tiene ubicación."""
+    if lat is None or lon is None:
+        return None
+    return encode(lat, lon)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Alto y ancho (en grados de lat y lon) de una celda de `precision` caracteres."""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def precision_for_radius(lat: float, radius_km: float) -> int:
+    """Mayor precisión cuya celda mide al menos `radius_km` por lado (0 = sin filtro)."""
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    for precision in range(PRECISION, 0, -1):
+        lat_deg, lon_deg = cell_size(precision)
+        if lat_deg * KM_PER_DEGREE >= radius_km and lon_deg * KM_PER_DEGREE * cos_lat >= radius_km:
+            return precision
+    return 0
+
+
+def covering_prefixes(lat: float, lon: float, radius_km: float) -> List[str]:
+    """Prefijos (celda del punto + 8 vecinas) que cubren el círculo de `radius_km`.
+
+    Lista vacía si el radio es más grande que las celdas de precisión 1.
+    """
+    precision = precision_for_radius(lat, radius_km)
+    if precision == 0:
+        return []
+    lat_deg, lon_deg = cell_size(precision)
+    prefixes = []
+    for dlat in (-lat_deg, 0.0, lat_deg):
+        for dlon in (-lon_deg, 0.0, lon_deg):
+            cell_lat = min(max(lat + dlat, -90.0), 90.0)
+            cell_lon = (lon + dlon + 180.0) % 360.0 - 180.0
+            prefix = encode(cell_lat, cell_lon, precision)
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+    return prefixes
+
+
+def prefix_filter(column, prefixes: List[str]):
+    """Condición SQL `column` empieza con alguno de los prefijos, como rangos indexables."""
+    # "{" es el carácter siguiente a "z", el último del alfabeto base32
+    return or_(*[and_(column >= prefix, column < prefix + "{") for prefix in prefixes])
+
+
+def backfill_geohashes(session, batch_size: int = 1000) -> int:
+    """Calcula el geohash de las propiedades que aún no lo tienen. Devuelve cuántas actualizó."""
+    from recommender_system.models import Property
+
+    updated = 0
+    while True:
+        props = (
+            session.query(Property)
+            .filter(Property.geohash.is_(None), Property.lat.isnot(None), Property.lon.isnot(None))
+            .limit(batch_size)
+            .all()
+        )
+        if not props:
+            return updated
+        for prop in props:
+            prop.geohash = encode(prop.lat, prop.lon)
+        session.commit()
+        updated += len(props)
@@ -0,0 +1,204 @@
+"""Ingesta masiva de propiedades con upserts por bloques.
+
+Cada bloque se escribe en una sola transacción con un único
+`INSERT ... ON CONFLICT (external_id) DO UPDATE` (Postgres y SQLite soportan la
+misma sintaxis). Igual que `notify_property`, una actualización sólo pisa los
+campos que vienen con valor.
+"""
+import math
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, null, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from recommender_system import changes, geo
+from recommender_system.feature_store import bump_version, load_properties
+from recommender_system.models import Property
+
+CHUNK_SIZE = int(os.environ.get("RECOMMENDER_INGEST_CHUNK", "1000"))
+
+# columnas que se actualizan en conflicto (sólo si el valor nuevo no es nulo)
+UPSERT_COLUMNS = ("comuna", "lat", "lon", "bedrooms", "price", "raw", "geohash")
+
+_BEDROOMS_RE = re.compile(r'^(\d+)')
+
+
+def parse_bedrooms(bedrooms_value):
+    """Parsea bedrooms: extrae int de string (e.g., '1 dormitorio' -> 1), o devuelve int/None."""
+    if isinstance(bedrooms_value, str):
+        match = _BEDROOMS_RE.match(bedrooms_value)  # Extrae dígitos al inicio
+        return int(match.group(1)) if match else None
+    elif isinstance(bedrooms_value, int):
+        return bedrooms_value
+    return None
+
+
+def parse_bedrooms_batch(values: Iterable[Any]) -> List[Any]:
+    """`parse_bedrooms` sobre un bloque completo de valores."""
+    return [parse_bedrooms(value) for value in values]
+
+
+def chunked(items: Iterable[Any], size: int = CHUNK_SIZE) -> Iterator[List[Any]]:
+    chunk: List[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _number(value, kind, low: float = -math.inf, high: float = math.inf):
+    """`value` convertido a `kind` (int o float), como lo haría `PropertyNotify`.
+
+    Acepta números y strings numéricos; cualquier otra cosa, un valor no finito o
+    fuera de `[low, high]` levanta ValueError.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"not a number: {value!r}")
+    number = float(value)
+    if not math.isfinite(number) or not low <= number <= high:
+        raise ValueError(f"out of range: {value!r}")
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError(f"not an integer: {value!r}")
+        return int(value) if isinstance(value, int) else int(number)
+    return number
+
+
+def to_row(item: Any) -> Optional[Dict[str, Any]]:
+    """Fila de `properties` para un payload, o None si no es válido.
+
+    Aplica los mismos tipos que `PropertyNotify`: sin `external_id` entero, con
+    lat/lon/price no numéricos (o fuera de rango), `comuna` que no es string,
+    `bedrooms` que no es int ni string o `raw` que no es un objeto, el elemento
+    se descarta.
+    """
+    if not isinstance(item, dict):
+        return None
+    try:
+        external_id = _number(item.get("external_id"), int)
+        lat = _number(item.get("lat"), float, -90.0, 90.0)
+        lon = _number(item.get("lon"), float, -180.0, 180.0)
+        price = _number(item.get("price"), float)
+    except ValueError:
+        return None
+    comuna, bedrooms, raw = item.get("comuna"), item.get("bedrooms"), item.get("raw")
+    if (external_id is None or not isinstance(comuna, (str, type(None)))
+            or isinstance(bedrooms, bool) or not isinstance(bedrooms, (int, str, type(None)))
+            or not isinstance(raw, (dict, type(None)))):
+        return None
+    return {
+        "external_id": external_id,
+        "comuna": comuna,
+        "lat": lat,
+        "lon": lon,
+        "bedrooms": bedrooms,
+        "price": price,
+        "raw": raw,
+        "geohash": geo.encode_optional(lat, lon),
+    }
+
+
+def to_rows(items: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Normaliza un bloque de payloads a filas de `properties`.
+
+    Devuelve `(filas, omitidas)`: se omiten los elementos inválidos (ver
+    `to_row`). Si el bloque repite un `external_id`, gana el último.
+    """
+    valid = [row for row in map(to_row, items) if row is not None]
+    bedrooms = parse_bedrooms_batch(row["bedrooms"] for row in valid)
+    rows: Dict[int, Dict[str, Any]] = {}
+    for row, parsed_bedrooms in zip(valid, bedrooms):
+        row["bedrooms"] = parsed_bedrooms
+        rows[row["external_id"]] = row
+    return list(rows.values()), len(items) - len(valid)
+
+
+def upsert_chunk(session, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """Inserta o actualiza un bloque en la transacción de `session` (sin commit).
+
+    Devuelve `(creadas, actualizadas)`.
+    """
+    if not rows:
+        return 0, 0
+    external_ids = [row["external_id"] for row in rows]
+    # external_id -> (lat, lon) vigentes de las que ya existen
+    existing = {external_id: (lat, lon) for external_id, lat, lon in session.execute(
+        select(Property.external_id, Property.lat, Property.lon).where(
+            Property.external_id.in_(external_ids)))}
+    version = bump_version(session)
+    for row in rows:
+        row["version"] = version
+        if row["external_id"] in existing and (row["lat"] is None) != (row["lon"] is None):
+            # sólo llegó lat o lon: el geohash sale del punto combinado con el valor previo
+            lat, lon = existing[row["external_id"]]
+            row["geohash"] = geo.encode_optional(
+                lat if row["lat"] is None else row["lat"], lon if row["lon"] is None else row["lon"])
+
+    dialect = session.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        # sin ON CONFLICT: se resuelve fila por fila dentro de la misma transacción
+        for row in rows:
+            if row["external_id"] in existing:
+                _update_existing(session, row)
+            else:
+                session.add(Property(**row))
+        return len(rows) - len(existing), len(existing)
+
+    insert = (postgresql if dialect == "postgresql" else sqlite).insert
+    # raw=None debe llegar como NULL de SQL (no JSON 'null') para que COALESCE conserve el valor previo
+    stmt = insert(Property).values(
+        [{**row, "raw": row["raw"] if row["raw"] is not None else null()} for row in rows])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Property.external_id],
+        set_={
+            **{name: func.coalesce(getattr(stmt.excluded, name), getattr(Property, name))
+               for name in UPSERT_COLUMNS},
+            "version": stmt.excluded.version,
+        },
+    )
+    session.execute(stmt)
+    return len(rows) - len(existing), len(existing)
+
+
+def _update_existing(session, row: Dict[str, Any]):
+    prop = session.execute(select(Property).where(
+        Property.external_id == row["external_id"])).scalar_one()
+    for name in UPSERT_COLUMNS:
+        if row[name] is not None:
+            setattr(prop, name, row[name])
+    prop.version = row["version"]
+
+
+def ingest_chunk(session_factory, items: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Escribe un bloque en su propia transacción y devuelve los conteos."""
+    rows, skipped = to_rows(items)
+    with session_factory() as session:
+        created, updated = upsert_chunk(session, rows)
+        # el estado escrito (el upsert conserva los campos que llegaron nulos), para el stream de cambios
+        written = load_properties(session, filters=[Property.external_id.in_(
+            [row["external_id"] for row in rows])]) if rows and changes.CHANGES_ENABLED else []
+        session.commit()
+    if written:
+        changes.publish_upserts(written, rows[0]["version"])
+    return {"created": created, "updated": updated, "skipped": skipped, "chunks": 1}
+
+
+def ingest(session_factory, items: Iterable[Dict[str, Any]], chunk_size: int = CHUNK_SIZE,
+           totals: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Escribe `items` en bloques de `chunk_size`, una transacción por bloque.
+
+    Los conteos se acumulan en `totals` (si se pasa) a medida que cada bloque
+    hace commit: si un bloque falla, ahí queda lo que sí se escribió.
+    """
+    totals = {"created": 0, "updated": 0, "skipped": 0, "chunks": 0} if totals is None else totals
+    for chunk in chunked(items, chunk_size):
+        for name, count in ingest_chunk(session_factory, chunk).items():
+            totals[name] += count
+    return totals
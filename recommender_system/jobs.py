@@ -0,0 +1,154 @@
+"""Espera de jobs sin polling: notificaciones de término por el bus de eventos.
+
+Cada worker publica `{"task_id", "status", "ts"}` en `JOBS_CHANNEL` cuando una
+tarea termina (después de que Celery guardó el resultado en el backend). En el
+maestro hay un único suscriptor (el hilo de pub/sub de events.py) que reparte
+cada notificación a las peticiones que esperan ese `task_id`:
+
+  - `GET /recommender/job/{task_id}/wait?timeout=` (long-poll)
+  - `GET /recommender/job/{task_id}/events?timeout=` (server-sent events)
+
+Cada espera lee el backend una vez al empezar, otra cuando llega la
+notificación y otra al vencer el plazo (y en SSE, en cada keepalive), en vez
+de una vez por poll del cliente. Las relecturas sin aviso cubren las
+notificaciones perdidas (Redis pub/sub no guarda lo publicado mientras el
+suscriptor se reconecta).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from recommender_system import aio, events, metrics
+
+logger = logging.getLogger(__name__)
+
+JOBS_CHANNEL = "recommender:jobs"
+# espera por defecto y máxima (segundos) de /wait y /events
+WAIT_TIMEOUT = float(os.environ.get("RECOMMENDER_JOB_WAIT_TIMEOUT", "30"))
+WAIT_MAX = float(os.environ.get("RECOMMENDER_JOB_WAIT_MAX", "300"))
+# cada cuántos segundos se manda un comentario SSE para mantener viva la conexión
+SSE_KEEPALIVE = 15.0
+# tareas cuyo término se notifica (las que un cliente puede estar esperando)
+NOTIFIED_TASKS = ("compute_recommendations", "compute_recommendations_batch")
+
+WAITERS = metrics.REGISTRY.gauge(
+    "recommender_job_waiters", "Peticiones esperando el término de un job (long-poll y SSE)")
+NOTIFY_DELAY = metrics.REGISTRY.histogram(
+    "recommender_job_notify_delay_seconds",
+    "Tiempo entre el término de una tarea en el worker y el aviso a quienes la esperan")
+
+
+def notify_done(task_id: str, status: str):
+    """Lado worker: avisa que `task_id` terminó (los errores sólo se registran)."""
+    events.publish(JOBS_CHANNEL, {"task_id": task_id, "status": status, "ts": time.time()})
+
+
+def _resolve(future: asyncio.Future, message: Dict[str, Any]):
+    if not future.done():
+        future.set_result(message)
+
+
+class JobWaiters:
+    """Registro de peticiones esperando jobs, alimentado por un solo suscriptor del proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # task_id -> [(event loop, future)] de cada petición que lo espera
+        self._waiting: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+        self._subscribed = False
+        # peticiones en espera (las ya avisadas siguen contando hasta que terminan)
+        self._count = 0
+
+    def _on_message(self, message: Dict[str, Any]):
+        # corre en el hilo de pub/sub (o en el que publica, sin Redis)
+        with self._lock:
+            waiting = self._waiting.pop(message.get("task_id"), [])
+        if waiting and "ts" in message:
+            NOTIFY_DELAY.labels().observe(max(0.0, time.time() - message["ts"]))
+        for loop, future in waiting:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, message)
+            except RuntimeError:
+                # el event loop de esa petición ya cerró
+                pass
+
+    def _register(self, task_id: str) -> asyncio.Future:
+        with self._lock:
+            if not self._subscribed:
+                events.subscribe(JOBS_CHANNEL, self._on_message)
+                self._subscribed = True
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._waiting.setdefault(task_id, []).append((loop, future))
+            self._count += 1
+            WAITERS.labels().set(self._count)
+        return future
+
+    def _discard(self, task_id: str, future: asyncio.Future):
+        with self._lock:
+            waiting = self._waiting.get(task_id)
+            if waiting is not None:
+                waiting[:] = [item for item in waiting if item[1] is not future]
+                if not waiting:
+                    del self._waiting[task_id]
+            self._count -= 1
+            WAITERS.labels().set(self._count)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._count
+
+    async def stream(self, task_id: str, timeout: float,
+                     keepalive: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Entrega el estado actual y, si no ha terminado, el estado final al llegar el aviso.
+
+        Con `keepalive` entrega None cada `keepalive` segundos sin novedades; en
+        cada uno se relee el backend, igual que al vencer `timeout`, por si el
+        aviso se perdió. Termina con el estado final o, si el job sigue sin
+        terminar al vencer `timeout`, sin él.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # registrarse antes de leer el estado: un aviso entre ambos no se pierde
+        future = self._register(task_id)
+        try:
+            state = await aio.task_state(task_id)
+            yield state
+            while not state["ready"]:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    # plazo vencido: se relee por si el aviso se perdió (ej. Redis reiniciado)
+                    state = await aio.task_state(task_id)
+                    if state["ready"]:
+                        yield state
+                    return
+                wait = remaining if keepalive is None else min(keepalive, remaining)
+                done, _ = await asyncio.wait({future}, timeout=wait)
+                if done:
+                    self._discard(task_id, future)
+                    future = self._register(task_id)
+                elif keepalive is None or wait >= remaining:
+                    continue
+                state = await aio.task_state(task_id)
+                if state["ready"]:
+                    yield state
+                elif not done:
+                    yield None
+        finally:
+            self._discard(task_id, future)
+
+    async def wait(self, task_id: str, timeout: float) -> Dict[str, Any]:
+        """Estado del job en cuanto termina, o el vigente al vencer `timeout`."""
+        state = None
+        async for state in self.stream(task_id, timeout):
+            pass
+        if not state["ready"]:
+            # el estado vigente (ej. STARTED) en vez del leído al empezar
+            state = await aio.task_state(task_id)
+        return state
+
+
+waiters = JobWaiters()
@@ -0,0 +1,220 @@
+"""Logging barato para el camino caliente: muestreado, estructurado y sin bloquear.
+
+`setup_logging()` instala en el logger raíz un `QueueHandler`: quien loguea sólo
+encola el `LogRecord` (sin formatearlo) y un hilo (`QueueListener`) le da formato
+y lo escribe. Si la cola se llena los registros se descartan y se cuentan en
+`recommender_log_dropped_total`, en vez de frenar la petición.
+
+  - `RECOMMENDER_LOG_FORMAT`: "json" (una línea JSON por registro) o "text".
+  - `RECOMMENDER_REQUEST_LOG_SAMPLE`: fracción de peticiones que se registran;
+    las con error (5xx) y las lentas se registran siempre.
+  - `RECOMMENDER_LOG_MAX_CHARS`: largo máximo de un mensaje o payload registrado.
+
+Los headers sólo se registran con nivel DEBUG, y con los sensibles ocultos
+(`redact_headers`). Para payloads grandes se usa `Truncated(valor)`: el `repr`
+se calcula (recortado) sólo si el registro llega a escribirse.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple, Union
+
+from recommender_system import metrics
+
+LOG_LEVEL = os.environ.get("RECOMMENDER_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("RECOMMENDER_LOG_FORMAT", "json").lower()
+REQUEST_LOG_SAMPLE = float(os.environ.get("RECOMMENDER_REQUEST_LOG_SAMPLE", "0.01"))
+# peticiones más lentas que esto (segundos) se registran siempre
+SLOW_REQUEST = float(os.environ.get("RECOMMENDER_REQUEST_LOG_SLOW_MS", "1000")) / 1000
+MAX_CHARS = int(os.environ.get("RECOMMENDER_LOG_MAX_CHARS", "1000"))
+# registros en espera de ser escritos; al llenarse se descartan
+QUEUE_SIZE = int(os.environ.get("RECOMMENDER_LOG_QUEUE_SIZE", "10000"))
+
+REDACTED_HEADERS = frozenset((
+    "authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key", "x-auth-token"))
+REDACTED = "[redacted]"
+
+access_logger = logging.getLogger("recommender_system.access")
+
+DROPPED = metrics.REGISTRY.counter(
+    "recommender_log_dropped_total", "Registros de log descartados por cola llena")
+
+
+def truncate(text: str, limit: int = MAX_CHARS) -> str:
+    """`text` recortado a `limit` caracteres, indicando cuántos se omitieron."""
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+
+class Truncated:
+    """Envuelve un valor para loguearlo como argumento: el `repr` recortado se arma al escribir."""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: int = MAX_CHARS):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        return truncate(repr(self.value), self.limit)
+
+    __repr__ = __str__
+
+
+Headers = Union[Mapping[str, str], Iterable[Tuple[bytes, bytes]]]
+
+
+def redact_headers(headers: Headers) -> Dict[str, str]:
+    """Headers como dict, con los valores sensibles (credenciales, cookies) ocultos."""
+    items = headers.items() if isinstance(headers, Mapping) else headers
+    redacted = {}
+    for name, value in items:
+        if isinstance(name, bytes):
+            name, value = name.decode("latin-1"), value.decode("latin-1")
+        name = name.lower()
+        redacted[name] = REDACTED if name in REDACTED_HEADERS else truncate(value, 200)
+    return redacted
+
+
+def request_sampled(status: int, seconds: float, rate: Optional[float] = None) -> bool:
+    """Si la petición se registra: errores y lentas siempre, el resto con probabilidad `rate`."""
+    rate = REQUEST_LOG_SAMPLE if rate is None else rate
+    return status >= 500 or seconds >= SLOW_REQUEST or random.random() < rate
+
+
+def log_request(scope: Dict[str, Any], status: int, seconds: float):
+    """Registra una petición ASGI terminada, si sale en la muestra (ver `request_sampled`)."""
+    if not request_sampled(status, seconds) or not access_logger.isEnabledFor(logging.INFO):
+        return
+    duration_ms = round(seconds * 1000, 2)
+    fields = {
+        "method": scope.get("method"),
+        "path": scope.get("path"),
+        "route": getattr(scope.get("route"), "path", None),
+        "status": status,
+        "duration_ms": duration_ms,
+        "sample_rate": REQUEST_LOG_SAMPLE,
+    }
+    if scope.get("query_string"):
+        fields["query"] = truncate(scope["query_string"].decode("latin-1"), 200)
+    if access_logger.isEnabledFor(logging.DEBUG):
+        fields["headers"] = redact_headers(scope.get("headers") or ())
+    level = logging.ERROR if status >= 500 else logging.INFO
+    access_logger.log(level, "%s %s %s %.1fms", fields["method"], fields["path"], status,
+                      duration_ms, extra={"fields": fields})
+
+
+def _timestamp(record: logging.LogRecord) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + \
+        f".{int(record.msecs):03d}Z"
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro; los campos de `extra={"fields": {...}}` van al primer nivel."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": _timestamp(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para desarrollo, con los campos extra como `clave=valor`."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = truncate(record.message)
+        text = super().formatMessage(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Encola el registro tal cual (el formato lo aplica el listener) y lo descarta si no cabe."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.labels().inc()
+
+
+_handler: Optional[_NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def _start_listener(target: logging.Handler):
+    global _listener
+    _handler.queue = queue.Queue(QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, target, respect_handler_level=True)
+    _listener.start()
+
+
+def _after_fork():
+    # el hilo del listener no sobrevive al fork (workers prefork de Celery, pools de rebuild)
+    if _listener is not None:
+        _start_listener(_listener.handlers[0])
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def setup_logging(level: Union[str, int, None] = None, stream=None, fmt: Optional[str] = None,
+                  force: bool = False):
+    """Configura el logger raíz con la cola no bloqueante.
+
+    Como `logging.basicConfig`, no hace nada si el raíz ya tiene handlers
+    (ej. los de pytest o los que configuró quien embebe la app), salvo con `force`.
+    """
+    global _handler
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return
+    stop_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    # la cola la crea `_start_listener` (de nuevo en cada proceso hijo)
+    _handler = _NonBlockingQueueHandler(None)
+    _start_listener(target)
+    root.addHandler(_handler)
+    root.setLevel(level or LOG_LEVEL)
+
+
+def stop_logging():
+    """Escribe lo pendiente en la cola y quita el handler instalado por `setup_logging`."""
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+
+atexit.register(stop_logging)
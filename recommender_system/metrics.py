@@ -0,0 +1,323 @@
+"""Métricas livianas en formato de texto de Prometheus.
+
+Contadores, gauges e histogramas en memoria, con etiquetas, pensados para el camino
+caliente: una observación es una búsqueda en un dict, un `bisect` y unas sumas
+bajo un lock (del orden de 1 µs). Con `RECOMMENDER_METRICS=false` las
+observaciones no hacen nada.
+
+Cada proceso worker publica periódicamente sus métricas en Redis
+(`start_collector`); el maestro las suma a las suyas al responder
+GET /recommender/metrics.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get(
+    "RECOMMENDER_METRICS", "true").lower() in ("1", "true", "yes")
+# cada cuántos segundos un worker publica sus métricas
+PUSH_INTERVAL = float(os.environ.get("RECOMMENDER_METRICS_PUSH_INTERVAL", "15"))
+REMOTE_PREFIX = "recommender:metrics:"
+
+# segundos: de 100 µs a 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Noop:
+    """Serie que descarta las observaciones (métricas deshabilitadas)."""
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def time(self):
+        return _Timer(self)
+
+
+_NOOP = _Noop()
+
+
+class _Timer:
+    """Context manager que observa la duración del bloque en segundos."""
+    __slots__ = ("_series", "_start")
+
+    def __init__(self, series):
+        self._series = series
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._series.observe(time.perf_counter() - self._start)
+
+
+class _CounterSeries:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class _GaugeSeries(_CounterSeries):
+    __slots__ = ()
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramSeries:
+    __slots__ = ("_lock", "_buckets", "counts", "sum")
+
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self._buckets = buckets
+        # un contador por bucket más el de +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        i = bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        return {"counts": list(self.counts), "sum": self.sum}
+
+
+class Metric:
+    """Métrica con nombre y etiquetas; `labels(...)` entrega (y memoriza) la serie."""
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help: str, labelnames: Sequence[str] = ()):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values):
+        if not self._registry.enabled:
+            return _NOOP
+        key = tuple(str(v) for v in values)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind, "help": self.help, "labelnames": list(self.labelnames),
+            "series": [[list(key), series.snapshot()] for key, series in list(self._series.items())],
+        }
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_series(self):
+        return _CounterSeries(self._lock)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_series(self):
+        return _GaugeSeries(self._lock)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(self._lock, self.buckets)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**super().snapshot(), "buckets": list(self.buckets)}
+
+
+class Registry:
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(self, name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado serializable (JSON) de todas las métricas del proceso."""
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    def render(self, remote: Sequence[Dict[str, Any]] = ()) -> str:
+        """Texto de Prometheus con las métricas propias más las de `remote` (sumadas)."""
+        return render(merge([self.snapshot(), *remote]))
+
+
+def merge(snapshots: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Suma varios snapshots serie a serie (también los gauges: cada uno lo escribe un solo proceso)."""
+    merged: Dict[str, Any] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "series": {}})
+            for labels, value in metric["series"]:
+                key = tuple(labels)
+                current = target["series"].get(key)
+                if current is None:
+                    target["series"][key] = json.loads(json.dumps(value))
+                elif metric["kind"] in ("counter", "gauge"):
+                    target["series"][key] = current + value
+                else:
+                    current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                    current["sum"] += value["sum"]
+    for metric in merged.values():
+        metric["series"] = [[list(key), value] for key, value in metric["series"].items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render(snapshot: Dict[str, Any]) -> str:
+    lines: List[str] = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        names = metric["labelnames"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for values, value in metric["series"]:
+            if metric["kind"] in ("counter", "gauge"):
+                lines.append(f"{name}{_labels(names, values)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + ["+Inf"], value["counts"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f"{name}_bucket{_labels(names, values, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, values)} {value['sum']}")
+            lines.append(f"{name}_count{_labels(names, values)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# métricas compartidas por el maestro y los workers
+REQUEST_LATENCY = REGISTRY.histogram(
+    "recommender_http_request_duration_seconds",
+    "Latencia de las requests HTTP por ruta", ("method", "route", "status"))
+HTTP_BYTES = REGISTRY.counter(
+    "recommender_http_payload_bytes_total",
+    "Bytes de cuerpos HTTP recibidos (request) y enviados (response)", ("route", "direction"))
+STAGE_LATENCY = REGISTRY.histogram(
+    "recommender_stage_duration_seconds",
+    "Duración de cada etapa del cálculo de recomendaciones", ("stage",))
+QUEUE_WAIT = REGISTRY.histogram(
+    "recommender_task_queue_wait_seconds",
+    "Tiempo entre que se encola una tarea y que un worker la empieza", ("task", "queue"),
+    buckets=LATENCY_BUCKETS + (30.0, 60.0, 300.0))
+TASK_LATENCY = REGISTRY.histogram(
+    "recommender_task_duration_seconds",
+    "Duración de las tareas Celery", ("task", "state"))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "recommender_queue_depth",
+    "Mensajes esperando en cada cola de Celery (al momento del scrape)", ("queue",))
+TASK_PAYLOAD_ITEMS = REGISTRY.counter(
+    "recommender_task_payload_properties_total",
+    "Propiedades recibidas dentro de los mensajes de tareas (modo inline)", ("task",))
+
+
+def stage(name: str):
+    """Timer de una etapa: `with stage("query"): ...`."""
+    return STAGE_LATENCY.labels(name).time()
+
+
+def push(client, key: str, ttl: float):
+    client.set(key, json.dumps(REGISTRY.snapshot()), ex=max(1, int(ttl)))
+
+
+def start_collector(client, key: str, interval: float = PUSH_INTERVAL) -> Optional[threading.Thread]:
+    """Publica las métricas del proceso en Redis cada `interval` segundos (hilo daemon)."""
+    if not REGISTRY.enabled or client is None:
+        return None
+
+    def run():
+        while True:
+            try:
+                push(client, key, interval * 3)
+            except Exception as e:
+                logger.warning(f"No se pudieron publicar las métricas: {str(e)}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-collector", daemon=True)
+    thread.start()
+    return thread
+
+
+def collect_remote(client) -> List[Dict[str, Any]]:
+    """Snapshots publicados por los workers (vacío sin Redis)."""
+    if client is None:
+        return []
+    snapshots = []
+    for key in client.scan_iter(match=f"{REMOTE_PREFIX}*"):
+        raw = client.get(key)
+        if raw:
+            snapshots.append(json.loads(raw))
+    return snapshots
@@ -1,10 +1,17 @@
-from sqlalchemy import Column, Integer, String, Float
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String
 from sqlalchemy.types import JSON as JSONType
 from .database import Base
 
 
 class Property(Base):
     __tablename__ = "properties"
+    __table_args__ = (
+        # selección de candidatos por comuna, dormitorios y banda de precio
+        Index("ix_properties_comuna_bedrooms_price",
+              "comuna", "bedrooms", "price"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     external_id = Column(Integer, unique=True, index=True, nullable=True)
@@ -14,6 +21,10 @@ class Property(Base):
     bedrooms = Column(Integer, nullable=True)
     price = Column(Float, nullable=True)
     raw = Column(JSONType, nullable=True)
+    # geohash de (lat, lon) para consultas por radio (ver geo.py)
+    geohash = Column(String(12), index=True, nullable=True)
+    # versión del catálogo en la que se escribió la fila por última vez
+    version = Column(Integer, index=True, nullable=True)
 
     def to_dict(self):
         return {
@@ -26,3 +37,79 @@ class Property(Base):
             "price": self.price,
             "raw": self.raw,
         }
+
+
+class CatalogVersion(Base):
+    """Versión monotónica del catálogo de propiedades (una sola fila, id=1).
+
+    Se incrementa en cada escritura sobre `properties` y permite a los workers
+    saber si su copia de las propiedades sigue vigente.
+    """
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class Recommendation(Base):
+    """Recomendación calculada por un worker para un usuario.
+
+    Cada fila es una propiedad recomendada (`rank` 1..3) a partir de la
+    propiedad que el usuario agendó (`source_property_id`).
+    """
+    __tablename__ = "recommendations"
+    __table_args__ = (
+        Index("ix_recommendations_user_created", "user_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, nullable=False)
+    source_property_id = Column(Integer, nullable=False)
+    property_id = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False)
+    distance_km = Column(Float, nullable=True)
+    knn_distance = Column(Float, nullable=True)
+    task_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "source_property_id": self.source_property_id,
+            "property_id": self.property_id,
+            "rank": self.rank,
+            "distance_km": self.distance_km,
+            "knn_distance": self.knn_distance,
+            "task_id": self.task_id,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class PropertyNeighbor(Base):
+    """Vecino precalculado (`rank` 1..K) de una propiedad origen.
+
+    La tabla la llena `precompute_neighbors` y la mantiene `refresh_neighbors`
+    (ver precompute.py). `policy_key` identifica la política de candidatos y el
+    ranking con que se calculó, para no servir filas de otra configuración.
+    """
+    __tablename__ = "property_neighbors"
+    __table_args__ = (
+        Index("ix_property_neighbors_source",
+              "policy_key", "source_property_id", "rank"),
+        # quién tiene a una propiedad entre sus vecinos (refresco incremental)
+        Index("ix_property_neighbors_neighbor",
+              "policy_key", "neighbor_property_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    policy_key = Column(String, nullable=False)
+    # external_id de la propiedad origen y del vecino
+    source_property_id = Column(Integer, nullable=False)
+    neighbor_property_id = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False)
+    distance_km = Column(Float, nullable=True)
+    knn_distance = Column(Float, nullable=True)
+    score = Column(Float, nullable=True)
+    # versión del catálogo con que se calculó la fila
+    version = Column(Integer, nullable=True)
@@ -0,0 +1,184 @@
+"""Tabla precalculada de vecinos (`property_neighbors`).
+
+Con `RECOMMENDER_PRECOMPUTE_NEIGHBORS=true`, `create_job` responde con una sola
+consulta por índice a esta tabla y sólo encola la tarea si la propiedad no
+tiene filas.
+
+  - `precompute_neighbors` (cola bulk) recalcula la tabla completa desde el
+    índice KNN del worker.
+  - `refresh_neighbors` recalcula sólo los vecindarios afectados por un cambio
+    (ver `tasks.affected_sources`); `notify_property` lo encola en cada escritura.
+  - `check_neighbors` compara una muestra contra KNN por fuerza bruta.
+
+La tabla es eventualmente consistente: entre la escritura y el refresco se
+sirven los vecinos anteriores.
+
+Uso:
+    python -m recommender_system.precompute build
+    python -m recommender_system.precompute check --sample 500
+"""
+import argparse
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, insert, select
+
+from recommender_system import features, metrics
+from recommender_system.celery_config.neighbors import backend_key
+from recommender_system.database import SessionLocal
+from recommender_system.feature_store import FEATURE_COLUMNS, feature_columns
+from recommender_system.models import Property, PropertyNeighbor
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTE_ENABLED = os.environ.get(
+    "RECOMMENDER_PRECOMPUTE_NEIGHBORS", "false").lower() in ("1", "true", "yes")
+# vecinos más cercanos de una propiedad cambiada que se revisan al refrescar
+FANOUT = int(os.environ.get("RECOMMENDER_PRECOMPUTE_FANOUT", "30"))
+# orígenes por transacción al recalcular la tabla completa
+CHUNK_SIZE = 2000
+# límite de parámetros por cláusula IN
+_IN_BATCH = 500
+
+LOOKUPS = metrics.REGISTRY.counter(
+    "recommender_precomputed_lookups_total",
+    "Consultas a la tabla de vecinos precalculados", ("outcome",))
+
+
+def policy_key(policy, ranking: str) -> str:
+    """Identifica las filas de una configuración: política, ranking, features y backend de vecinos."""
+    return f"{ranking}:{policy.key()!r}:{features.model_key()}:{backend_key()}"
+
+
+def _batches(values: List[Any]) -> Iterable[List[Any]]:
+    for start in range(0, len(values), _IN_BATCH):
+        yield values[start:start + _IN_BATCH]
+
+
+def store_neighbors(results: Dict[int, Any], key: str, version: Optional[int],
+                    session_factory=SessionLocal) -> int:
+    """Reemplaza las filas de los orígenes de `results` (los errores sólo borran)."""
+    rows = []
+    for source, result in results.items():
+        if not isinstance(result, list):
+            continue
+        for rank, rec in enumerate(result, 1):
+            rows.append({
+                "policy_key": key,
+                "source_property_id": source,
+                "neighbor_property_id": rec["property"].get("external_id"),
+                "rank": rank,
+                "distance_km": float(rec["distance_km"]),
+                "knn_distance": float(rec["knn_distance"]),
+                "score": rec.get("score"),
+                "version": version,
+            })
+    with session_factory() as session:
+        for batch in _batches(list(results)):
+            session.execute(delete(PropertyNeighbor).where(
+                PropertyNeighbor.policy_key == key,
+                PropertyNeighbor.source_property_id.in_(batch)))
+        if rows:
+            session.execute(insert(PropertyNeighbor), rows)
+        session.commit()
+    return len(rows)
+
+
+def prune(key: str, before_version: int, session_factory=SessionLocal) -> int:
+    """Borra filas no reescritas desde `before_version` (orígenes que ya no existen)."""
+    with session_factory() as session:
+        deleted = session.execute(delete(PropertyNeighbor).where(
+            PropertyNeighbor.policy_key == key,
+            PropertyNeighbor.version < before_version)).rowcount
+        session.commit()
+    return deleted
+
+
+def lookup(property_id: int, key: str, session_factory=SessionLocal) -> Optional[List[Dict[str, Any]]]:
+    """Vecinos precalculados con el formato de `compute_recommendations`, o None."""
+    columns = feature_columns()
+    query = (
+        select(PropertyNeighbor.distance_km, PropertyNeighbor.knn_distance,
+               PropertyNeighbor.score, *columns)
+        .join(Property, Property.external_id == PropertyNeighbor.neighbor_property_id)
+        .where(PropertyNeighbor.policy_key == key,
+               PropertyNeighbor.source_property_id == property_id)
+        .order_by(PropertyNeighbor.rank)
+    )
+    with session_factory() as session:
+        rows = session.execute(query).all()
+    if not rows:
+        LOOKUPS.labels("miss").inc()
+        return None
+    LOOKUPS.labels("hit").inc()
+    result = []
+    for distance_km, knn_distance, score, *values in rows:
+        rec = {"property": dict(zip(FEATURE_COLUMNS, values)),
+               "distance_km": distance_km, "knn_distance": knn_distance}
+        if score is not None:
+            rec["score"] = score
+        result.append(rec)
+    return result
+
+
+def sources_with_neighbor(session, property_ids: List[int], key: str) -> Set[int]:
+    """Orígenes que hoy tienen alguna de `property_ids` entre sus vecinos."""
+    sources: Set[int] = set()
+    for batch in _batches(property_ids):
+        sources.update(session.execute(
+            select(PropertyNeighbor.source_property_id).where(
+                PropertyNeighbor.policy_key == key,
+                PropertyNeighbor.neighbor_property_id.in_(batch))).scalars())
+    return sources
+
+
+def worst_distances(session, sources: List[int], key: str) -> Dict[int, Tuple[int, float]]:
+    """Por origen: (cantidad de vecinos guardados, mayor knn_distance)."""
+    found: Dict[int, Tuple[int, float]] = {}
+    for batch in _batches(sources):
+        rows = session.execute(
+            select(PropertyNeighbor.source_property_id, func.count(),
+                   func.max(PropertyNeighbor.knn_distance))
+            .where(PropertyNeighbor.policy_key == key,
+                   PropertyNeighbor.source_property_id.in_(batch))
+            .group_by(PropertyNeighbor.source_property_id))
+        found.update({source: (count, worst) for source, count, worst in rows})
+    return found
+
+
+def _neighbor_ids(result) -> List[int]:
+    if not isinstance(result, list):
+        return []
+    return sorted(rec["property"].get("external_id") for rec in result)
+
+
+def compare(stored: Dict[int, Any], expected: Dict[int, Any], examples: int = 10) -> Dict[str, Any]:
+    """Resumen de diferencias entre los vecinos guardados y los esperados."""
+    mismatches = []
+    missing = 0
+    for source, result in expected.items():
+        if stored.get(source) is None and isinstance(result, list) and result:
+            missing += 1
+        want, got = _neighbor_ids(result), _neighbor_ids(stored.get(source))
+        if want != got:
+            mismatches.append({"property_id": source, "stored": got, "expected": want})
+    return {"sampled": len(expected), "mismatched": len(mismatches),
+            "missing": missing, "examples": mismatches[:examples]}
+
+
+if __name__ == "__main__":
+    from recommender_system.celery_config.tasks import check_neighbors, precompute_neighbors
+
+    parser = argparse.ArgumentParser(description="Tabla de vecinos precalculados")
+    parser.add_argument("command", choices=("build", "check"))
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "build":
+        print(json.dumps(precompute_neighbors()))
+    else:
+        print(json.dumps(check_neighbors(args.sample, args.seed), indent=2))
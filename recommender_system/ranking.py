@@ -0,0 +1,64 @@
+"""Ranking final de las recomendaciones a partir de los vecinos del KNN.
+
+Sólo depende de NumPy: el maestro lo importa (para la llave del caché de
+resultados) sin cargar scikit-learn.
+"""
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+from recommender_system.celery_config.controllers import haversine_np
+
+# Ranking final:
+#  - "knn": los k vecinos más cercanos en el espacio escalado (lat, lon, price)
+#  - "rerank": el KNN trae RECOMMENDER_RERANK_CANDIDATES vecinos y se reordenan por
+#    distancia geográfica real más una penalización por diferencia de precio
+RANKING = os.environ.get("RECOMMENDER_RANKING", "knn")
+RERANK_CANDIDATES = int(os.environ.get("RECOMMENDER_RERANK_CANDIDATES", "50"))
+# km equivalentes a una diferencia de precio del 100% respecto al origen
+RERANK_PRICE_KM = float(os.environ.get("RECOMMENDER_RERANK_PRICE_KM", "5.0"))
+
+
+def format_recommendations(origen: Dict[str, Any], neighbors, k: int = 3, ranking: str = RANKING) -> List[Dict[str, Any]]:
+    """Arma la respuesta a partir de pares `(propiedad, knn_distance)`.
+
+    Las distancias geográficas de todos los vecinos se calculan en una sola
+    pasada vectorizada; en modo "rerank" esa misma pasada produce el puntaje
+    con que se eligen los k mejores.
+    """
+    if not neighbors:
+        return []
+    props = [prop for prop, _ in neighbors]
+    distances_km = haversine_np(
+        origen.get("lat") or 0, origen.get("lon") or 0,
+        np.array([p.get("lat") or 0 for p in props], dtype=float),
+        np.array([p.get("lon") or 0 for p in props], dtype=float),
+    )
+    scores = None
+    if ranking == "rerank":
+        scores = rerank_scores(origen, props, distances_km)
+        order = np.argsort(scores, kind="stable")[:k]
+    else:
+        order = range(min(k, len(props)))
+
+    result = []
+    for i in order:
+        rec = {
+            "property": props[i],
+            "distance_km": float(distances_km[i]),
+            "knn_distance": neighbors[i][1],
+        }
+        if scores is not None:
+            rec["score"] = float(scores[i])
+        result.append(rec)
+    return result
+
+
+def rerank_scores(origen: Dict[str, Any], props: List[Dict[str, Any]], distances_km: np.ndarray) -> np.ndarray:
+    """Puntaje exacto (menor es mejor): km reales + penalización relativa de precio."""
+    origen_price = origen.get("price") or 0
+    if not origen_price:
+        return distances_km
+    prices = np.array([p.get("price") or 0 for p in props], dtype=float)
+    return distances_km + RERANK_PRICE_KM * np.abs(prices - origen_price) / origen_price
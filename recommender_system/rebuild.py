@@ -0,0 +1,77 @@
+"""Reconstrucción completa en varios núcleos: snapshot, índice y tabla de vecinos.
+
+  1. lee el catálogo de la DB por bloques directo a columnas (`snapshot.load_columns`)
+     y, con `RECOMMENDER_SNAPSHOT_DIR`, lo publica como snapshot versionado;
+  2. escala las features y construye el índice una vez, en este proceso;
+  3. reparte los orígenes entre `RECOMMENDER_REBUILD_WORKERS` procesos que heredan
+     el índice (fork) y escriben sus filas en `property_neighbors` con la versión
+     del catálogo;
+  4. al terminar todos, borra las filas de versiones anteriores: la tabla queda
+     completa en una sola versión.
+
+Las tareas Celery (`precompute_neighbors`) usan un solo proceso: los procesos
+del pool de Celery no deberían crear hijos. Este módulo es para cron o para un
+job aparte con todos los núcleos del host.
+
+Uso:
+    python -m recommender_system.rebuild --workers 8
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from recommender_system import snapshot
+from recommender_system.database import SessionLocal
+from recommender_system.celery_config.knn_index import PropertyIndex
+from recommender_system.celery_config.tasks import build_neighbor_table
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# 0 = todos los núcleos disponibles
+WORKERS = int(os.environ.get("RECOMMENDER_REBUILD_WORKERS", "0")) or available_cores()
+
+
+def rebuild(workers: int = WORKERS, session_factory=SessionLocal,
+            snapshot_dir: Optional[str] = snapshot.SNAPSHOT_DIR) -> Dict[str, Any]:
+    """Reconstruye snapshot, índice y tabla de vecinos; devuelve el tiempo de cada etapa."""
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    if snapshot_dir:
+        with session_factory() as session:
+            snapshot.export_snapshot(session, snapshot_dir)
+        timings["snapshot_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = PropertyIndex(session_factory, snapshot_dir=snapshot_dir)
+    index.rebuild()
+    timings["index_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report = build_neighbor_table(index, session_factory, workers=workers)
+    timings["neighbors_s"] = time.perf_counter() - start
+
+    report.update(workers=workers, **timings)
+    logger.info(
+        f"Reconstrucción completa: version={report['version']}, workers={workers}, "
+        f"etapas={', '.join(f'{name}={value:.1f}' for name, value in timings.items())}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(rebuild(args.workers), indent=2))
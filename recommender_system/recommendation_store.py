@@ -0,0 +1,115 @@
+"""Persistencia de las recomendaciones calculadas y lectura cacheada por usuario.
+
+Los workers insertan en bloque en la tabla `recommendations` y publican los
+usuarios afectados; el maestro mantiene un caché read-through por usuario que
+se invalida con esos eventos (y que expira por TTL si algún evento se pierde).
+
+Cada invalidación avanza la generación del usuario; una lectura de la DB sólo
+se guarda en caché si la generación no cambió mientras se leía (si no, podría
+guardar filas anteriores a una invalidación que ya llegó).
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from recommender_system import events
+from recommender_system.cache import TTLCache
+from recommender_system.database import SessionLocal
+from recommender_system.models import Recommendation
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "recommender:recommendations"
+# filas que se guardan en caché por usuario; `limit` del endpoint no puede superarlo
+MAX_RECOMMENDATIONS = 100
+
+cache = TTLCache(
+    maxsize=int(os.environ.get("RECOMMENDER_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("RECOMMENDER_CACHE_TTL", "60")),
+)
+# generaciones por franja de usuarios (hash del user_id): acotadas en memoria; dos
+# usuarios en la misma franja sólo se quitan alguna escritura en caché
+GENERATION_STRIPES = 4096
+_generations = [0] * GENERATION_STRIPES
+_lock = threading.Lock()
+_subscribed = False
+
+
+def save_recommendations(entries: Iterable[Tuple[Any, int, Any]], task_id: Optional[str] = None, session_factory=SessionLocal) -> int:
+    """Inserta en bloque los resultados `(user_id, property_id, result)`.
+
+    Los resultados que no son listas (errores) se omiten. Devuelve la cantidad
+    de filas insertadas.
+    """
+    # una misma marca de tiempo por escritura: así se ordenan por job y luego por rank
+    created_at = datetime.utcnow()
+    rows = []
+    for user_id, source_property_id, result in entries:
+        if not isinstance(result, list):
+            continue
+        for rank, rec in enumerate(result, 1):
+            rows.append({
+                "user_id": str(user_id),
+                "source_property_id": source_property_id,
+                "property_id": rec["property"].get("external_id"),
+                "rank": rank,
+                "distance_km": float(rec["distance_km"]),
+                "knn_distance": float(rec["knn_distance"]),
+                "task_id": task_id,
+                "created_at": created_at,
+            })
+    if not rows:
+        return 0
+    with session_factory() as session:
+        session.execute(insert(Recommendation), rows)
+        session.commit()
+    events.publish(INVALIDATION_CHANNEL, {
+                   "user_ids": sorted({row["user_id"] for row in rows})})
+    return len(rows)
+
+
+def _stripe(user_id) -> int:
+    return hash(str(user_id)) % GENERATION_STRIPES
+
+
+def _on_invalidation(message: Dict[str, Any]):
+    with _lock:
+        for user_id in message.get("user_ids", ()):
+            _generations[_stripe(user_id)] += 1
+            cache.invalidate(user_id)
+
+
+def _ensure_subscribed():
+    global _subscribed
+    if _subscribed:
+        return
+    with _lock:
+        if not _subscribed:
+            events.subscribe(INVALIDATION_CHANNEL, _on_invalidation)
+            _subscribed = True
+
+
+def get_user_recommendations(user_id: str, limit: int = 20, session_factory=SessionLocal) -> List[Dict[str, Any]]:
+    """Recomendaciones más recientes del usuario, servidas desde caché si es posible."""
+    _ensure_subscribed()
+    rows = cache.get(user_id)
+    if rows is None:
+        stripe = _stripe(user_id)
+        generation = _generations[stripe]
+        with session_factory() as session:
+            query = (
+                select(Recommendation)
+                .where(Recommendation.user_id == user_id)
+                .order_by(Recommendation.created_at.desc(), Recommendation.id)
+                .limit(MAX_RECOMMENDATIONS)
+            )
+            rows = [rec.to_dict() for rec in session.execute(query).scalars()]
+        with _lock:
+            # una invalidación durante la lectura: estas filas pueden ser anteriores a ella
+            if _generations[stripe] == generation:
+                cache.set(user_id, rows)
+    return rows[:limit]
@@ -9,28 +9,40 @@
 
 # Se deben ofrecer además los siguientes endpoints desde el maestro de los workers:
 # GET /job/(:id) Donde :id representa el id de un job creado
+# GET /job/(:id)/wait y /job/(:id)/events Esperan el término del job sin polling (ver jobs.py)
 # POST /job Recibe los datos necesarios para el pago y entrega un id del job creado
 # GET /heartbeat Indica si el servicio está operativo (devuelve true)
 
 import logging  # Agrega esta importación si no está
-from recommender_system.celery_app import app as celery_app
-from recommender_system.celery_config.tasks import compute_recommendations
+from recommender_system.celery_app import PRIORITIES, app as celery_app, queue_depths, task
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime
 from uuid import uuid4
 from pydantic import BaseModel
-from fastapi import APIRouter, HTTPException, FastAPI
+from fastapi import APIRouter, HTTPException, FastAPI, Request
+from starlette.concurrency import run_in_threadpool
 import sys
 import os
 from typing import Optional, List, Union
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import select
 import re
-import traceback  # Agrega esta importación
+import time
 
 # DB imports
-from recommender_system.database import SessionLocal, init_db
+from recommender_system.database import INIT_DB_ON_STARTUP, SessionLocal, setup_database
+from recommender_system.candidates import POLICY
+from recommender_system.ranking import RANKING
 from recommender_system.models import Property
+from recommender_system.feature_store import bump_version, current_version
+from recommender_system.recommendation_store import MAX_RECOMMENDATIONS, get_user_recommendations, save_recommendations
+from recommender_system.result_cache import result_cache
+from recommender_system.celery_config.controllers import haversine
+from recommender_system import aio, changes, events, geo, jobs, logs, metrics, precompute
+from recommender_system.ingest import CHUNK_SIZE, ingest, ingest_chunk, parse_bedrooms
+from recommender_system.snapshot import SNAPSHOT_DIR
 
 # Asegurar que el paquete `API` (y su subpaquete `database`) esté en sys.path
 # Esto permite importaciones como `from database.connection import SessionLocal`
@@ -39,56 +51,160 @@ api_path = os.path.join(base_dir, "API")
 if api_path not in sys.path:
     sys.path.insert(0, api_path)
 
-# importa la tarea Celery (la tarea ahora está registrada en el celery app)
+# Tareas Celery por nombre: el maestro no importa el módulo de tareas (ni scikit-learn)
+compute_recommendations = task("compute_recommendations")
+compute_recommendations_batch = task("compute_recommendations_batch")
+precompute_neighbors = task("precompute_neighbors")
+rebuild_snapshot = task("rebuild_snapshot")
+refresh_neighbors = task("refresh_neighbors")
 
 router = APIRouter(prefix="/recommender", tags=["recommender"])
 
-# Inicializar la DB (crea tablas si no existen)
-try:
-    init_db()
-except Exception:
-    # no detener la importación si la db no está accesible en este momento
-    pass
+logger = logging.getLogger(__name__)
 
 
-# Configura el logger al inicio del archivo
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranque del maestro: logging y esquema de la DB (nada de esto corre al importar)."""
+    logs.setup_logging()
+    if INIT_DB_ON_STARTUP:
+        try:
+            await run_in_threadpool(setup_database)
+        except Exception as e:
+            # el maestro arranca igual; las rutas fallarán hasta que la DB esté accesible
+            logger.error("No se pudo inicializar la DB: %s", e)
+    yield
+
+
+# Modo de encolado de jobs:
+#  - "reference": el mensaje lleva sólo user_id/property_id y la versión del catálogo;
+#    el worker resuelve las propiedades desde el feature store.
+#  - "inline": el mensaje incluye todas las propiedades (útil para pruebas).
+JOB_MODE = os.environ.get("RECOMMENDER_JOB_MODE", "reference")
+
+
+def build_job_kwargs(mode: str = JOB_MODE) -> dict:
+    """Arma los kwargs de `compute_recommendations` según el modo de encolado."""
+    with SessionLocal() as session:
+        if mode == "inline":
+            props = session.query(Property).all()
+            all_props = [p.to_dict() for p in props]
+            logger.debug("Obtenidas %d propiedades de la DB", len(all_props))
+            return {"all_properties": all_props}
+        return {"dataset_version": current_version(session)}
+
+
+async def build_job_kwargs_async(mode: str = JOB_MODE) -> dict:
+    """`build_job_kwargs` sin bloquear el event loop."""
+    if mode == "inline":
+        return await aio.run_io(build_job_kwargs, mode)
+    return {"dataset_version": await aio.current_version_async()}
+
+
+def serve_cached(user_id: str, property_id: int, result):
+    """Registra un resultado del caché como job terminado (consultable en GET /job/{task_id})."""
+    task_id = str(uuid4())
+    try:
+        celery_app.backend.store_result(task_id, result, "SUCCESS")
+        save_recommendations([(user_id, property_id, result)], task_id=task_id)
+    except Exception as e:
+        logger.error("Error al registrar resultado cacheado: %s", e)
+        raise HTTPException(
+            status_code=500, detail=f"Error encolando job: {str(e)}")
+    logger.debug("Job resuelto desde caché, task_id=%s, property_id=%s", task_id, property_id)
+    return {"task_id": task_id, "status": "SUCCESS", "cached": True}
 
 
 @router.post("/job/{user_id}/{property_id}")
-def create_job(user_id: str, property_id: int):
+async def create_job(user_id: str, property_id: int, priority: str = "high"):
     """
     Encola la tarea de recomendación. Devuelve el task_id de Celery para seguimiento.
+
+    `priority`: "high" (un usuario espera el resultado, por defecto), "normal",
+    o "low" (backfills: van a la cola bulk y no retrasan a los interactivos).
     """
-    logger.info(
-        f"Iniciando creación de job para user_id={user_id}, property_id={property_id}")
-    # Obtener todas las propiedades desde la base de datos local
-    all_props = []
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    queue, queue_priority = PRIORITIES[priority]
+    logger.debug("Iniciando creación de job para user_id=%s, property_id=%s", user_id, property_id)
+    # Vecinos precalculados: una consulta por índice, sin leer la versión ni encolar
+    if precompute.PRECOMPUTE_ENABLED:
+        try:
+            precomputed = await aio.run_io(
+                precompute.lookup, property_id, precompute.policy_key(POLICY, RANKING))
+        except Exception as e:
+            logger.error("Error al leer vecinos precalculados: %s", e)
+            precomputed = None
+        if precomputed is not None:
+            return await aio.run_io(serve_cached, user_id, property_id, precomputed)
+
     try:
-        with SessionLocal() as session:
-            props = session.query(Property).all()
-            all_props = [p.to_dict() for p in props]
-            logger.info(f"Obtenidas {len(all_props)} propiedades de la DB")
+        job_kwargs = await build_job_kwargs_async()
     except Exception as e:
-        logger.error(f"Error al obtener propiedades de DB: {str(e)}")
-        all_props = []
-        print("Warning: no se pudo leer la base de datos local de propiedades.")
+        logger.error("Error al obtener propiedades de DB: %s", e)
+        job_kwargs = {"all_properties": []} if JOB_MODE == "inline" else {}
+
+    # Mismo (propiedad, política, versión) ya calculado: se responde sin encolar
+    cached = await aio.run_io(result_cache.get, property_id, POLICY,
+                              job_kwargs.get("dataset_version"), RANKING)
+    if cached is not None:
+        return await aio.run_io(serve_cached, user_id, property_id, cached)
 
-    # Encolar la tarea pasando las propiedades obtenidas
+    # Encolar la tarea (con las propiedades o sólo con la versión del catálogo)
     try:
-        async_result = compute_recommendations.apply_async(
-            args=[user_id, property_id], kwargs={"all_properties": all_props}
+        async_result = await aio.run_io(
+            compute_recommendations.apply_async,
+            args=[user_id, property_id], kwargs=job_kwargs,
+            queue=queue, priority=queue_priority
         )
-        logger.info(
-            f"Job encolado exitosamente, task_id={async_result.id}, status={async_result.status}")
-        return {"task_id": async_result.id, "status": async_result.status}
+        logger.debug("Job encolado exitosamente, task_id=%s", async_result.id)
+        return {"task_id": async_result.id, "status": "PENDING"}
     except Exception as e:
-        logger.error(f"Error al encolar job: {str(e)}")
+        logger.error("Error al encolar job: %s", e)
         raise HTTPException(
             status_code=500, detail=f"Error encolando job: {str(e)}")
 
 
+class JobPair(BaseModel):
+    """Par (usuario, propiedad agendada) para el que se piden recomendaciones."""
+    user_id: str
+    property_id: int
+
+
+class BatchJobRequest(BaseModel):
+    pairs: List[JobPair]
+
+
+@router.post("/jobs/batch")
+async def create_batch_job(payload: BatchJobRequest):
+    """
+    Encola una sola tarea que calcula recomendaciones para todos los pares.
+    Devuelve el id del batch (un task_id de Celery, consultable en GET /job/{task_id}).
+    """
+    if not payload.pairs:
+        raise HTTPException(status_code=400, detail="pairs is required")
+    logger.debug("Iniciando creación de batch con %d pares", len(payload.pairs))
+    try:
+        job_kwargs = await build_job_kwargs_async()
+    except Exception as e:
+        logger.error("Error al obtener propiedades de DB: %s", e)
+        job_kwargs = {"all_properties": []} if JOB_MODE == "inline" else {}
+
+    try:
+        async_result = await aio.run_io(
+            compute_recommendations_batch.apply_async,
+            args=[[pair.model_dump() for pair in payload.pairs]], kwargs=job_kwargs
+        )
+        logger.info("Batch encolado exitosamente, batch_id=%s, pares=%d",
+                    async_result.id, len(payload.pairs))
+        return {"batch_id": async_result.id, "status": "PENDING", "size": len(payload.pairs)}
+    except Exception as e:
+        logger.error("Error al encolar batch: %s", e)
+        raise HTTPException(
+            status_code=500, detail=f"Error encolando batch: {str(e)}")
+
+
 class PropertyNotify(BaseModel):
     """Modelo sencillo para recibir notificaciones de propiedades."""
     external_id: Optional[int]
@@ -101,14 +217,15 @@ class PropertyNotify(BaseModel):
     raw: Optional[dict] = None
 
 
-def parse_bedrooms(bedrooms_value):
-    """Parsea bedrooms: extrae int de string (e.g., '1 dormitorio' -> 1), o devuelve int/None."""
-    if isinstance(bedrooms_value, str):
-        match = re.match(r'^(\d+)', bedrooms_value)  # Extrae dígitos al inicio
-        return int(match.group(1)) if match else None
-    elif isinstance(bedrooms_value, int):
-        return bedrooms_value
-    return None
+def enqueue_neighbor_refresh(property_ids: List[int]):
+    """Encola el refresco de la tabla de vecinos para las propiedades cambiadas."""
+    if not precompute.PRECOMPUTE_ENABLED:
+        return
+    try:
+        # va a la cola interactiva: acota cuánto tiempo se sirven vecinos desactualizados
+        refresh_neighbors.apply_async(args=[property_ids])
+    except Exception as e:
+        logger.error("No se pudo encolar refresh_neighbors: %s", e)
 
 
 @router.post("/properties/notify")
@@ -123,11 +240,10 @@ def notify_property(payload: PropertyNotify):
 
     try:
         with SessionLocal() as session:
-            print("hay session")
             prop = session.query(Property).filter(
                 Property.external_id == payload.external_id).one_or_none()
             if prop is None:
-                print("creando propiedad")
+                logger.debug("Creando propiedad external_id=%s", payload.external_id)
                 parsed_bedrooms = parse_bedrooms(payload.bedrooms)
                 prop = Property(
                     external_id=payload.external_id,
@@ -136,13 +252,17 @@ def notify_property(payload: PropertyNotify):
                     lon=payload.lon,
                     bedrooms=parsed_bedrooms,
                     price=payload.price,
+                    geohash=geo.encode_optional(payload.lat, payload.lon),
                 )
+                prop.version = bump_version(session)
                 session.add(prop)
                 session.commit()
                 session.refresh(prop)
+                changes.publish_upserts([prop.to_dict()], prop.version)
+                enqueue_neighbor_refresh([payload.external_id])
                 return {"status": "created", "id": prop.id}
             else:
-                print("actualizando propiedad")
+                logger.debug("Actualizando propiedad external_id=%s", payload.external_id)
                 # actualizar campos si vienen en el payload
                 if payload.comuna is not None:
                     setattr(prop, "comuna", payload.comuna)
@@ -157,65 +277,363 @@ def notify_property(payload: PropertyNotify):
                     setattr(prop, "price", payload.price)
                 if payload.raw is not None:
                     setattr(prop, "raw", payload.raw)
+                setattr(prop, "geohash", geo.encode_optional(prop.lat, prop.lon))
+                prop.version = bump_version(session)
                 session.add(prop)
+                # antes del commit: después los atributos expiran y leerlos es otra consulta
+                written, version = prop.to_dict(), prop.version
                 session.commit()
+                changes.publish_upserts([written], version)
+                enqueue_neighbor_refresh([payload.external_id])
                 return {"status": "updated", "id": prop.id}
     except Exception as e:
-        import logging
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger(__name__)
-        logger.error(f"Error en notify_property: {str(e)}")
-        # Agrega traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Error en notify_property: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _ndjson_items(request: Request):
+    """Objetos de un cuerpo NDJSON, leídos a medida que llegan."""
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+@router.post("/properties/bulk")
+async def bulk_properties(request: Request):
+    """Inserta/actualiza muchas propiedades con upserts por bloques.
+
+    Acepta un arreglo JSON (`application/json`) o un stream NDJSON
+    (`application/x-ndjson`), con los mismos campos que /properties/notify.
+    Cada bloque de RECOMMENDER_INGEST_CHUNK filas es una transacción.
+    """
+    content_type = request.headers.get("content-type", "")
+    totals = {"created": 0, "updated": 0, "skipped": 0, "chunks": 0}
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            chunk = []
+            async for item in _ndjson_items(request):
+                chunk.append(item)
+                if len(chunk) >= CHUNK_SIZE:
+                    counts = await run_in_threadpool(ingest_chunk, SessionLocal, chunk)
+                    totals = {k: totals[k] + counts[k] for k in totals}
+                    chunk = []
+            if chunk:
+                counts = await run_in_threadpool(ingest_chunk, SessionLocal, chunk)
+                totals = {k: totals[k] + counts[k] for k in totals}
+        else:
+            items = json.loads(await request.body())
+            if not isinstance(items, list):
+                raise HTTPException(
+                    status_code=400, detail="expected a JSON array or NDJSON")
+            await run_in_threadpool(ingest, SessionLocal, items, CHUNK_SIZE, totals)
+    except HTTPException:
+        raise
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"JSON inválido: {str(e)}")
+    except Exception as e:
+        logger.error("Error en bulk_properties: %s", e)
+        raise HTTPException(
+            status_code=500, detail=f"Error en ingesta: {str(e)}, procesado hasta ahora: {totals}")
+    finally:
+        # aunque un bloque falle, los anteriores ya hicieron commit
+        _after_bulk_ingest(totals)
+    logger.info("Ingesta masiva: %s", totals)
+    return totals
+
+
+def _after_bulk_ingest(totals: dict):
+    """Encola el snapshot y el precálculo de vecinos si la ingesta escribió algo."""
+    if SNAPSHOT_DIR and totals["created"] + totals["updated"]:
+        try:
+            rebuild_snapshot.apply_async()
+        except Exception as e:
+            logger.error("No se pudo encolar rebuild_snapshot: %s", e)
+    # una ingesta masiva puede mover muchos vecindarios: se recalcula la tabla completa
+    if precompute.PRECOMPUTE_ENABLED and totals["created"] + totals["updated"]:
+        try:
+            precompute_neighbors.apply_async()
+        except Exception as e:
+            logger.error("No se pudo encolar precompute_neighbors: %s", e)
+
+
+def _job_response(task_id: str, state: dict) -> dict:
+    if state["result"] == "error: property not found":
+        logger.warning("No se encontró job con task_id=%s", task_id)
+        return {**state, "status": "FAILURE"}
+    return state
+
+
+def _wait_timeout(timeout: Optional[float]) -> float:
+    if timeout is None:
+        return jobs.WAIT_TIMEOUT
+    if timeout < 0:
+        raise HTTPException(status_code=400, detail="timeout must be >= 0")
+    return min(timeout, jobs.WAIT_MAX)
+
+
 @router.get("/job/{task_id}")
-def get_job(task_id: str):
+async def get_job(task_id: str):
     """Consulta el estado del task de Celery usando su id."""
-    logger.info(f"Consultando estado de job con task_id={task_id}")
     try:
-        result = celery_app.AsyncResult(task_id)
-        if result.result == "error: property not found":
-            logger.warning(f"No se encontró job con task_id={task_id}")
-            return {"ready": result.ready(), "status": "FAILURE", "result": result.result}
-        logger.info(
-            f"Estado del job {task_id}: resultado={result.result}, status={result.status}")
-        return {"ready": result.ready(), "status": result.status, "result": result.result}
+        state = await aio.task_state(task_id)
+        logger.debug("Estado del job %s: status=%s", task_id, state["status"])
+        return _job_response(task_id, state)
     except Exception as e:
-        logger.error(f"Error al consultar job {task_id}: {str(e)}")
+        logger.error("Error al consultar job %s: %s", task_id, e)
         raise HTTPException(
             status_code=500, detail=f"Error consultando job: {str(e)}")
 
 
+@router.get("/job/{task_id}/wait")
+async def wait_job(task_id: str, timeout: Optional[float] = None):
+    """Como GET /job/{task_id}, pero responde cuando el job termina o al vencer `timeout` segundos.
+
+    Si vence el plazo devuelve el estado vigente (`ready: false`) y el cliente
+    vuelve a llamar. Por defecto espera RECOMMENDER_JOB_WAIT_TIMEOUT segundos.
+    """
+    timeout = _wait_timeout(timeout)
+    try:
+        return _job_response(task_id, await jobs.waiters.wait(task_id, timeout))
+    except Exception as e:
+        logger.error("Error al esperar job %s: %s", task_id, e)
+        raise HTTPException(
+            status_code=500, detail=f"Error consultando job: {str(e)}")
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.get("/job/{task_id}/events")
+async def job_events(task_id: str, timeout: Optional[float] = None):
+    """Server-sent events del job: `status` con el estado actual, `done` con el final.
+
+    Si el job no termina antes de `timeout` segundos se envía `timeout` y se
+    cierra el stream; mientras tanto van comentarios de keepalive.
+    """
+    timeout = _wait_timeout(timeout)
+
+    async def stream():
+        last = None
+        try:
+            async for state in jobs.waiters.stream(task_id, timeout, keepalive=jobs.SSE_KEEPALIVE):
+                if state is None:
+                    yield ": keepalive\n\n"
+                    continue
+                last = _job_response(task_id, state)
+                yield _sse("done" if last["ready"] else "status", last)
+        except Exception as e:
+            logger.error("Error en el stream del job %s: %s", task_id, e)
+            yield _sse("error", {"detail": f"Error consultando job: {str(e)}"})
+            return
+        if last is not None and not last["ready"]:
+            yield _sse("timeout", last)
+
+    # sin buffering en proxies (nginx) para que cada evento salga de inmediato
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/users/{user_id}/recommendations")
+def get_recommendations_for_user(user_id: str, limit: int = 20):
+    """Devuelve las recomendaciones más recientes del usuario (sin consultar Celery)."""
+    if limit < 1 or limit > MAX_RECOMMENDATIONS:
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {MAX_RECOMMENDATIONS}")
+    try:
+        return get_user_recommendations(user_id, limit)
+    except Exception as e:
+        logger.error("Error al obtener recomendaciones de %s: %s", user_id, e)
+        raise HTTPException(
+            status_code=500, detail=f"Error al obtener recomendaciones: {str(e)}")
+
+
 @router.get("/heartbeat")
-def heartbeat():
+async def heartbeat():
     return {"alive": True}
 
 
+# columnas que se pueden pedir en GET /properties?fields=...
+PROPERTY_FIELDS = ("id", "external_id", "comuna", "lat",
+                   "lon", "bedrooms", "price", "raw")
+PROPERTIES_PAGE_SIZE = 1000
+PROPERTIES_MAX_PAGE_SIZE = 10000
+# filas que se traen por vuelta del cursor al transmitir NDJSON
+STREAM_BATCH_SIZE = 1000
+
+
+def _property_rows(session, fields, after_id: Optional[int], limit: Optional[int]):
+    """Filas proyectadas a `fields`, por keyset sobre `id`, leídas en tandas."""
+    query = select(*[getattr(Property, name) for name in fields]).order_by(Property.id)
+    if after_id is not None:
+        query = query.where(Property.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    result = session.execute(
+        query.execution_options(yield_per=STREAM_BATCH_SIZE))
+    for row in result:
+        yield dict(zip(fields, row))
+
+
 @router.get("/properties")
-def get_all_properties():
-    """Devuelve todas las propiedades almacenadas en la base de datos."""
+def get_all_properties(after_id: Optional[int] = None, limit: Optional[int] = None,
+                       fields: Optional[str] = None, format: str = "json"):
+    """Devuelve las propiedades almacenadas en la base de datos, ordenadas por id.
+
+    - `after_id`/`limit`: paginación por keyset. En JSON se devuelven hasta
+      `limit` filas (1000 si sólo viene `after_id`) y el header
+      `X-Next-After-Id` indica desde dónde pedir la página siguiente. Sin
+      ninguno de los dos se devuelve el catálogo completo, como antes.
+    - `fields`: columnas separadas por coma (ej. `fields=external_id,lat,lon` para no traer `raw`).
+    - `format=ndjson`: transmite una propiedad por línea sin cargarlas todas en
+      memoria; sin `limit` recorre todo el catálogo.
+    """
+    selected = tuple(fields.split(",")) if fields else PROPERTY_FIELDS
+    unknown = [name for name in selected if name not in PROPERTY_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"unknown fields: {', '.join(unknown)}")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    if limit is not None and (limit < 1 or (format == "json" and limit > PROPERTIES_MAX_PAGE_SIZE)):
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {PROPERTIES_MAX_PAGE_SIZE}")
+
+    if format == "ndjson":
+        def stream():
+            with SessionLocal() as session:
+                for row in _property_rows(session, selected, after_id, limit):
+                    yield json.dumps(row) + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    # sin parámetros de paginación se mantiene la respuesta completa de siempre
+    page_size = None if limit is None and after_id is None else limit or PROPERTIES_PAGE_SIZE
+    # el id es necesario para calcular el cursor aunque no se haya pedido
+    query_fields = selected if "id" in selected else ("id",) + selected
+    try:
+        with SessionLocal() as session:
+            rows = list(_property_rows(session, query_fields, after_id, page_size))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error al obtener propiedades: {str(e)}")
+    headers = {}
+    if page_size is not None and len(rows) == page_size:
+        headers["X-Next-After-Id"] = str(rows[-1]["id"])
+    if "id" not in selected:
+        for row in rows:
+            del row["id"]
+    return JSONResponse(content=rows, headers=headers)
+
+
+@router.get("/properties/near")
+def get_properties_near(lat: float, lon: float, radius_km: float = 1.0, limit: int = 50):
+    """Propiedades a menos de `radius_km` del punto, ordenadas por distancia.
+
+    Acota en SQL por prefijos de geohash y filtra exacto con haversine.
+    """
+    if radius_km <= 0 or limit < 1:
+        raise HTTPException(
+            status_code=400, detail="radius_km and limit must be positive")
     try:
         with SessionLocal() as session:
-            properties = session.query(Property).all()
-            return [prop.to_dict() for prop in properties]
+            query = session.query(Property).filter(
+                Property.lat.isnot(None), Property.lon.isnot(None))
+            prefixes = geo.covering_prefixes(lat, lon, radius_km)
+            if prefixes:
+                query = query.filter(geo.prefix_filter(Property.geohash, prefixes))
+            nearby = []
+            for prop in query:
+                distance = haversine(lat, lon, prop.lat, prop.lon)
+                if distance <= radius_km:
+                    nearby.append((distance, prop))
+            nearby.sort(key=lambda item: item[0])
+            return [{**prop.to_dict(), "distance_km": distance} for distance, prop in nearby[:limit]]
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error al obtener propiedades: {str(e)}")
 
 
+@router.get("/metrics")
+def get_metrics():
+    """Métricas del maestro y de los workers en formato de texto de Prometheus."""
+    try:
+        for queue, depth in queue_depths().items():
+            metrics.QUEUE_DEPTH.labels(queue).set(depth)
+    except Exception as e:
+        logger.warning("No se pudo leer la profundidad de las colas: %s", e)
+    try:
+        remote = metrics.collect_remote(events.get_client())
+    except Exception as e:
+        logger.warning("No se pudieron leer las métricas de los workers: %s", e)
+        remote = []
+    return PlainTextResponse(metrics.REGISTRY.render(remote),
+                             media_type="text/plain; version=0.0.4")
+
+
 # Exponer la aplicación FastAPI para poder ejecutar este servicio por separado
-app = FastAPI(title="recommender-master")
+app = FastAPI(title="recommender-master", lifespan=lifespan)
+
+
+class RequestLogMiddleware:
+    """Una línea estructurada por petición muestreada (ver logs.py), como middleware ASGI puro."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        response = {"status": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            logs.log_request(scope, response["status"], time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """Latencia y bytes por ruta, como middleware ASGI puro (sin el costo de BaseHTTPMiddleware)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        response = {"status": 500, "length": None}
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["length"] = dict(message.get("headers") or ()).get(b"content-length")
+            await send(message)
 
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            # plantilla de la ruta (no la URL) para acotar las series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.REQUEST_LATENCY.labels(scope["method"], route, response["status"]).observe(
+                time.perf_counter() - start)
+            request_length = dict(scope.get("headers") or ()).get(b"content-length")
+            for direction, length in (("request", request_length), ("response", response["length"])):
+                if length:
+                    metrics.HTTP_BYTES.labels(route, direction).inc(int(length))
 
-@app.middleware("http")
-async def log_requests(request, call_next):
-    logger.info(
-        f"Request: {request.method} {request.url} - Headers: {dict(request.headers)}")
-    response = await call_next(request)
-    logger.info(
-        f"Response: {response.status_code} for {request.method} {request.url}")
-    return response
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestLogMiddleware)
 app.include_router(router)
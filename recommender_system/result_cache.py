@@ -0,0 +1,116 @@
+"""Caché de resultados de recomendación por (propiedad, política, versión del catálogo).
+
+La llave incluye además el ranking, las features (`RECOMMENDER_FEATURES`,
+`RECOMMENDER_NULL_FEATURES`) y el backend de vecinos.
+
+El resultado de `compute_recommendations` no depende del usuario: mientras la
+versión del catálogo no cambie, la misma propiedad origen con la misma política
+y ranking da los mismos vecinos. Como la versión es parte de la llave, nunca
+hay que invalidar: cualquier escritura (`notify_property`, ingesta masiva)
+avanza la versión y las entradas antiguas simplemente dejan de consultarse.
+
+Hay dos niveles: un LRU en memoria por proceso y, si hay Redis, un nivel
+compartido entre el maestro y todos los workers.
+"""
+import json
+import logging
+import os
+from typing import Any, Optional, Tuple
+
+from recommender_system import events, features, metrics
+from recommender_system.cache import TTLCache
+from recommender_system.celery_config.neighbors import backend_key
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.environ.get(
+    "RECOMMENDER_RESULT_CACHE", "true").lower() in ("1", "true", "yes")
+# las llaves llevan la versión, así que el TTL sólo acota la memoria usada
+RESULT_CACHE_TTL = float(os.environ.get("RECOMMENDER_RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_SIZE = int(os.environ.get("RECOMMENDER_RESULT_CACHE_SIZE", "10000"))
+KEY_PREFIX = "recommender:result:"
+
+LOOKUPS = metrics.REGISTRY.counter(
+    "recommender_result_cache_lookups_total",
+    "Consultas al caché de resultados por nivel y resultado", ("tier", "outcome"))
+SAVED_SECONDS = metrics.REGISTRY.counter(
+    "recommender_result_cache_saved_seconds_total",
+    "Segundos de cálculo evitados por aciertos en el caché de resultados")
+
+
+class ResultCache:
+    """LRU local con un nivel opcional en Redis; los valores son `(resultado, segundos de cálculo)`."""
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL,
+                 client_factory=events.get_client, enabled: bool = RESULT_CACHE_ENABLED):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._client_factory = client_factory
+
+    @staticmethod
+    def key(property_id: int, policy, version: int, ranking: str) -> str:
+        # con la configuración de features y el backend: cambiarlos no sirve vecinos antiguos
+        return f"{KEY_PREFIX}{version}:{ranking}:{features.model_key()}:{backend_key()}:" \
+            f"{property_id}:{policy.key()!r}"
+
+    def _client(self):
+        try:
+            return self._client_factory() if self._client_factory else None
+        except Exception as e:
+            logger.warning(f"Caché de resultados sin Redis: {str(e)}")
+            return None
+
+    def get(self, property_id: int, policy, version: Optional[int], ranking: str) -> Optional[Any]:
+        """Resultado guardado, o None si no está (o si falta la versión)."""
+        if not self.enabled or version is None:
+            return None
+        key = self.key(property_id, policy, version, ranking)
+        entry = self._local.get(key)
+        tier = "local"
+        if entry is None:
+            entry = self._get_remote(key)
+            tier = "redis"
+            if entry is not None:
+                self._local.set(key, entry)
+        if entry is None:
+            LOOKUPS.labels("all", "miss").inc()
+            return None
+        LOOKUPS.labels(tier, "hit").inc()
+        SAVED_SECONDS.inc(entry[1])
+        return entry[0]
+
+    def _get_remote(self, key: str) -> Optional[Tuple[Any, float]]:
+        client = self._client()
+        if client is None:
+            return None
+        try:
+            raw = client.get(key)
+        except Exception as e:
+            logger.warning(f"No se pudo leer el caché de resultados: {str(e)}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return data["result"], data["seconds"]
+
+    def set(self, property_id: int, policy, version: Optional[int], ranking: str,
+            result: Any, seconds: float = 0.0):
+        if not self.enabled or version is None:
+            return
+        key = self.key(property_id, policy, version, ranking)
+        self._local.set(key, (result, seconds))
+        client = self._client()
+        if client is None:
+            return
+        try:
+            client.set(key, json.dumps({"result": result, "seconds": seconds}),
+                       ex=max(1, int(self.ttl)))
+        except Exception as e:
+            logger.warning(f"No se pudo escribir el caché de resultados: {str(e)}")
+
+    def clear(self):
+        self._local.clear()
+
+
+result_cache = ResultCache()
@@ -0,0 +1,238 @@
+"""Serializador columnar y binario para los mensajes y resultados de Celery.
+
+Con JSON, una lista de propiedades repite las claves en cada fila y cada float
+viaja como texto decimal. Este serializador (registrado en kombu como
+`recommender`) convierte toda lista larga en columnas:
+
+  - números -> un buffer NumPy (int64 o float64) con sus bytes crudos; si la
+    columna mezcla enteros y floats, float64 más una máscara de los enteros,
+  - strings -> códigos int32 más la lista de valores distintos,
+  - dicts   -> una columna por clave (recursivo),
+  - listas  -> largos por fila más una columna con todos los elementos.
+
+Los valores que no calzan con el tipo de la columna (por ejemplo un mensaje de
+error en una columna de listas) se guardan aparte, tal cual. El resto del
+mensaje va en un encabezado JSON (con el codificador de kombu, que conserva
+fechas, UUIDs, etc.); un dict del usuario que tenga la clave `__rcs__` se
+escapa para no confundirlo con una tabla. Sobre `RECOMMENDER_SERIALIZER_COMPRESS_MIN` bytes el
+cuerpo se comprime con zlib.
+
+Formato: b"RCS" + bandera de compresión (b"0"/b"z") + largo del encabezado
+(4 bytes, big endian) + encabezado + buffers concatenados.
+"""
+import os
+import struct
+import zlib
+from collections import Counter
+from typing import Any, Dict, List
+
+import numpy as np
+from kombu.serialization import register
+from kombu.utils import json as kombu_json
+
+NAME = "recommender"
+CONTENT_TYPE = "application/x-recommender-columnar"
+MAGIC = b"RCS"
+# listas más cortas no compensan el costo de pasarlas a columnas
+MIN_ROWS = int(os.environ.get("RECOMMENDER_SERIALIZER_MIN_ROWS", "8"))
+# bytes desde los que se comprime el cuerpo (negativo = nunca)
+COMPRESS_MIN = int(os.environ.get("RECOMMENDER_SERIALIZER_COMPRESS_MIN", "65536"))
+_TABLE = "__rcs__"
+# los floats representan exacto los enteros hasta aquí
+_MAX_EXACT_INT = 2 ** 53
+
+
+# tipo exacto -> clase de columna (los demás tipos se revisan valor a valor)
+_KINDS = {int: "num", float: "num", np.int64: "num", np.float64: "num",
+          str: "str", dict: "dict", list: "list", tuple: "list"}
+_NONE = type(None)
+
+
+def _kind(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "other"
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return "num"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, dict):
+        return "dict"
+    if isinstance(value, (list, tuple)):
+        return "list"
+    return "other"
+
+
+class _Encoder:
+    def __init__(self):
+        self.buffers: List[np.ndarray] = []
+
+    def _add(self, array: np.ndarray) -> int:
+        self.buffers.append(np.ascontiguousarray(array))
+        return len(self.buffers) - 1
+
+    def walk(self, value):
+        if isinstance(value, dict):
+            walked = {key: self.walk(item) for key, item in value.items()}
+            # la clave reservada marca tablas: un dict que ya la tiene va escapado
+            return {_TABLE: {"raw": walked}} if _TABLE in value else walked
+        if isinstance(value, (list, tuple)):
+            if len(value) >= MIN_ROWS:
+                return {_TABLE: self.column(value), "n": len(value)}
+            return [self.walk(item) for item in value]
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def column(self, values) -> Dict[str, Any]:
+        types = set(map(type, values))
+        has_none = _NONE in types
+        types.discard(_NONE)
+        if not types:
+            return {"none": True}
+        kinds = {_KINDS.get(t, "other") for t in types}
+        if len(kinds) == 1 and "other" not in kinds:
+            # caso común: una sola clase de valor, a lo más con nulos
+            dominant = kinds.pop()
+            present = [v is not None for v in values] if has_none else None
+            selected = [v for v in values if v is not None] if has_none else values
+            other = {}
+        else:
+            value_kinds = [_kind(v) for v in values]
+            counts = Counter(k for k in value_kinds if k is not None)
+            dominant = counts.most_common(1)[0][0]
+            if dominant == "other":
+                return {"json": [self.walk(v) for v in values]}
+            present = [k == dominant for k in value_kinds]
+            selected = [v for v, p in zip(values, present) if p]
+            types = set(map(type, selected))
+            other = {str(i): self.walk(v) for i, (v, k) in enumerate(zip(values, value_kinds))
+                     if k is not None and k != dominant}
+        spec: Dict[str, Any] = {}
+
+        if dominant == "num":
+            integer = [issubclass(t, (int, np.integer)) for t in types]
+            if all(integer):
+                try:
+                    spec["num"] = self._add(np.array(selected, dtype=np.int64))
+                except OverflowError:
+                    return {"json": [self.walk(v) for v in values]}
+            else:
+                if any(integer):
+                    # enteros y floats mezclados: se marcan los enteros para devolverlos como int
+                    ints = [isinstance(v, (int, np.integer)) for v in selected]
+                    if any(abs(int(v)) > _MAX_EXACT_INT for v, i in zip(selected, ints) if i):
+                        return {"json": [self.walk(v) for v in values]}
+                    spec["int"] = self._add(np.array(ints, dtype=bool))
+                spec["num"] = self._add(np.array(selected, dtype=np.float64))
+        elif dominant == "str":
+            categories: Dict[str, int] = {}
+            codes = [categories.setdefault(v, len(categories)) for v in selected]
+            spec["str"] = {"codes": self._add(np.array(codes, dtype=np.int32)),
+                           "values": list(categories)}
+        elif dominant == "dict":
+            keys = list(selected[0])
+            if any(list(v) != keys for v in selected):
+                return {"json": [self.walk(v) for v in values]}
+            spec["dict"] = {key: self.column([v[key] for v in selected]) for key in keys}
+        else:
+            lengths = np.array([len(v) for v in selected], dtype=np.int64)
+            spec["list"] = {"lengths": self._add(lengths),
+                            "items": self.column([item for v in selected for item in v])}
+
+        if present is not None:
+            spec["present"] = self._add(np.array(present, dtype=bool))
+        if other:
+            spec["other"] = other
+        return spec
+
+
+class _Decoder:
+    def __init__(self, buffers: List[np.ndarray]):
+        self.buffers = buffers
+
+    def walk(self, value):
+        if isinstance(value, dict):
+            if _TABLE in value:
+                if "raw" in value[_TABLE]:
+                    return {key: self.walk(item) for key, item in value[_TABLE]["raw"].items()}
+                return self.column(value[_TABLE], value["n"])
+            return {key: self.walk(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.walk(item) for item in value]
+        return value
+
+    def column(self, spec: Dict[str, Any], n: int) -> list:
+        if "none" in spec:
+            return [None] * n
+        if "json" in spec:
+            return [self.walk(v) for v in spec["json"]]
+        present = self.buffers[spec["present"]].tolist() if "present" in spec else None
+        m = n if present is None else sum(present)
+
+        if "num" in spec:
+            selected = self.buffers[spec["num"]].tolist()
+            if "int" in spec:
+                ints = self.buffers[spec["int"]].tolist()
+                selected = [int(v) if i else v for v, i in zip(selected, ints)]
+        elif "str" in spec:
+            values = spec["str"]["values"]
+            selected = [values[code] for code in self.buffers[spec["str"]["codes"]].tolist()]
+        elif "dict" in spec:
+            keys = list(spec["dict"])
+            columns = [self.column(s, m) for s in spec["dict"].values()]
+            selected = [dict(zip(keys, row)) for row in zip(*columns)] if keys else [{} for _ in range(m)]
+        else:
+            lengths = self.buffers[spec["list"]["lengths"]].tolist()
+            items = self.column(spec["list"]["items"], sum(lengths))
+            selected, start = [], 0
+            for length in lengths:
+                selected.append(items[start:start + length])
+                start += length
+
+        if present is None:
+            return selected
+        result: list = [None] * n
+        it = iter(selected)
+        for i, flag in enumerate(present):
+            if flag:
+                result[i] = next(it)
+        for i, value in spec.get("other", {}).items():
+            result[int(i)] = self.walk(value)
+        return result
+
+
+def dumps(obj) -> bytes:
+    encoder = _Encoder()
+    tree = encoder.walk(obj)
+    header = kombu_json.dumps({
+        "tree": tree,
+        "buffers": [[b.dtype.str, int(b.size)] for b in encoder.buffers],
+    }).encode()
+    payload = struct.pack(">I", len(header)) + header + b"".join(b.tobytes() for b in encoder.buffers)
+    if 0 <= COMPRESS_MIN <= len(payload):
+        return MAGIC + b"z" + zlib.compress(payload, 1)
+    return MAGIC + b"0" + payload
+
+
+def loads(data) -> Any:
+    if isinstance(data, str):
+        data = data.encode("latin-1")
+    data = bytes(data)
+    if data[:3] != MAGIC:
+        raise ValueError("not a recommender columnar payload")
+    payload = zlib.decompress(data[4:]) if data[3:4] == b"z" else memoryview(data)[4:]
+    (header_len,) = struct.unpack(">I", payload[:4])
+    header = kombu_json.loads(bytes(payload[4:4 + header_len]))
+    buffers, offset = [], 4 + header_len
+    for dtype, size in header["buffers"]:
+        array = np.frombuffer(payload, dtype=np.dtype(dtype), count=size, offset=offset)
+        buffers.append(array)
+        offset += array.nbytes
+    return _Decoder(buffers).walk(header["tree"])
+
+
+def register_serializer():
+    """Registra el serializador en kombu (idempotente)."""
+    register(NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary")
@@ -0,0 +1,352 @@
+"""Snapshot columnar y versionado de las features de las propiedades.
+
+El exportador escribe una columna por archivo `.npy` (external_id, lat, lon,
+price, bedrooms, código de comuna y los campos `raw.<campo>` que pida
+`RECOMMENDER_FEATURES`) dentro de `v<version>/`, y luego apunta
+`CURRENT` a esa carpeta con un `os.replace` atómico. Junto a las columnas va
+la matriz ya escalada (`scaled.npy`) con la transformación que la produjo
+(`transform.json`, rotulada con `features.model_key()`). Los workers cargan la
+versión vigente con `np.load(mmap_mode="r")`: todos los procesos de un mismo
+host comparten las mismas páginas en vez de tener cada uno su copia en
+objetos de Python. Lo que sigue siendo de cada proceso es la estructura del
+buscador de vecinos (los nodos del KD-tree o las listas IVF), que se arma
+sobre la matriz compartida.
+
+Uso:
+    python -m recommender_system.snapshot [directorio]
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from recommender_system import features
+from recommender_system.features import NULL_FEATURES, FeatureSpec, FeatureTransform, NormalizationStats
+from recommender_system.feature_store import FEATURE_COLUMNS, current_version, feature_columns
+
+logger = logging.getLogger(__name__)
+
+# sin directorio configurado los snapshots quedan deshabilitados
+SNAPSHOT_DIR = os.environ.get("RECOMMENDER_SNAPSHOT_DIR") or None
+# versiones que se conservan en disco (un lector puede seguir usando la anterior)
+KEEP_VERSIONS = 2
+# filas que se convierten a arreglos de una vez
+CHUNK_ROWS = 10000
+
+# valor que representa NULL en las columnas enteras
+MISSING = -1
+DTYPES = {
+    "id": np.int64,
+    "external_id": np.int64,
+    "lat": np.float64,
+    "lon": np.float64,
+    "price": np.float64,
+    "bedrooms": np.int32,
+    "comuna_code": np.int32,
+    # campos numéricos de `raw` (NaN si faltan)
+    **{name: np.float64 for name in features.SPEC.raw_columns},
+}
+FLOAT_COLUMNS = ("lat", "lon", "price") + features.SPEC.raw_columns
+
+
+class PropertyColumns:
+    """Features de las propiedades en arreglos contiguos, una columna por arreglo."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], comunas: List[Optional[str]], version: Optional[int] = None):
+        self.arrays = arrays
+        # nombre de cada código de comuna (posición en la lista)
+        self.comunas = comunas
+        self._codes = {name: code for code, name in enumerate(comunas)}
+        self.version = version
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Any]], version: Optional[int] = None,
+                  chunk_rows: int = CHUNK_ROWS) -> "PropertyColumns":
+        """Construye las columnas desde tuplas en el orden de `FEATURE_COLUMNS`.
+
+        Las filas se consumen por bloques de `chunk_rows` y cada bloque se
+        convierte columna por columna con NumPy (NULL queda como NaN o MISSING).
+        """
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in DTYPES}
+        comunas: List[Optional[str]] = []
+        codes: Dict[Optional[str], int] = {None: MISSING}
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, chunk_rows))
+            if not batch:
+                break
+            values = dict(zip(FEATURE_COLUMNS, zip(*batch)))
+            for name in ("id", "external_id", "bedrooms"):
+                parts[name].append(_int_column(values[name], DTYPES[name]))
+            for name in FLOAT_COLUMNS:
+                # np.array(..., dtype=float) convierte None en NaN
+                parts[name].append(np.array(values[name], dtype=np.float64))
+            for comuna in dict.fromkeys(values["comuna"]):
+                if comuna not in codes:
+                    codes[comuna] = len(comunas)
+                    comunas.append(comuna)
+            parts["comuna_code"].append(np.fromiter(
+                (codes[comuna] for comuna in values["comuna"]), dtype=np.int32, count=len(batch)))
+        arrays = {name: np.concatenate(parts[name]).astype(dtype, copy=False)
+                  if parts[name] else np.empty(0, dtype=dtype)
+                  for name, dtype in DTYPES.items()}
+        return cls(arrays, comunas, version)
+
+    @classmethod
+    def from_properties(cls, properties: Iterable[Dict[str, Any]], version: Optional[int] = None) -> "PropertyColumns":
+        return cls.from_rows(
+            (tuple(features.feature_value(p, name) for name in FEATURE_COLUMNS) for p in properties), version)
+
+    def __len__(self):
+        return len(self.arrays["external_id"])
+
+    @property
+    def external_id(self) -> np.ndarray:
+        return self.arrays["external_id"]
+
+    @property
+    def comuna_codes(self) -> np.ndarray:
+        return self.arrays["comuna_code"]
+
+    def comuna_code(self, comuna: Optional[str]) -> Optional[int]:
+        """Código de la comuna, MISSING si es None, o None si no aparece en las columnas."""
+        if comuna is None:
+            return MISSING
+        return self._codes.get(comuna)
+
+    def select(self, mask: np.ndarray) -> "PropertyColumns":
+        """Sólo las filas de `mask` (arreglo booleano o de posiciones)."""
+        return PropertyColumns({name: np.asarray(array)[mask] for name, array in self.arrays.items()},
+                               list(self.comunas), self.version)
+
+    def extend(self, other: "PropertyColumns") -> "PropertyColumns":
+        """Las filas de `self` seguidas de las de `other` (con sus comunas recodificadas)."""
+        comunas = list(self.comunas)
+        codes = dict(self._codes)
+        # la última posición traduce MISSING (-1) a MISSING
+        remap = np.full(len(other.comunas) + 1, MISSING, dtype=np.int32)
+        for code, name in enumerate(other.comunas):
+            if name not in codes:
+                codes[name] = len(comunas)
+                comunas.append(name)
+            remap[code] = codes[name]
+        arrays = {name: np.concatenate([
+            np.asarray(array),
+            remap[other.comuna_codes] if name == "comuna_code" else other.arrays[name],
+        ]).astype(DTYPES[name], copy=False) for name, array in self.arrays.items()}
+        return PropertyColumns(arrays, comunas, other.version or self.version)
+
+    def raw_features(self) -> np.ndarray:
+        """Matriz con las features numéricas de `RECOMMENDER_FEATURES` (por defecto
+        lat, lon, price); NaN donde el valor es NULL."""
+        return features.SPEC.raw_matrix(self)
+
+    def null_counts(self) -> Dict[str, int]:
+        counts = np.isnan(self.raw_features()).sum(axis=0)
+        return {name: int(count) for name, count in zip(features.SPEC.numeric, counts)}
+
+    def null_fill(self, nulls: str = NULL_FEATURES) -> np.ndarray:
+        """Valor que reemplaza los NULL de cada feature según `RECOMMENDER_NULL_FEATURES`."""
+        return features.null_fill(self.raw_features(), nulls)
+
+    def features(self, fill: Optional[np.ndarray] = None) -> np.ndarray:
+        """`raw_features()` con los NULL reemplazados por `fill` (por defecto `null_fill()`)."""
+        raw = self.raw_features()
+        return features.fill_nulls(raw, self.null_fill() if fill is None else fill)
+
+    def row(self, pos: int) -> Dict[str, Any]:
+        """La fila `pos` como dict con las claves de `FEATURE_COLUMNS` (NULL como None)."""
+        record: Dict[str, Any] = {}
+        for name in ("id", "external_id"):
+            value = int(self.arrays[name][pos])
+            record[name] = None if value == MISSING else value
+        code = int(self.arrays["comuna_code"][pos])
+        record["comuna"] = None if code == MISSING else self.comunas[code]
+        for name in ("lat", "lon"):
+            value = float(self.arrays[name][pos])
+            record[name] = None if np.isnan(value) else value
+        bedrooms = int(self.arrays["bedrooms"][pos])
+        record["bedrooms"] = None if bedrooms == MISSING else bedrooms
+        for name in FLOAT_COLUMNS[2:]:
+            value = float(self.arrays[name][pos])
+            record[name] = None if np.isnan(value) else value
+        return record
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"),
+                    np.ascontiguousarray(array))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"version": self.version, "rows": len(self),
+                      "comunas": self.comunas}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "PropertyColumns":
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"),
+                          mmap_mode="r" if mmap else None)
+            for name in DTYPES
+        }
+        return cls(arrays, meta["comunas"], meta["version"])
+
+
+def _int_column(values: Sequence[Any], dtype) -> np.ndarray:
+    try:
+        return np.array(values, dtype=dtype)
+    except TypeError:
+        # hay NULL: sólo entonces se recorre valor por valor
+        return np.array([MISSING if v is None else v for v in values], dtype=dtype)
+
+
+def load_columns(session, batch_size: int = CHUNK_ROWS) -> PropertyColumns:
+    """Lee todo el catálogo directamente a columnas, sin dicts por fila.
+
+    La versión se lee antes que las filas: con READ COMMITTED o un cursor en
+    streaming, las filas pueden incluir escrituras posteriores a ella, y así
+    las columnas quedan rotuladas con una versión a lo más atrasada (los
+    cambios desde esa versión se vuelven a aplicar sin efecto), nunca
+    adelantada (se perderían las escrituras intermedias).
+    """
+    version = current_version(session)
+    result = session.execute(
+        select(*feature_columns()).execution_options(yield_per=batch_size))
+    return PropertyColumns.from_rows(result, version, batch_size)
+
+
+def save_scaled(path: str, columns: PropertyColumns, spec: FeatureSpec = features.SPEC,
+                nulls: str = NULL_FEATURES):
+    """Guarda en `path` la matriz escalada de `columns` y la transformación ajustada sobre ellas."""
+    transform = FeatureTransform.fit(spec, columns, nulls)
+    np.save(os.path.join(path, "scaled.npy"), np.ascontiguousarray(transform.encode(columns)))
+    with open(os.path.join(path, "transform.json"), "w") as f:
+        json.dump({"model": features.model_key(spec, nulls), "count": transform.stats.count,
+                   "mean": transform.stats.mean.tolist(), "m2": transform.stats.m2.tolist(),
+                   "fill": transform.fill.tolist(), "comunas": transform.comunas}, f)
+
+
+def load_scaled(directory: Optional[str], version: int, spec: FeatureSpec = features.SPEC,
+                nulls: str = NULL_FEATURES) -> Optional[Tuple[FeatureTransform, np.ndarray]]:
+    """Transformación y matriz escalada (memory-mapped) del snapshot `version`.
+
+    None si el snapshot no las tiene o se escalaron con otra configuración de
+    features: en ese caso cada proceso escala las columnas por su cuenta.
+    """
+    if not directory:
+        return None
+    path = _version_dir(directory, version)
+    try:
+        with open(os.path.join(path, "transform.json")) as f:
+            meta = json.load(f)
+        if meta["model"] != features.model_key(spec, nulls):
+            return None
+        scaled = np.load(os.path.join(path, "scaled.npy"), mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    stats = NormalizationStats(meta["count"], meta["mean"], meta["m2"])
+    return FeatureTransform(spec, stats, meta["fill"], meta["comunas"]), scaled
+
+
+def _version_dir(directory: str, version: int) -> str:
+    return os.path.join(directory, f"v{version:012d}")
+
+
+def current_snapshot_version(directory: Optional[str] = SNAPSHOT_DIR) -> Optional[int]:
+    """Versión del catálogo del snapshot vigente, o None si no hay."""
+    if not directory:
+        return None
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return int(f.read().strip().lstrip("v"))
+    except (OSError, ValueError):
+        return None
+
+
+def load_current(directory: Optional[str] = SNAPSHOT_DIR, mmap: bool = True) -> Optional[PropertyColumns]:
+    """Carga (memory-mapped) el snapshot vigente, o None si no hay."""
+    version = current_snapshot_version(directory)
+    if version is None:
+        return None
+    try:
+        return PropertyColumns.load(_version_dir(directory, version), mmap=mmap)
+    except OSError as e:
+        logger.warning(f"No se pudo cargar el snapshot v{version}: {str(e)}")
+        return None
+
+
+@contextmanager
+def _directory_lock(directory: str):
+    """Lock exclusivo sobre `directory` entre procesos (publicar y podar versiones)."""
+    with open(os.path.join(directory, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def export_snapshot(session, directory: Optional[str] = SNAPSHOT_DIR, keep: int = KEEP_VERSIONS) -> PropertyColumns:
+    """Escribe un snapshot del catálogo y lo publica de forma atómica.
+
+    Dos exportaciones pueden correr a la vez (una por ingesta masiva): los
+    archivos se escriben sin lock, pero publicar y podar se hacen con el lock
+    del directorio, y `CURRENT` sólo avanza a una versión más nueva que la
+    publicada (una exportación lenta de una versión anterior se descarta).
+    """
+    if not directory:
+        raise ValueError("RECOMMENDER_SNAPSHOT_DIR no está configurado")
+    os.makedirs(directory, exist_ok=True)
+    columns = load_columns(session)
+    target = _version_dir(directory, columns.version)
+
+    tmp = None
+    if not os.path.isdir(target):
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+        columns.save(tmp)
+        save_scaled(tmp, columns)
+
+    with _directory_lock(directory):
+        published = current_snapshot_version(directory)
+        if published is not None and published >= columns.version:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+            logger.info("Snapshot v%s descartado: ya está publicado v%s", columns.version, published)
+            return columns
+        if tmp is not None:
+            try:
+                os.rename(tmp, target)
+            except OSError:
+                # otro proceso escribió la misma versión primero
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        pointer = os.path.join(directory, f".CURRENT-{os.getpid()}")
+        with open(pointer, "w") as f:
+            f.write(os.path.basename(target))
+        os.replace(pointer, os.path.join(directory, "CURRENT"))
+        logger.info("Snapshot publicado: version=%s, filas=%s", columns.version, len(columns))
+
+        # con el lock tomado, la más nueva es la que apunta CURRENT: nunca se poda
+        versions = sorted(name for name in os.listdir(directory)
+                          if name.startswith("v") and os.path.isdir(os.path.join(directory, name)))
+        for name in versions[:-keep]:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return columns
+
+
+if __name__ == "__main__":
+    from recommender_system.database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as session:
+        export_snapshot(session, sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT_DIR)
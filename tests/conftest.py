@@ -0,0 +1,40 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from recommender_system.database import Base, seed_catalog_version
+from recommender_system.feature_store import bump_version
+from recommender_system.models import Property
+
+
+@pytest.fixture()
+def make_session_factory(tmp_path):
+    """Fábrica de catálogos SQLite de prueba: `rows` propiedades cerca de Santiago en una versión.
+
+    `seed` fija los valores aleatorios y `columns(i, rng)` devuelve columnas que
+    se agregan o reemplazan en la propiedad `i` (ej. bedrooms o `raw`).
+    """
+    def make(seed, columns=None, rows=200):
+        engine = create_engine(f"sqlite:///{tmp_path}/catalog-{seed}.db", future=True)
+        Base.metadata.create_all(bind=engine)
+        seed_catalog_version(engine)
+        factory = sessionmaker(bind=engine, future=True)
+        rng = random.Random(seed)
+        with factory() as session:
+            version = bump_version(session)
+            properties = []
+            for i in range(rows):
+                fields = {"external_id": i, "comuna": f"c{i % 4}", "bedrooms": 2,
+                          "lat": -33.45 + rng.uniform(-0.1, 0.1),
+                          "lon": -70.65 + rng.uniform(-0.1, 0.1),
+                          "price": rng.uniform(50000, 200000)}
+                if columns is not None:
+                    fields.update(columns(i, rng))
+                properties.append(Property(version=version, **fields))
+            session.add_all(properties)
+            session.commit()
+        return factory
+
+    return make
@@ -0,0 +1,142 @@
+import pytest
+
+from recommender_system import changes, events
+from recommender_system.models import Property
+from recommender_system.feature_store import bump_version
+from recommender_system.ingest import ingest_chunk
+from recommender_system.celery_config.knn_index import PropertyIndex
+
+
+@pytest.fixture()
+def session_factory(make_session_factory):
+    return make_session_factory(seed=11)
+
+
+@pytest.fixture()
+def local_stream(monkeypatch):
+    """Publica en una cola en memoria propia de la prueba (sin Redis)."""
+    monkeypatch.setattr(events, "get_client", lambda: None)
+
+    def make(maxlen=changes.MAXLEN):
+        stream = changes.LocalStream(maxlen)
+        monkeypatch.setattr(changes, "_local_stream", stream)
+        return stream
+    return make
+
+
+def _neighbors(index, ids):
+    return {i: [p["external_id"] for p, _ in items] for i, items in index.query_many(ids).items()}
+
+
+def _no_db():
+    raise AssertionError("el índice no debería leer la DB")
+
+
+def test_index_follows_change_stream_without_db(session_factory, local_stream):
+    stream = local_stream()
+    index = PropertyIndex(session_factory, snapshot_dir=None)
+    index.changes = changes.ChangeConsumer(index, stream)
+    index.rebuild()
+    index.changes.catch_up()
+    reference = PropertyIndex(session_factory, snapshot_dir=None)
+    reference.refresh()
+
+    ingest_chunk(session_factory, [
+        {"external_id": 3, "price": 123456.0},  # sólo cambia el precio: el evento lleva la fila escrita
+        {"external_id": 500, "comuna": "c1", "lat": -33.41, "lon": -70.61, "price": 90000.0},
+    ])
+    index._session_factory = _no_db
+    index.refresh()
+    assert index.get(3)["price"] == 123456.0 and index.get(3)["lat"] is not None
+    assert index.get(500)["comuna"] == "c1"
+    reference.refresh()
+    ids = [3, 500, 42, 77]
+    assert _neighbors(index, ids) == _neighbors(reference, ids)
+
+    changes.publish_deletes([500], index.version + 1)
+    index.refresh()
+    assert index.get(500) is None and len(index) == 200
+
+    # por sobre el umbral se compacta en memoria, también sin la DB
+    index.rebuild_threshold = 0
+    changes.publish_upserts([dict(index.get(42), price=50000.0)], index.version + 1)
+    index.refresh()
+    assert index.pending_changes == 0 and index.get(42)["price"] == 50000.0
+
+
+def test_catch_up_after_trimmed_stream_and_gaps(session_factory, local_stream):
+    stream = local_stream(maxlen=2)
+    index = PropertyIndex(session_factory, snapshot_dir=None)
+    index.rebuild()
+    start = index.version
+    for external_id in (600, 601, 602):
+        ingest_chunk(session_factory, [{"external_id": external_id, "comuna": "c0",
+                                        "lat": -33.45, "lon": -70.65, "price": 1000.0}])
+    assert changes.entries_since(stream, start) is None
+    assert [e["version"] for e in changes.entries_since(stream, start + 1)[1]] == [start + 2, start + 3]
+
+    # reinicio: el stream ya no tiene start + 1, se leen de la DB las filas posteriores
+    index.changes = changes.ChangeConsumer(index, stream)
+    index.changes.catch_up()
+    assert index.version == start + 3 and all(index.get(i) for i in (600, 601, 602))
+
+    # una versión escrita sin evento (ej. un script) queda pendiente y se lee de la DB
+    with session_factory() as session:
+        prop = session.query(Property).filter(Property.external_id == 7).one()
+        prop.price, prop.version = 1.0, bump_version(session)
+        session.commit()
+    ingest_chunk(session_factory, [{"external_id": 603, "comuna": "c0", "lat": -33.4, "lon": -70.6}])
+    index.refresh()
+    assert index.get(603) is not None and index.get(7)["price"] != 1.0
+    index.resolve_gaps(timeout=0)
+    assert index.get(7)["price"] == 1.0 and not index._missing
+
+
+def test_late_event_does_not_overwrite_newer_row(session_factory, local_stream):
+    stream = local_stream()
+    index = PropertyIndex(session_factory, snapshot_dir=None)
+    index.changes = changes.ChangeConsumer(index, stream)
+    index.rebuild()
+    index.changes.catch_up()
+    index._session_factory = _no_db
+    base = index.version
+
+    # dos maestros publican fuera de orden: llega v+2 y después v+1, para la misma propiedad
+    changes.publish_upserts([dict(index.get(7), price=3.0)], base + 2)
+    index.refresh()
+    changes.publish_upserts([dict(index.get(7), price=2.0)], base + 1)
+    index.refresh()
+    assert index.get(7)["price"] == 3.0 and not index._missing
+
+    # en un mismo lote: un upsert atrasado no revive una propiedad borrada después
+    changes.publish_deletes([8], base + 4)
+    changes.publish_upserts([dict(index.get(8), price=5.0)], base + 3)
+    index.refresh()
+    assert index.get(8) is None and len(index) == 199
+
+
+def test_refresh_notices_unpublished_write_and_out_of_band_delete(session_factory, local_stream, monkeypatch):
+    stream = local_stream()
+    index = PropertyIndex(session_factory, snapshot_dir=None)
+    index.changes = changes.ChangeConsumer(index, stream)
+    index.rebuild()
+    index.changes.catch_up()
+
+    # falla la publicación de la última escritura: ningún evento posterior delata el hueco
+    def unavailable(entry):
+        raise ConnectionError("redis caído")
+    monkeypatch.setattr(stream, "add", unavailable)
+    ingest_chunk(session_factory, [{"external_id": 700, "comuna": "c0", "lat": -33.4, "lon": -70.6,
+                                    "price": 1000.0}])
+    index.refresh()
+    assert index.get(700) is None  # la DB se consulta a lo más cada GAP_TIMEOUT
+    index.check_db(interval=0)
+    index.resolve_gaps(timeout=0)
+    assert index.get(700) is not None and index._db_ahead is None
+
+    # borrado hecho fuera de la API: no avanza la versión, lo delata el conteo
+    with session_factory() as session:
+        session.query(Property).filter(Property.external_id == 5).delete()
+        session.commit()
+    index.check_db(interval=0)
+    assert index.get(5) is None and len(index) == 200
@@ -0,0 +1,41 @@
+from recommender_system import database
+
+
+def test_async_url_and_pool_options():
+    assert database.async_database_url("postgresql://u:p@db:5432/props") == \
+        "postgresql+asyncpg://u:p@db:5432/props"
+    assert database.async_database_url("postgresql+psycopg2://u:p@db/props") == \
+        "postgresql+asyncpg://u:p@db/props"
+    assert database.async_database_url("sqlite:///./recommender.db") == \
+        "sqlite+aiosqlite:///./recommender.db"
+    assert database.async_database_url("mysql://u:p@db/props") is None
+
+    assert set(database.engine_options("sqlite:///./x.db")) == {"pool_pre_ping"}
+    options = database.engine_options("postgresql://u:p@db/props")
+    assert options["pool_size"] == database.POOL_SIZE
+    assert options["max_overflow"] == database.MAX_OVERFLOW
+
+
+def test_catalog_version_row_is_seeded_once(tmp_path):
+    import pytest
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from recommender_system.feature_store import bump_version, current_version
+
+    engine = create_engine(f"sqlite:///{tmp_path}/seed.db", future=True)
+    database.Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, future=True)
+    with factory() as session:
+        # sin la fila, bump_version ya no la inserta (dos primeras escrituras chocarían)
+        with pytest.raises(RuntimeError):
+            bump_version(session)
+
+    database.seed_catalog_version(engine)
+    database.seed_catalog_version(engine)
+    with factory() as session:
+        assert current_version(session) == 0
+        assert bump_version(session) == 1
+        session.commit()
+    database.seed_catalog_version(engine)
+    with factory() as session:
+        assert current_version(session) == 1
@@ -0,0 +1,130 @@
+import queue
+import time
+from collections import defaultdict
+
+import redis
+from redis.client import PubSubWorkerThread
+
+from recommender_system import events
+
+
+class FlakyPubSub:
+    """PubSub falso cuya lectura falla `failures` veces (Redis caído) antes de entregar mensajes."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.handlers = {}
+        self.messages = queue.Queue()
+
+    def subscribe(self, **handlers):
+        self.handlers.update(handlers)
+
+    def run_in_thread(self, sleep_time, daemon, exception_handler):
+        thread = PubSubWorkerThread(self, sleep_time, daemon=daemon,
+                                    exception_handler=exception_handler)
+        thread.start()
+        return thread
+
+    def get_message(self, ignore_subscribe_messages, timeout):
+        if self.failures:
+            self.failures -= 1
+            raise redis.ConnectionError("Connection refused")
+        try:
+            channel, data = self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.handlers[channel]({"channel": channel.encode(), "data": data})
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    def __init__(self, refuse=0):
+        self.refuse = refuse
+        self.pubsubs = []
+
+    def pubsub(self, ignore_subscribe_messages):
+        if self.refuse:
+            self.refuse -= 1
+            raise redis.ConnectionError("Connection refused")
+        self.pubsubs.append(FlakyPubSub(failures=3))
+        return self.pubsubs[-1]
+
+
+def _until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def _isolate(monkeypatch, client):
+    monkeypatch.setattr(events, "_client", client)
+    monkeypatch.setattr(events, "_subscribers", defaultdict(list))
+    monkeypatch.setattr(events, "_listener", None)
+    monkeypatch.setattr(events, "_listening", frozenset())
+    monkeypatch.setattr(events, "_failures", 0)
+    monkeypatch.setattr(events, "RETRY_MAX", 0.01)
+
+
+def test_listener_survives_redis_errors_and_resubscribes_new_channels(monkeypatch):
+    client = FakeClient()
+    _isolate(monkeypatch, client)
+    received = []
+    events.subscribe("a", received.append)
+    first = events._listener
+    try:
+        client.pubsubs[0].messages.put(("a", '{"n": 1}'))
+        assert _until(lambda: received == [{"n": 1}])
+        assert first.is_alive()
+
+        # un canal nuevo se registra en un PubSub nuevo, no desde este hilo sobre el que se lee
+        events.subscribe("b", received.append)
+        assert len(client.pubsubs) == 2 and set(client.pubsubs[1].handlers) == {"a", "b"}
+        assert _until(lambda: not first.is_alive())
+        client.pubsubs[1].messages.put(("b", '{"n": 2}'))
+        assert _until(lambda: received[-1:] == [{"n": 2}])
+    finally:
+        events._listener.stop()
+
+
+def test_failed_subscription_is_retried(monkeypatch):
+    client = FakeClient(refuse=2)
+    _isolate(monkeypatch, client)
+    received = []
+    events.subscribe("a", received.append)
+    assert _until(lambda: events._listener is not None and events._listener.is_alive())
+    try:
+        client.pubsubs[-1].messages.put(("a", '{"n": 1}'))
+        assert _until(lambda: received == [{"n": 1}])
+    finally:
+        events._listener.stop()
+
+
+def test_invalidation_during_read_is_not_lost():
+    from recommender_system import recommendation_store as store
+    from recommender_system.database import SessionLocal, init_db
+
+    init_db()
+
+    class RacingSession:
+        """La escritura del worker (y su invalidación) ocurre justo después de la lectura."""
+
+        def __enter__(self):
+            self.session = SessionLocal()
+            return self
+
+        def __exit__(self, *exc):
+            self.session.close()
+
+        def execute(self, query):
+            result = self.session.execute(query)
+            store._on_invalidation({"user_ids": ["racing-user"]})
+            return result
+
+    store.cache.invalidate("racing-user")
+    assert store.get_user_recommendations("racing-user", session_factory=RacingSession) == []
+    assert store.cache.get("racing-user") is None
+    store.get_user_recommendations("racing-user")
+    assert store.cache.get("racing-user") == []
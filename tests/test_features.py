@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from recommender_system.models import Property
+from recommender_system.feature_store import load_properties
+from recommender_system.features import FeatureSpec, FeatureTransform, NormalizationStats, sql_transform
+from recommender_system.snapshot import PropertyColumns, load_columns
+from recommender_system.celery_config.knn_index import PropertyIndex
+
+
+@pytest.fixture()
+def session_factory(make_session_factory):
+    return make_session_factory(seed=5, columns=lambda i, rng: {
+        "bedrooms": None if i % 17 == 0 else rng.randint(0, 4),
+        "raw": {"m2": rng.uniform(30, 150)} if i % 5 else {},
+    })
+
+
+def test_spec_parsing():
+    spec = FeatureSpec.parse("lat, lon,price:0.5,comuna:2,raw.m2")
+    assert spec.numeric == ["lat", "lon", "price", "raw.m2"]
+    assert spec.comuna_weight == 2.0 and spec.raw_columns == ("raw.m2",)
+    assert spec.key() == "lat:1,lon:1,price:0.5,comuna:2,raw.m2:1"
+    for text in ("lat,superficie", "lat:0", ""):
+        with pytest.raises(ValueError):
+            FeatureSpec.parse(text)
+
+
+def test_streaming_stats_match_full_recompute():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal([-33.4, -70.6, 1e5], [0.05, 0.05, 3e4], size=(500, 3))
+    stats = NormalizationStats.from_matrix(matrix[:300])
+    stats.add(matrix[300:])
+    stats.remove(matrix[:100])
+    stats.add(matrix[:40])
+    expected = NormalizationStats.from_matrix(matrix[np.r_[0:40, 100:500]])
+    assert stats.count == expected.count == 440
+    assert np.allclose(stats.mean, expected.mean)
+    assert np.allclose(stats.std, expected.std)
+    assert stats.drift(expected) < 1e-9
+
+
+def test_sql_stats_match_columns(session_factory):
+    spec = FeatureSpec.parse("lat,price:2,bedrooms,price_per_bedroom")
+    with session_factory() as session:
+        from_sql = sql_transform(session, spec, nulls="mean")
+        columns = load_columns(session)
+        m2 = np.array([p.raw.get("m2", np.nan) for p in session.query(Property).order_by(Property.id)])
+        raw_sql = sql_transform(session, FeatureSpec.parse("raw.m2"), nulls="zero")
+    exact = FeatureTransform.fit(spec, columns, nulls="mean")
+    assert from_sql.stats.count == 200
+    assert np.allclose(from_sql.fill, exact.fill)
+    assert np.allclose(from_sql.stats.mean, exact.stats.mean)
+    assert np.allclose(from_sql.stats.std, exact.stats.std)
+    # campos de `raw` leídos desde el JSON en SQL (los ausentes cuentan como 0)
+    assert np.isclose(raw_sql.stats.mean[0], np.nan_to_num(m2).mean())
+    assert np.isclose(raw_sql.stats.std[0], np.nan_to_num(m2).std())
+
+
+def test_candidate_scale_does_not_depend_on_candidates(session_factory):
+    with session_factory() as session:
+        scaler = sql_transform(session)
+        props = load_properties(session)
+    origen = props[10]
+    small = PropertyIndex.from_properties([origen] + props[150:160], scaler)
+    large = PropertyIndex.from_properties([origen] + props[20:120], scaler)
+    assert np.allclose(small._scaled[0], large._scaled[0])
+    # sin escala global cada conjunto de candidatos movería al origen
+    assert not np.allclose(PropertyIndex.from_properties([origen] + props[150:160])._scaled[0],
+                           PropertyIndex.from_properties([origen] + props[20:120])._scaled[0])
+
+
+def test_weighted_index_with_comuna_and_streaming_stats(session_factory):
+    spec = FeatureSpec.parse("lat,lon,price:0.5,bedrooms:2,comuna:3")
+    index = PropertyIndex(session_factory, snapshot_dir=None, spec=spec)
+    index.refresh()
+    assert index._scaled.shape == (200, 4 + 4)
+
+    index.apply_changes([{"external_id": 7, "comuna": "c9", "lat": -33.4, "lon": -70.6,
+                          "bedrooms": 3, "price": 90000.0}])
+    index.remove([11])
+    with session_factory() as session:
+        props = [p for p in load_properties(session) if p["external_id"] not in (7, 11)]
+    props.append(index.get(7))
+    columns = PropertyColumns.from_properties(props)
+    # las estadísticas en streaming coinciden con recalcular sobre el catálogo actual
+    assert np.allclose(index.stats.std, FeatureTransform.fit(spec, columns).stats.std)
+
+    index.compact()
+    scaled = index._scaler.encode(columns)
+    for property_id in (7, 42, 150):
+        pos = next(i for i, p in enumerate(props) if p["external_id"] == property_id)
+        distances = np.linalg.norm(scaled - scaled[pos], axis=1)
+        expected = [props[i]["external_id"] for i in np.argsort(distances)[1:4]]
+        assert [p["external_id"] for p, _ in index.query(property_id, k=3)] == expected
+
+
+def test_cache_keys_follow_feature_config(monkeypatch):
+    from recommender_system import features, precompute
+    from recommender_system.candidates import POLICY
+    from recommender_system.celery_config import neighbors
+    from recommender_system.result_cache import ResultCache
+
+    def keys():
+        return ResultCache.key(3, POLICY, 7, "knn"), precompute.policy_key(POLICY, "knn")
+
+    seen = [keys()]
+    monkeypatch.setattr(features, "SPEC", FeatureSpec.parse("lat,lon,price:2"))
+    seen.append(keys())
+    monkeypatch.setattr(features, "NULL_FEATURES", "mean")
+    seen.append(keys())
+    # los backends exactos dan los mismos vecinos: comparten llave; el aproximado no
+    monkeypatch.setattr(neighbors, "NEIGHBOR_BACKEND", "brute")
+    assert keys() == seen[-1]
+    monkeypatch.setattr(neighbors, "NEIGHBOR_BACKEND", "ivf")
+    seen.append(keys())
+    for position in (0, 1):
+        assert len({key[position] for key in seen}) == len(seen)
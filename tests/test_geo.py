@@ -0,0 +1,25 @@
+import random
+
+from recommender_system import geo
+from recommender_system.celery_config.controllers import haversine
+
+
+def test_encode_known_geohash():
+    assert geo.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geo.encode(-33.45, -70.65).startswith(geo.encode(-33.45, -70.65, 5))
+
+
+def test_covering_prefixes_contain_every_point_in_radius():
+    rng = random.Random(2)
+    lat, lon, radius_km = -33.45, -70.65, 2.5
+    prefixes = geo.covering_prefixes(lat, lon, radius_km)
+    assert prefixes and len(prefixes) <= 9
+    for _ in range(2000):
+        p_lat = lat + rng.uniform(-0.05, 0.05)
+        p_lon = lon + rng.uniform(-0.05, 0.05)
+        if haversine(lat, lon, p_lat, p_lon) <= radius_km:
+            assert geo.encode(p_lat, p_lon).startswith(tuple(prefixes))
+
+
+def test_covering_prefixes_huge_radius_disables_prefilter():
+    assert geo.covering_prefixes(-33.45, -70.65, 20000) == []
@@ -0,0 +1,203 @@
+import os
+
+import numpy as np
+import pytest
+
+from recommender_system.models import Property
+from recommender_system.feature_store import bump_version
+from recommender_system.celery_config.knn_index import PropertyIndex, build_features
+from recommender_system.candidates import CandidatePolicy, select_candidates
+
+
+@pytest.fixture()
+def session_factory(make_session_factory):
+    return make_session_factory(seed=3)
+
+
+def _write(factory, external_id, **fields):
+    with factory() as session:
+        version = bump_version(session)
+        prop = session.query(Property).filter(
+            Property.external_id == external_id).one_or_none()
+        if prop is None:
+            prop = Property(external_id=external_id, bedrooms=2)
+        for name, value in fields.items():
+            setattr(prop, name, value)
+        prop.version = version
+        session.add(prop)
+        session.commit()
+
+
+def test_index_matches_per_task_knn(session_factory):
+    """Sin cambios pendientes, el índice devuelve lo mismo que ajustar un KNN por tarea."""
+    from sklearn.neighbors import NearestNeighbors
+    from sklearn.preprocessing import StandardScaler
+
+    index = PropertyIndex(session_factory)
+    index.refresh()
+    with session_factory() as session:
+        all_properties = [p.to_dict() for p in session.query(Property).all()]
+
+    scaled = StandardScaler().fit_transform(build_features(all_properties))
+    knn = NearestNeighbors(n_neighbors=4).fit(scaled)
+    for pos in (0, 57, 199):
+        distances, indices = knn.kneighbors(scaled[pos:pos + 1])
+        neighbors = index.query(all_properties[pos]["external_id"], k=3)
+        assert [p["external_id"] for p, _ in neighbors] == \
+            [all_properties[i]["external_id"] for i in indices[0][1:]]
+        assert np.allclose([d for _, d in neighbors], distances[0][1:])
+
+
+def test_index_respects_candidate_policy(session_factory):
+    index = PropertyIndex(session_factory)
+    index.refresh()
+    policy = CandidatePolicy(same_comuna=True, price_band=0.2)
+    for property_id in (3, 64, 150):
+        origen = index.get(property_id)
+        neighbors = index.query(property_id, k=3, policy=policy)
+        assert len(neighbors) == 3
+        assert all(policy.matches(origen, p) for p, _ in neighbors)
+
+    # el filtrado en SQL selecciona exactamente los mismos candidatos
+    with session_factory() as session:
+        origen, candidates = select_candidates(session, 64, policy)
+        everything = [p.to_dict() for p in session.query(Property).all()]
+    assert sorted(p["external_id"] for p in candidates) == sorted(
+        p["external_id"] for p in everything
+        if p["external_id"] != 64 and policy.matches(origen, p))
+
+
+@pytest.mark.parametrize("backend", ["brute", "ivf"])
+def test_index_backends_match_tree(session_factory, backend):
+    tree = PropertyIndex(session_factory, snapshot_dir=None, backend="tree")
+    other = PropertyIndex(session_factory, snapshot_dir=None, backend=backend)
+    tree.refresh()
+    other.refresh()
+    policy = CandidatePolicy(same_comuna=True, price_band=0.2)
+    ids = list(range(0, 200, 7))
+    for p in (None, policy):
+        expected = tree.query_many(ids, k=3, policy=p)
+        found = other.query_many(ids, k=3, policy=p)
+        # con 200 filas y nprobe=8 el IVF revisa más de la mitad de las listas
+        assert {i: [n["external_id"] for n, _ in v] for i, v in found.items()} == \
+            {i: [n["external_id"] for n, _ in v] for i, v in expected.items()}
+
+
+def test_null_features_are_filled_explicitly():
+    from recommender_system.snapshot import PropertyColumns
+
+    props = [{"external_id": 1, "lat": 1.0, "lon": None, "price": 100.0},
+             {"external_id": 2, "lat": 3.0, "lon": 2.0, "price": None}]
+    columns = PropertyColumns.from_properties(props)
+    assert columns.null_counts() == {"lat": 0, "lon": 1, "price": 1}
+    assert np.isnan(columns.raw_features()[0, 1])
+    assert columns.features().tolist() == [[1.0, 0.0, 100.0], [3.0, 2.0, 0.0]]
+    mean = columns.null_fill("mean")
+    assert columns.features(mean).tolist() == [[1.0, 2.0, 100.0], [3.0, 2.0, 100.0]]
+    # el delta usa el reemplazo del catálogo principal, no el de sus propias filas
+    assert build_features([{"external_id": 3, "lat": None, "lon": None, "price": None}], mean).tolist() == \
+        [[2.0, 2.0, 100.0]]
+    with pytest.raises(ValueError):
+        columns.null_fill("drop")
+
+
+def test_policy_levels_widen():
+    policy = CandidatePolicy(bedrooms_delta=1, price_band=0.1)
+    levels = policy.levels()
+    assert [(lv.bedrooms_delta, lv.price_band, lv.same_comuna) for lv in levels] == \
+        [(1, 0.1, True), (1, None, True), (None, None, True)]
+    assert policy.replace(allow_other_comunas=True).levels()[-1].unrestricted
+
+
+def test_index_incremental_updates_stay_exact(session_factory):
+    index = PropertyIndex(session_factory, rebuild_threshold=50)
+    index.refresh()
+    version = index.version
+
+    _write(session_factory, 10, price=99999.0, lat=-33.40, lon=-70.60)
+    _write(session_factory, 500, comuna="c1", lat=-33.41, lon=-70.61, price=100000.0)
+    index.refresh()
+    assert index.version > version
+    assert index.pending_changes == 3  # una fila muerta + dos en el delta
+    assert len(index) == 201
+
+    # comparar contra fuerza bruta usando el mismo escalador del índice
+    with session_factory() as session:
+        props = [p.to_dict() for p in session.query(Property).all()]
+    scaled = index._scaler.transform(build_features(props))
+    for property_id in (10, 500, 42):
+        pos = next(i for i, p in enumerate(props) if p["external_id"] == property_id)
+        distances = np.linalg.norm(scaled - scaled[pos], axis=1)
+        expected = [props[i]["external_id"] for i in np.argsort(distances)[1:4]]
+        assert [p["external_id"] for p, _ in index.query(property_id, k=3)] == expected
+
+
+def test_index_rebuilds_after_threshold(session_factory):
+    index = PropertyIndex(session_factory, rebuild_threshold=2)
+    index.refresh()
+    for external_id in (1, 2, 3):
+        _write(session_factory, external_id, price=1000.0 * external_id)
+    index.refresh()
+    assert index.pending_changes == 0
+    assert len(index) == 200
+    assert index.query(12345) is None
+
+
+def test_radius_policy_prefilters_by_geohash(session_factory):
+    from recommender_system import geo
+
+    with session_factory() as session:
+        geo.backfill_geohashes(session)
+        policy = CandidatePolicy(same_comuna=False, radius_km=3.0, min_candidates=1)
+        origen, candidates = select_candidates(session, 20, policy)
+    assert candidates
+    assert all(policy.matches(origen, p) for p in candidates)
+
+
+def test_older_snapshot_export_does_not_move_current_back(session_factory, tmp_path, monkeypatch):
+    from recommender_system import snapshot
+
+    directory = str(tmp_path / "snapshots")
+    with session_factory() as session:
+        old = snapshot.load_columns(session)
+    _write(session_factory, 10, price=99999.0)
+    with session_factory() as session:
+        new = snapshot.export_snapshot(session, directory)
+        # una exportación lenta que leyó el catálogo antes de la última escritura
+        monkeypatch.setattr(snapshot, "load_columns", lambda session: old)
+        snapshot.export_snapshot(session, directory)
+    assert old.version < new.version == snapshot.current_snapshot_version(directory)
+    assert snapshot.load_current(directory).version == new.version
+    assert sorted(name for name in os.listdir(directory) if name.startswith("v")) == \
+        [os.path.basename(snapshot._version_dir(directory, new.version))]
+
+
+def test_index_loads_snapshot_plus_delta(session_factory, tmp_path):
+    from recommender_system import snapshot
+
+    directory = str(tmp_path / "snapshots")
+    with session_factory() as session:
+        exported = snapshot.export_snapshot(session, directory)
+    loaded = snapshot.load_current(directory)
+    assert loaded.version == exported.version == snapshot.current_snapshot_version(directory)
+    assert isinstance(loaded.external_id, np.memmap)
+    assert [loaded.row(i) for i in (0, 199)] == [exported.row(i) for i in (0, 199)]
+
+    # cambios escritos después del snapshot: se leen desde la DB como delta
+    _write(session_factory, 10, price=99999.0, lat=-33.40, lon=-70.60)
+    _write(session_factory, 500, comuna="c1", lat=-33.41, lon=-70.61, price=100000.0)
+    from_snapshot = PropertyIndex(session_factory, snapshot_dir=directory)
+    from_snapshot.rebuild()
+    assert from_snapshot.pending_changes == 3
+    # la matriz escalada también se comparte: no se recalcula en cada proceso
+    assert isinstance(from_snapshot._scaled, np.memmap)
+    from_db = PropertyIndex(session_factory, snapshot_dir=None)
+    from_db.rebuild()
+    assert from_db.version == from_snapshot.version
+    assert len(from_db) == len(from_snapshot) == 201
+
+    policy = CandidatePolicy(same_comuna=True)
+    for property_id in (10, 500, 42):
+        assert [p["external_id"] for p, _ in from_snapshot.query(property_id, k=3, policy=policy)] == \
+            [p["external_id"] for p, _ in from_db.query(property_id, k=3, policy=policy)]
+    assert from_snapshot.get(500)["comuna"] == "c1"
@@ -0,0 +1,54 @@
+import io
+import json
+import logging
+
+from recommender_system import logs
+
+
+class _Expensive:
+    calls = 0
+
+    def __repr__(self):
+        _Expensive.calls += 1
+        return "x" * 5000
+
+
+def test_redaction_and_truncation():
+    headers = [(b"Authorization", b"Bearer secreto"), (b"cookie", b"session=1"),
+               (b"user-agent", b"pytest")]
+    assert logs.redact_headers(headers) == {
+        "authorization": logs.REDACTED, "cookie": logs.REDACTED, "user-agent": "pytest"}
+    assert logs.redact_headers({"X-Api-Key": "k"}) == {"x-api-key": logs.REDACTED}
+    assert logs.truncate("abcdef", 3) == "abc...(+3 chars)"
+    assert str(logs.Truncated([1, 2, 3], 4)) == "[1, ...(+5 chars)"
+
+
+def test_sampled_json_logging_through_queue(monkeypatch):
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    stream = io.StringIO()
+    monkeypatch.setattr(logs, "REQUEST_LOG_SAMPLE", 0.0)
+    try:
+        logs.setup_logging("INFO", stream=stream, fmt="json", force=True)
+        scope = {"method": "GET", "path": "/recommender/job/1", "query_string": b"timeout=5",
+                 "headers": [(b"authorization", b"Bearer secreto")]}
+        logs.log_request(scope, 200, 0.001)  # fuera de la muestra
+        logs.log_request(scope, 503, 0.001)  # los errores se registran siempre
+        logs.log_request(scope, 200, logs.SLOW_REQUEST)  # y las lentas también
+        # payload en DEBUG con el nivel en INFO: nunca se calcula su repr
+        logging.getLogger("demo").debug("payload: %s", logs.Truncated(_Expensive()))
+        logging.getLogger("demo").info("payload: %s", logs.Truncated(_Expensive(), 10))
+        logs.stop_logging()
+    finally:
+        logs.stop_logging()
+        root.handlers[:] = saved_handlers
+        root.setLevel(saved_level)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line.get("status") for line in lines] == [503, 200, None]
+    error = lines[0]
+    assert error["level"] == "ERROR" and error["logger"] == "recommender_system.access"
+    assert error["path"] == "/recommender/job/1" and error["query"] == "timeout=5"
+    assert "headers" not in error and "secreto" not in stream.getvalue()
+    assert lines[2]["message"] == "payload: xxxxxxxxxx...(+4990 chars)"
+    assert _Expensive.calls == 1
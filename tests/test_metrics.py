@@ -0,0 +1,30 @@
+from recommender_system import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry(enabled=True)
+    latency = registry.histogram("demo_seconds", "demo", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.labels("query").observe(value)
+    registry.counter("demo_total", "demo").inc(2)
+
+    text = registry.render()
+    assert 'demo_seconds_bucket{stage="query",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="query",le="1.0"} 3' in text
+    assert 'demo_seconds_bucket{stage="query",le="+Inf"} 4' in text
+    assert 'demo_seconds_count{stage="query"} 4' in text
+    assert "demo_total 2" in text
+
+    # las métricas publicadas por otro proceso se suman a las propias
+    merged = registry.render([registry.snapshot()])
+    assert 'demo_seconds_count{stage="query"} 8' in merged
+    assert "demo_total 4" in merged
+
+
+def test_disabled_registry_discards_observations():
+    registry = metrics.Registry(enabled=False)
+    counter = registry.counter("demo_total", "demo", ("kind",))
+    counter.labels("a").inc()
+    with registry.histogram("demo_seconds", "demo").labels().time():
+        pass
+    assert "demo_total{" not in registry.render()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from recommender_system.celery_config.neighbors import (
+    BruteForceSearcher, IVFSearcher, TreeSearcher, build_searcher)
+
+
+@pytest.fixture()
+def points():
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, 3)) * 3
+    return centers[rng.integers(0, 20, 5000)] + rng.normal(size=(5000, 3)) * 0.5
+
+
+def test_exact_backends_agree(points):
+    queries = points[:200]
+    expected_d, expected_i = TreeSearcher(points).query(queries, 5)
+    for searcher in (BruteForceSearcher(points), IVFSearcher(points, nprobe=10 ** 6)):
+        distances, indices = searcher.query(queries, 5)
+        assert np.allclose(distances, expected_d)
+        assert (indices == expected_i).all()
+    # k mayor que el número de filas devuelve todas
+    assert BruteForceSearcher(points[:3]).query(queries[:1], 10)[1].shape == (1, 3)
+    assert IVFSearcher(points[:3]).query(queries[:1], 10)[1].shape == (1, 3)
+    with pytest.raises(ValueError):
+        build_searcher(points, "annoy")
+
+
+def test_ivf_recall_grows_with_nprobe(points):
+    queries = points[:300]
+    _, exact = BruteForceSearcher(points).query(queries, 3)
+
+    def recall(nprobe):
+        _, found = IVFSearcher(points, n_lists=64, nprobe=nprobe).query(queries, 3)
+        return np.mean([len(set(a) & set(b)) / 3 for a, b in zip(exact, found)])
+
+    low, high = recall(1), recall(16)
+    assert low <= high
+    assert high > 0.95
+
+
+def test_ivf_batch_matches_single_queries(points):
+    searcher = IVFSearcher(points, n_lists=16, nprobe=3)
+    queries = points[::25]
+    distances, indices = searcher.query(queries, 4)
+    single = [searcher.query(query, 4) for query in queries]
+    assert np.allclose(distances, np.vstack([d for d, _ in single]))
+    assert (indices == np.vstack([i for _, i in single])).all()
+    # listas con menos filas que k: se revisan más hasta juntar k candidatos
+    tiny = IVFSearcher(points[:40], n_lists=20, nprobe=1)
+    assert (tiny.query(points[:40], 6)[1] >= 0).all()
+    assert np.allclose(tiny.query(points[:40], 6)[0], [tiny.query(p, 6)[0][0] for p in points[:40]])
@@ -0,0 +1,51 @@
+import pytest
+
+from recommender_system import precompute
+from recommender_system.models import Property
+from recommender_system.feature_store import bump_version
+from recommender_system.celery_config.knn_index import PropertyIndex
+from recommender_system.celery_config.tasks import (
+    POLICY, RANKING, build_neighbor_table, check_neighbor_table, recommend, refresh_neighbor_table)
+
+
+@pytest.fixture()
+def session_factory(make_session_factory):
+    return make_session_factory(seed=5)
+
+
+def test_table_matches_index_and_refreshes_incrementally(session_factory):
+    index = PropertyIndex(session_factory, snapshot_dir=None)
+    index.refresh()
+    report = build_neighbor_table(index, session_factory)
+    assert report["sources"] == 200
+    assert check_neighbor_table(index, sample=50, seed=1, session_factory=session_factory)["mismatched"] == 0
+
+    key = precompute.policy_key(POLICY, RANKING)
+    stored = precompute.lookup(42, key, session_factory)
+    assert [r["property"]["external_id"] for r in stored] == \
+        [r["property"]["external_id"] for r in recommend(index, [42])[42]]
+    assert precompute.lookup(12345, key, session_factory) is None
+
+    # la propiedad 10 se mueve junto a la 42 (misma comuna): entra en vecindarios ajenos
+    origin = index.get(42)
+    with session_factory() as session:
+        prop = session.query(Property).filter(Property.external_id == 10).one()
+        prop.lat, prop.lon, prop.price = origin["lat"] + 1e-5, origin["lon"], origin["price"]
+        prop.version = bump_version(session)
+        session.commit()
+    index.refresh()
+    assert check_neighbor_table(index, sample=200, session_factory=session_factory)["mismatched"] > 0
+
+    report = refresh_neighbor_table(index, [10], session_factory)
+    assert report["sources"] < 200
+    check = check_neighbor_table(index, sample=200, session_factory=session_factory)
+    assert check["mismatched"] == 0 and check["missing"] == 0
+
+
+def test_parallel_build_matches_serial(session_factory):
+    index = PropertyIndex(session_factory, snapshot_dir=None)
+    index.refresh()
+    report = build_neighbor_table(index, session_factory, chunk_size=30, workers=2)
+    assert report["sources"] == 200 and report["rows"] == 600
+    check = check_neighbor_table(index, sample=200, session_factory=session_factory)
+    assert check["mismatched"] == 0 and check["missing"] == 0
@@ -0,0 +1,30 @@
+import numpy as np
+
+from recommender_system.celery_config.controllers import haversine, haversine_np
+from recommender_system.ranking import format_recommendations
+
+
+def test_haversine_np_matches_scalar():
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(-34.0, -33.0, 500)
+    lon = rng.uniform(-71.0, -70.0, 500)
+    expected = [haversine(-33.45, -70.65, a, b) for a, b in zip(lat, lon)]
+    assert np.allclose(haversine_np(-33.45, -70.65, lat, lon), expected)
+    assert haversine_np(-33.45, -70.65, -33.45, -70.65) == 0
+
+
+def test_rerank_orders_by_geographic_and_price_score():
+    origen = {"external_id": 1, "lat": -33.45, "lon": -70.65, "price": 100000.0}
+    neighbors = [
+        ({"external_id": 2, "lat": -33.50, "lon": -70.65, "price": 100000.0}, 0.1),
+        ({"external_id": 3, "lat": -33.451, "lon": -70.65, "price": 100000.0}, 0.2),
+        ({"external_id": 4, "lat": -33.451, "lon": -70.65, "price": 300000.0}, 0.3),
+    ]
+    knn = format_recommendations(origen, neighbors, k=2, ranking="knn")
+    assert [r["property"]["external_id"] for r in knn] == [2, 3]
+
+    reranked = format_recommendations(origen, neighbors, k=2, ranking="rerank")
+    assert [r["property"]["external_id"] for r in reranked] == [3, 2]
+    assert reranked[0]["score"] <= reranked[1]["score"]
+    assert np.isclose(reranked[0]["distance_km"],
+                      haversine(-33.45, -70.65, -33.451, -70.65))
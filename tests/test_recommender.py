@@ -2,7 +2,7 @@ import pytest
 from fastapi.testclient import TestClient
 from recommender_system.recommender_master import app
 from recommender_system.database import SessionLocal, init_db
-from recommender_system.models import Property
+from recommender_system.models import Property, Recommendation
 from recommender_system.celery_config.tasks import compute_recommendations
 import time
 import os
@@ -26,6 +26,7 @@ def setup_database():
     # Limpiar la base de datos después de todos los tests
     with SessionLocal() as session:
         session.query(Property).delete()
+        session.query(Recommendation).delete()
         session.commit()
 
 
@@ -199,3 +200,394 @@ def test_recommendation_result():
     for i, rec in enumerate(result, 1):
         prop = rec["property"]
         print(f"{i}. ID: {prop['external_id']}, Comuna: {prop['comuna']}, Lat: {prop['lat']}, Lon: {prop['lon']}, Bedrooms: {prop['bedrooms']}, Price: {prop['price']}, Distance KM: {rec['distance_km']:.2f}, KNN Distance: {rec['knn_distance']:.4f}")
+
+
+def test_recommendation_by_reference():
+    """Probar que el worker resuelve las propiedades desde el feature store."""
+    # Usa las propiedades insertadas por test_recommendation_result
+    from recommender_system.recommender_master import build_job_kwargs
+
+    job_kwargs = build_job_kwargs("reference")
+    assert set(job_kwargs) == {"dataset_version"}
+    assert job_kwargs["dataset_version"] > 0
+
+    result = compute_recommendations(1, 3001, **job_kwargs)
+    assert isinstance(result, list)
+    assert 0 < len(result) <= 3
+    for rec in result:
+        assert rec["property"]["external_id"] != 3001
+        assert "raw" not in rec["property"]
+
+
+def test_batch_job():
+    """Probar el endpoint POST /recommender/jobs/batch y la tarea batch."""
+    from recommender_system.celery_config.tasks import compute_recommendations_batch
+
+    pairs = [{"user_id": "1", "property_id": 3001},
+             {"user_id": "2", "property_id": 3004},
+             {"user_id": "3", "property_id": 9999}]
+    response = client.post("/recommender/jobs/batch", json={"pairs": pairs})
+    assert response.status_code == 200
+    data = response.json()
+    assert "batch_id" in data
+    assert data["size"] == 3
+
+    response = client.post("/recommender/jobs/batch", json={"pairs": []})
+    assert response.status_code == 400
+
+    props_in_db = client.get("/recommender/properties").json()
+    batch = compute_recommendations_batch(pairs, all_properties=props_in_db)
+    indexed = compute_recommendations_batch(pairs)
+    for results in (batch["results"], indexed["results"]):
+        assert [r["property_id"] for r in results] == [3001, 3004, 9999]
+        assert results[2]["result"] == "error: property not found"
+    # cada par coincide con el cálculo individual
+    for pair, item in zip(pairs[:2], batch["results"]):
+        single = compute_recommendations(
+            pair["user_id"], pair["property_id"], all_properties=props_in_db)
+        assert [r["property"]["external_id"] for r in item["result"]] == \
+            [r["property"]["external_id"] for r in single]
+
+
+def test_user_recommendations_endpoint():
+    """Probar que los resultados quedan guardados y se leen por usuario."""
+    user_id = "user-recs"
+    response = client.get(f"/recommender/users/{user_id}/recommendations")
+    assert response.status_code == 200
+    assert response.json() == []  # queda en caché vacío
+
+    first = compute_recommendations(user_id, 3001)
+    second = compute_recommendations(user_id, 3002)
+    assert isinstance(first, list) and first
+    assert isinstance(second, list) and second
+
+    # la escritura del worker invalida el caché del usuario
+    response = client.get(f"/recommender/users/{user_id}/recommendations")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == len(first) + len(second)
+    # primero el job más reciente
+    assert [r["source_property_id"] for r in data] == \
+        [3002] * len(second) + [3001] * len(first)
+    assert [r["property_id"] for r in data[:len(second)]] == \
+        [r["property"]["external_id"] for r in second]
+
+    response = client.get(
+        f"/recommender/users/{user_id}/recommendations", params={"limit": 1})
+    assert [r["source_property_id"] for r in response.json()] == [3002]
+
+    response = client.get(
+        f"/recommender/users/{user_id}/recommendations", params={"limit": 0})
+    assert response.status_code == 400
+
+
+def test_recommendation_from_sql_candidates():
+    """Probar el camino que filtra candidatos en SQL (índice deshabilitado)."""
+    from recommender_system.celery_config.tasks import recommend_from_db
+
+    result = recommend_from_db(3001)
+    assert [r["property"]["external_id"] for r in result] == [3002]
+    assert recommend_from_db(9999) == "error: property not found"
+
+
+def test_create_job_served_from_result_cache():
+    """Un resultado ya calculado para la versión actual se responde sin encolar."""
+    from recommender_system.recommender_master import build_job_kwargs
+
+    expected = compute_recommendations(
+        "cache-user", 3001, **build_job_kwargs("reference"))
+    response = client.post("/recommender/job/cache-user-2/3001")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["cached"] is True and data["status"] == "SUCCESS"
+    job = client.get(f"/recommender/job/{data['task_id']}").json()
+    assert job["ready"] and job["result"] == expected
+    recs = client.get("/recommender/users/cache-user-2/recommendations").json()
+    assert [r["property_id"] for r in recs] == \
+        [r["property"]["external_id"] for r in expected]
+
+    # cualquier escritura avanza la versión del catálogo: ya no hay acierto
+    client.post("/recommender/properties/notify", json={
+        "external_id": 3001, "comuna": None, "lat": None, "lon": None, "bedrooms": None, "price": None})
+    response = client.post("/recommender/job/cache-user-2/3001")
+    assert "cached" not in response.json()
+
+
+def test_create_job_priority_routes_to_queue():
+    from recommender_system.celery_app import BULK_QUEUE, INTERACTIVE_QUEUE, queue_depths
+
+    before = queue_depths()
+    response = client.post("/recommender/job/backfill/424242", params={"priority": "low"})
+    assert response.status_code == 200
+    after = queue_depths()
+    assert after[BULK_QUEUE] == before[BULK_QUEUE] + 1
+    assert after[INTERACTIVE_QUEUE] == before[INTERACTIVE_QUEUE]
+
+    response = client.post("/recommender/job/backfill/424242", params={"priority": "urgent"})
+    assert response.status_code == 400
+    assert f'recommender_queue_depth{{queue="{BULK_QUEUE}"}}' in \
+        client.get("/recommender/metrics").text
+
+
+def test_properties_near():
+    """Probar el endpoint GET /recommender/properties/near."""
+    response = client.get("/recommender/properties/near",
+                          params={"lat": -33.45, "lon": -70.65, "radius_km": 2})
+    assert response.status_code == 200
+    data = response.json()
+    # 3001 está en el punto y 3002 a ~1.4 km; el resto a más de 5 km
+    assert [p["external_id"] for p in data] == [3001, 3002]
+    assert data[0]["distance_km"] <= data[1]["distance_km"] <= 2
+
+    response = client.get("/recommender/properties/near",
+                          params={"lat": -33.45, "lon": -70.65, "radius_km": 50, "limit": 4})
+    assert len(response.json()) == 4
+
+    response = client.get("/recommender/properties/near",
+                          params={"lat": -33.45, "lon": -70.65, "radius_km": 0})
+    assert response.status_code == 400
+
+
+def test_bulk_properties():
+    """Probar el endpoint POST /recommender/properties/bulk (JSON y NDJSON)."""
+    import json
+
+    items = [
+        {"external_id": 4001, "comuna": "Oeste", "lat": -33.5, "lon": -70.8,
+         "bedrooms": "3 dormitorios", "price": 80000.0, "raw": {"a": 1}},
+        {"external_id": 4002, "comuna": "Oeste", "lat": -33.51, "lon": -70.81,
+         "bedrooms": 2, "price": 85000.0},
+        {"comuna": "sin id"},
+        {"external_id": "abc", "comuna": "Oeste"},
+        {"external_id": 4004, "lat": "norte", "lon": -70.8},
+        {"external_id": 4005, "price": [1]},
+    ]
+    response = client.post("/recommender/properties/bulk", json=items)
+    assert response.status_code == 200
+    assert response.json() == {"created": 2, "updated": 0, "skipped": 4, "chunks": 1}
+
+    # actualización parcial por NDJSON: sólo se pisan los campos con valor
+    body = "\n".join(json.dumps(item) for item in [
+        {"external_id": 4001, "price": 90000.0},
+        {"external_id": 4003, "comuna": "Oeste", "lat": -33.52, "lon": -70.82},
+    ]) + "\n"
+    response = client.post("/recommender/properties/bulk", content=body,
+                           headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.json()["created"] == 1
+    assert response.json()["updated"] == 1
+
+    # strings numéricos se convierten, como en /properties/notify
+    response = client.post("/recommender/properties/bulk",
+                           json=[{"external_id": "4002", "price": "86000"}])
+    assert response.json()["updated"] == 1
+
+    with SessionLocal() as session:
+        assert session.query(Property).filter(
+            Property.external_id == 4002).one().price == 86000.0
+        assert session.query(Property).filter(
+            Property.external_id.in_([4004, 4005])).count() == 0
+        prop = session.query(Property).filter(
+            Property.external_id == 4001).one()
+        assert prop.price == 90000.0
+        assert prop.bedrooms == 3
+        assert prop.comuna == "Oeste"
+        assert prop.raw == {"a": 1}
+        assert prop.geohash is not None
+
+    response = client.post("/recommender/properties/bulk", json={"no": "list"})
+    assert response.status_code == 400
+    response = client.post("/recommender/properties/bulk", content="{oops",
+                           headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 400
+
+    with SessionLocal() as session:
+        session.query(Property).filter(
+            Property.external_id.in_([4001, 4002, 4003])).delete()
+        session.commit()
+
+
+def test_bulk_partial_coordinates_update_geohash():
+    from recommender_system import geo
+
+    client.post("/recommender/properties/bulk",
+                json=[{"external_id": 4201, "lat": -33.45, "lon": -70.65}])
+    client.post("/recommender/properties/bulk", json=[{"external_id": 4201, "lat": -20.0}])
+    client.post("/recommender/properties/bulk", json=[{"external_id": 4201, "lon": -69.0}])
+    with SessionLocal() as session:
+        prop = session.query(Property).filter(Property.external_id == 4201).one()
+        assert (prop.lat, prop.lon) == (-20.0, -69.0)
+        assert prop.geohash == geo.encode(-20.0, -69.0)
+        session.delete(prop)
+        session.commit()
+
+
+def test_bulk_failure_still_refreshes_committed_chunks(monkeypatch):
+    from recommender_system import ingest, precompute, recommender_master
+
+    real_chunk = ingest.ingest_chunk
+
+    def failing_chunk(session_factory, items):
+        if items[0]["external_id"] == 4102:
+            raise RuntimeError("db down")
+        return real_chunk(session_factory, items)
+
+    enqueued = []
+    monkeypatch.setattr(ingest, "ingest_chunk", failing_chunk)
+    monkeypatch.setattr(precompute, "PRECOMPUTE_ENABLED", True)
+    monkeypatch.setattr(recommender_master.precompute_neighbors, "apply_async",
+                        lambda *args, **kwargs: enqueued.append("precompute"))
+    monkeypatch.setattr(recommender_master, "CHUNK_SIZE", 2)
+
+    items = [{"external_id": 4100 + i, "lat": -33.5, "lon": -70.8} for i in range(4)]
+    response = client.post("/recommender/properties/bulk", json=items)
+    assert response.status_code == 500
+    assert enqueued == ["precompute"]
+
+    with SessionLocal() as session:
+        assert session.query(Property).filter(
+            Property.external_id.in_([4100, 4101])).delete() == 2
+        session.commit()
+
+
+def test_get_properties_pagination_and_stream():
+    """Probar paginación por keyset, proyección y modo NDJSON de GET /properties."""
+    import json
+
+    response = client.get("/recommender/properties",
+                          params={"limit": 4, "fields": "external_id,price"})
+    assert response.status_code == 200
+    first = response.json()
+    assert len(first) == 4
+    assert set(first[0]) == {"external_id", "price"}
+    after_id = response.headers["X-Next-After-Id"]
+
+    response = client.get("/recommender/properties",
+                          params={"limit": 4, "after_id": after_id})
+    second = response.json()
+    assert "X-Next-After-Id" not in response.headers
+    assert all(p["id"] > int(after_id) for p in second)
+    assert len(first) + len(second) == len(client.get("/recommender/properties").json())
+
+    response = client.get("/recommender/properties",
+                          params={"format": "ndjson", "fields": "id,external_id"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    streamed = [json.loads(line) for line in response.text.splitlines()]
+    assert [p["id"] for p in streamed] == sorted(p["id"] for p in streamed)
+    assert {p["external_id"] for p in streamed} == \
+        {p["external_id"] for p in first + second}
+
+    assert client.get("/recommender/properties",
+                      params={"fields": "password"}).status_code == 400
+
+
+def test_get_properties_without_pagination_returns_everything(monkeypatch):
+    from recommender_system import recommender_master
+
+    monkeypatch.setattr(recommender_master, "PROPERTIES_PAGE_SIZE", 2)
+    total = len(client.get("/recommender/properties",
+                           params={"format": "ndjson"}).text.splitlines())
+    assert total > 2
+    response = client.get("/recommender/properties")
+    assert len(response.json()) == total
+    assert "X-Next-After-Id" not in response.headers
+
+    response = client.get("/recommender/properties", params={"after_id": 0})
+    assert len(response.json()) == 2
+    assert "X-Next-After-Id" in response.headers
+
+
+def test_create_job_served_from_precomputed_neighbors(monkeypatch):
+    from recommender_system import precompute
+    from recommender_system.celery_config.tasks import POLICY, RANKING, precompute_neighbors
+
+    report = precompute_neighbors()
+    assert report["status"] == "precomputed" and report["sources"] > 0
+    expected = precompute.lookup(3001, precompute.policy_key(POLICY, RANKING))
+    assert expected
+
+    monkeypatch.setattr(precompute, "PRECOMPUTE_ENABLED", True)
+    data = client.post("/recommender/job/precomputed-user/3001").json()
+    assert data["cached"] is True
+    assert client.get(f"/recommender/job/{data['task_id']}").json()["result"] == expected
+
+
+def test_metrics_endpoint():
+    client.get("/recommender/heartbeat")
+    compute_recommendations.apply(args=["metrics-user", 999999])
+
+    response = client.get("/recommender/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'route="/recommender/heartbeat"' in text
+    assert 'recommender_task_duration_seconds_count{task="recommender_system.celery_config.tasks.compute_recommendations",state="SUCCESS"}' in text
+    assert 'recommender_stage_duration_seconds_count{stage="query"}' in text
+
+
+def test_wait_job_returns_on_completion_notice():
+    import threading
+    from uuid import uuid4
+    from recommender_system import events, jobs
+    from recommender_system.celery_app import app as celery_app
+
+    notices = []
+    events.subscribe(jobs.JOBS_CHANNEL, notices.append)
+    compute_recommendations.apply(args=["notify-user", 999999])
+    assert notices and notices[-1]["status"] == "SUCCESS"
+
+    def finish(task_id, delay):
+        time.sleep(delay)
+        celery_app.backend.store_result(task_id, [], "SUCCESS")
+        jobs.notify_done(task_id, "SUCCESS")
+
+    task_id = str(uuid4())
+    threading.Thread(target=finish, args=(task_id, 0.3)).start()
+    start = time.perf_counter()
+    job = client.get(f"/recommender/job/{task_id}/wait", params={"timeout": 10}).json()
+    assert job["ready"] and job["status"] == "SUCCESS"
+    assert time.perf_counter() - start < 5
+    assert jobs.waiters.pending() == 0
+
+    # sin aviso se responde al vencer el plazo con el estado vigente
+    pending = client.get(f"/recommender/job/{uuid4()}/wait", params={"timeout": 0.1}).json()
+    assert pending["ready"] is False and pending["status"] == "PENDING"
+
+    task_id = str(uuid4())
+    threading.Thread(target=finish, args=(task_id, 0.3)).start()
+    response = client.get(f"/recommender/job/{task_id}/events", params={"timeout": 10})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert [line for line in response.text.splitlines() if line.startswith("event:")] == \
+        ["event: status", "event: done"]
+    timed_out = client.get(f"/recommender/job/{uuid4()}/events", params={"timeout": 0.1}).text
+    assert "event: timeout" in timed_out
+
+
+def test_job_events_notice_completion_without_notification(monkeypatch):
+    import threading
+    from uuid import uuid4
+    from recommender_system import jobs
+    from recommender_system.celery_app import app as celery_app
+
+    def finish_silently(task_id, delay):
+        # el aviso se perdió (ej. publicado mientras el suscriptor se reconectaba)
+        time.sleep(delay)
+        celery_app.backend.store_result(task_id, [], "SUCCESS")
+
+    # se relee en cada keepalive
+    monkeypatch.setattr(jobs, "SSE_KEEPALIVE", 0.1)
+    task_id = str(uuid4())
+    threading.Thread(target=finish_silently, args=(task_id, 0.3)).start()
+    start = time.perf_counter()
+    text = client.get(f"/recommender/job/{task_id}/events", params={"timeout": 10}).text
+    assert [line for line in text.splitlines() if line.startswith("event:")] == \
+        ["event: status", "event: done"]
+    assert time.perf_counter() - start < 5
+
+    # y una vez más al vencer el plazo
+    monkeypatch.setattr(jobs, "SSE_KEEPALIVE", 60.0)
+    task_id = str(uuid4())
+    threading.Thread(target=finish_silently, args=(task_id, 0.1)).start()
+    text = client.get(f"/recommender/job/{task_id}/events", params={"timeout": 0.5}).text
+    assert "event: done" in text and "event: timeout" not in text
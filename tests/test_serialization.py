@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+import numpy as np
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads
+
+from recommender_system import serialization
+
+
+def _properties(n):
+    return [
+        {"id": i, "external_id": 1000 + i, "comuna": ["Ñuñoa", "Providencia", None][i % 3],
+         "lat": -33.45 - i * 1e-4, "lon": -70.6 + i * 1e-4,
+         "bedrooms": None if i % 5 == 0 else i % 4, "price": 1500.5 + i}
+        for i in range(n)
+    ]
+
+
+def test_round_trip_keeps_values_types_and_order():
+    results = [
+        {"user_id": i, "property_id": i,
+         "result": [{"property": p, "distance_km": 1.5, "knn_distance": np.float64(0.25)}
+                    for p in _properties(3)]}
+        for i in range(10)
+    ]
+    results[4]["result"] = "Property not found"
+    payload = ([], {"mode": "inline", "properties": _properties(50), "flag": True},
+               {"callbacks": None, "date": datetime(2024, 1, 2, tzinfo=timezone.utc)})
+
+    decoded = serialization.loads(serialization.dumps({"args": payload, "batch": results}))
+
+    assert decoded["args"][1]["properties"] == _properties(50)
+    assert decoded["args"][1]["flag"] is True
+    assert decoded["args"][2]["date"] == datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert decoded["batch"][4]["result"] == "Property not found"
+    assert decoded["batch"][0]["result"][0]["knn_distance"] == 0.25
+    assert decoded["batch"] == results
+    # claves en el mismo orden que el original
+    assert list(decoded["args"][1]["properties"][0]) == list(_properties(1)[0])
+
+
+def test_columnar_is_smaller_than_json_and_compresses(monkeypatch):
+    serialization.register_serializer()
+    monkeypatch.setattr(serialization, "COMPRESS_MIN", -1)
+    body = {"properties": _properties(2000)}
+    _, _, as_json = kombu_dumps(body, serializer="json")
+    _, content_encoding, packed = kombu_dumps(body, serializer=serialization.NAME)
+    assert content_encoding == "binary"
+    assert len(packed) < len(as_json) / 2
+
+    monkeypatch.setattr(serialization, "COMPRESS_MIN", 0)
+    compressed = serialization.dumps(body)
+    assert compressed[:4] == b"RCSz"
+    assert len(compressed) < len(packed)
+    assert kombu_loads(compressed, serialization.CONTENT_TYPE, "binary",
+                       accept=[serialization.CONTENT_TYPE]) == body
+
+
+def test_mixed_numeric_columns_keep_ints_exact():
+    mixed = [1, 2.5] * 20
+    decoded = serialization.loads(serialization.dumps(mixed))
+    assert decoded == mixed
+    assert [type(v) for v in decoded] == [type(v) for v in mixed]
+
+    big = [2 ** 53 + 1, 0.5] * 10 + [2 ** 62] * 4
+    assert serialization.loads(serialization.dumps(big)) == big
+    assert serialization.loads(serialization.dumps([2 ** 62 + 1] * 10)) == [2 ** 62 + 1] * 10
+
+
+def test_user_dicts_with_reserved_key_round_trip():
+    values = [{"__rcs__": 1},
+              {"__rcs__": {"raw": [1] * 10}, "n": 3},
+              {"rows": [{"__rcs__": i, "x": [i] * 10} for i in range(10)]}]
+    for value in values:
+        assert serialization.loads(serialization.dumps(value)) == value